@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+# Measures the SDK against the stand-in server in thematic.mock_server, so changes to the client
+# can be compared before they are rolled out. The server runs in its own process, and so does
+# every benchmark, so that the peak memory reported is the client's alone.
+#
+#   python benchmarks/run_benchmarks.py
+#   python benchmarks/run_benchmarks.py --sizes 10 100 500 --jobs 1 8 32 128 --json results.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thematic import Thematic, Metrics, PipelineExecutor, Chain, Step  # noqa: E402
+
+EXAMPLE_CSV = os.path.join(ROOT, "example", "input.csv")
+MB = 1024 * 1024
+
+
+def scaled_csv(directory, size_mb):
+    # example/input.csv repeated until the file is size_mb long
+    path = os.path.join(directory, "input_{}mb.csv".format(size_mb))
+    if os.path.exists(path):
+        return path
+    with open(EXAMPLE_CSV, "rb") as f:
+        data = f.read()
+    if not data.endswith(b"\n"):
+        data += b"\r\n"
+    with open(path, "wb") as f:
+        written = 0
+        while written < size_mb * MB:
+            written += f.write(data)
+    return path
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (MB if sys.platform == "darwin" else 1024.0)
+
+
+def wait_for(client, job_id):
+    client.wait_for_job_completion(job_id)
+    return job_id
+
+
+def bench_upload(url, csv_filename, compress=False):
+    client = Thematic(url, "key", compress_uploads=compress)
+    survey_id = client.create_survey("benchmark", 1, [0], False)["survey_id"]
+    size = os.path.getsize(csv_filename)
+    start = time.time()
+    client.run_job(survey_id, csv_filename)
+    seconds = time.time() - start
+    return {"seconds": seconds, "mb_per_second": size / MB / seconds}
+
+
+def bench_download(url, csv_filename, mode="path"):
+    client = Thematic(url, "key")
+    survey_id = client.create_survey("benchmark", 1, [0], False)["survey_id"]
+    job_id = wait_for(client, client.run_job(survey_id, csv_filename))
+    out_dir = tempfile.mkdtemp(prefix="thematic-bench-")
+    try:
+        start = time.time()
+        if mode == "path":
+            client.retrieve_csv(job_id, path=os.path.join(out_dir, "out.csv"))
+            size = os.path.getsize(os.path.join(out_dir, "out.csv"))
+        elif mode == "file":
+            with open(os.path.join(out_dir, "out.csv"), "wb") as f:
+                client.retrieve_csv(job_id, file_obj=f)
+            size = os.path.getsize(os.path.join(out_dir, "out.csv"))
+        else:
+            size = len(client.retrieve_csv(job_id))
+        seconds = time.time() - start
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return {"seconds": seconds, "mb_per_second": size / MB / seconds}
+
+
+def bench_polling(url, csv_filename, num_jobs, job_seconds, grouped=True):
+    # how many requests waiting costs, and how long after a job ends the client notices
+    metrics = Metrics()
+    client = Thematic(url, "key", metrics=metrics)
+    survey_id = client.create_survey("benchmark", 1, [0], False)["survey_id"]
+    job_ids = [client.run_job(survey_id, csv_filename) for _ in range(num_jobs)]
+    metrics.reset()
+    start = time.time()
+    if grouped:
+        client.wait_for_jobs(job_ids, survey_id=survey_id)
+    else:
+        for job_id in job_ids:
+            client.wait_for_job_completion(job_id)
+    seconds = time.time() - start
+    return {
+        "seconds": seconds,
+        "overshoot_seconds": max(0.0, seconds - job_seconds),
+        "requests": metrics.counter("requests"),
+        "requests_per_job": metrics.counter("requests") / float(num_jobs),
+    }
+
+
+def bench_scaling(url, csv_filename, num_jobs, max_jobs):
+    # submits, waits for and downloads num_jobs jobs through the pipeline executor
+    metrics = Metrics()
+    client = Thematic(url, "key", metrics=metrics, pool_maxsize=max(10, max_jobs))
+    survey_ids = [client.create_survey("benchmark {}".format(i), 1, [0], False)["survey_id"] for i in range(num_jobs)]
+    chains = [Chain(survey_id, [Step("run_job", survey_id=survey_id, csv_filename=csv_filename)], survey_id=survey_id) for survey_id in survey_ids]
+    start = time.time()
+    results = PipelineExecutor(client, max_workers=min(16, max_jobs), max_jobs=max_jobs).run(chains)
+    for result in results.values():
+        client.retrieve_csv(result["job_id"])
+    seconds = time.time() - start
+    return {"seconds": seconds, "jobs_per_second": num_jobs / seconds, "requests": metrics.counter("requests")}
+
+
+BENCHMARKS = {
+    "upload": bench_upload,
+    "download": bench_download,
+    "polling": bench_polling,
+    "scaling": bench_scaling,
+}
+
+
+def run_one(name, kwargs):
+    # runs in the child process
+    baseline = peak_rss_mb()
+    result = BENCHMARKS[name](**kwargs)
+    result["peak_rss_mb"] = peak_rss_mb()
+    result["rss_growth_mb"] = result["peak_rss_mb"] - baseline
+    return result
+
+
+def spawn(name, kwargs):
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--run", name, json.dumps(kwargs)])
+    return json.loads(out.decode("utf-8").strip().splitlines()[-1])
+
+
+def start_server(args):
+    command = [
+        sys.executable,
+        "-m",
+        "thematic.mock_server",
+        "--port",
+        "0",
+        "--queue-seconds",
+        str(args.queue_seconds),
+        "--processing-seconds",
+        str(args.processing_seconds),
+        "--latency",
+        str(args.latency),
+        "--error-rate",
+        str(args.error_rate),
+        "--throttle-rate",
+        str(args.throttle_rate),
+    ]
+    server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE)
+    line = server.stdout.readline().decode("utf-8")
+    return server, line.strip().rsplit(" ", 1)[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Thematic SDK against a local mock server")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100], help="sizes of the uploaded csv in MB")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 8, 32], help="numbers of concurrent jobs")
+    parser.add_argument("--max-jobs", type=int, default=20, help="jobs in flight at once when scaling")
+    parser.add_argument("--queue-seconds", type=float, default=0.5)
+    parser.add_argument("--processing-seconds", type=float, default=1.5)
+    parser.add_argument("--latency", type=float, default=0.0, help="added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--run", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_one(args.run[0], json.loads(args.run[1]))))
+        return
+
+    only = set(args.only or BENCHMARKS)
+    job_seconds = args.queue_seconds + args.processing_seconds
+    data_dir = tempfile.mkdtemp(prefix="thematic-bench-")
+    server, url = start_server(args)
+    results = []
+
+    def record(name, params, result):
+        results.append({"benchmark": name, "params": params, "result": result})
+        print(
+            "{:<10} {:<40} {}".format(
+                name,
+                " ".join("{}={}".format(k, v) for k, v in sorted(params.items())),
+                "  ".join("{}={:.2f}".format(k, v) for k, v in sorted(result.items())),
+            ),
+            flush=True,
+        )
+
+    try:
+        small_csv = EXAMPLE_CSV
+        for size in args.sizes:
+            csv_filename = scaled_csv(data_dir, size)
+            if "upload" in only:
+                for compress in (False, True):
+                    record("upload", {"mb": size, "compress": compress}, spawn("upload", {"url": url, "csv_filename": csv_filename, "compress": compress}))
+            if "download" in only:
+                for mode in ("bytes", "file", "path"):
+                    record("download", {"mb": size, "mode": mode}, spawn("download", {"url": url, "csv_filename": csv_filename, "mode": mode}))
+        for num_jobs in args.jobs:
+            if "polling" in only:
+                for grouped in (False, True):
+                    params = {"jobs": num_jobs, "grouped": grouped}
+                    record("polling", params, spawn("polling", {"url": url, "csv_filename": small_csv, "num_jobs": num_jobs, "job_seconds": job_seconds, "grouped": grouped}))
+            if "scaling" in only:
+                params = {"jobs": num_jobs, "max_jobs": args.max_jobs}
+                record("scaling", params, spawn("scaling", {"url": url, "csv_filename": small_csv, "num_jobs": num_jobs, "max_jobs": args.max_jobs}))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 
+import os
 import sys
 import json
-import ConfigParser
+import configparser
 
 sys.path.append('..')
 from thematic.thematic import Thematic
@@ -9,20 +10,20 @@ from thematic.thematic import Thematic
 
 
 def main():
-    cfg = ConfigParser.ConfigParser()
+    cfg = configparser.ConfigParser()
     cfg.read('config.ini')
 
     # Login to the thematic service
     server_url = cfg.get('server', 'base_url')
     username = cfg.get('server', 'username')
     password = cfg.get('server', 'password')
-    thematic_instance = Thematic( server_url, username, password )
+    thematic_instance = Thematic.FromLogin( server_url, username, password )
 
     # Create a survey
     survey_name = cfg.get('survey', 'name')
-    total_columns = cfg.get('survey', 'total_columns')
+    total_columns = cfg.getint('survey', 'total_columns')
     columns = json.loads(cfg.get('survey', 'columns')) 
-    has_header = cfg.get('survey', 'has_header')
+    has_header = cfg.getboolean('survey', 'has_header')
 
     survey_info = thematic_instance.create_survey(survey_name,
                                     total_columns,
@@ -39,22 +40,21 @@ def main():
     # Wait for the survey to finish
     thematic_instance.wait_for_job_completion( job_id )
 
-    # Download the results
-    results = thematic_instance.retrieve_results( job_id )
-    if not results:
-        raise Exception ("Failed to retrieve results")
-
-    # Save the results to disk
+    # Download the results to disk
+    if not os.path.isdir("data_out"):
+        os.makedirs("data_out")
     base_filename, extension = os.path.splitext(os.path.basename(filename))
     csv_filename = os.path.join("data_out/",base_filename+"_output.csv")
     themes_filename = os.path.join("data_out/",base_filename+"_themes.json")
-    with open( csv_filename, "w" ) as f:
-        f.write( results['csv'] )
-    with open( themes_filename, "w" ) as f:
-        f.write( results['themes'] )
+    if not thematic_instance.retrieve_csv( job_id, path=csv_filename ):
+        raise Exception ("Failed to retrieve results")
+    with open( themes_filename, "wb" ) as f:
+        if not thematic_instance.retrieve_themes( job_id, file_obj=f ):
+            raise Exception ("Failed to retrieve themes")
 
     # Please note, this example does not include the tweaking of parameters, concepts or themes
     # These are required to get the most of the service and are described in the SDK documentation
+    # To run many surveys at once, see thematic-batch (thematic/cli.py), which reads files like config.ini
 
 
 if __name__ == "__main__": main()
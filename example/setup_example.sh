@@ -1,5 +1,5 @@
 #!/bin/bash
-virtualenv --no-site-packages --distribute example
+python3 -m venv example
 source example/bin/activate
 
 pip install -r ../requirements.txt
@@ -7,4 +7,4 @@ pip install -r ../requirements.txt
 echo ''
 echo ''
 echo 'Please run `source example/bin/activate` to activate the virtual environment for this example'
-echo 'You may then run python run_example.py to run the example'
\ No newline at end of file
+echo 'You may then run python3 run_example.py to run the example'
\ No newline at end of file
@@ -9,9 +9,17 @@ setuptools.setup(
     url='http://getthematic.com/',
     description = '',
     packages=setuptools.find_packages(),
+    python_requires=">=3.7",
     package_data = {},
     install_requires=[
         "requests>=2.18",
         "requests[security]"
-    ]
+    ],
+    extras_require={
+        "async": ["aiohttp>=3.7"],
+        "arrow": ["pyarrow>=1.0"],
+    },
+    entry_points={
+        "console_scripts": ["thematic-batch = thematic.cli:main"],
+    }
 )
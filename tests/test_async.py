@@ -0,0 +1,48 @@
+import os
+import time
+import asyncio
+
+import pytest
+
+from thematic import Thematic, RetryPolicy
+from thematic.mock_server import MockServer
+
+pytest.importorskip("aiohttp")
+
+from thematic.async_thematic import AsyncThematic  # noqa: E402
+
+EXAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example", "input.csv")
+
+
+def test_a_request_waiting_to_retry_doesnt_hold_a_slot():
+    async def scenario(server):
+        async with AsyncThematic(server.url, "key", max_concurrency=1, retry_policy=RetryPolicy(max_retries=1, max_retry_after=3)) as client:
+            throttled = asyncio.ensure_future(client.list_jobs(survey_id="survey"))
+            await asyncio.sleep(0.5)
+            server.throttle_rate = 0.0
+            start = time.time()
+            await client.list_jobs(survey_id="survey")
+            elapsed = time.time() - start
+            assert not throttled.done()
+            await throttled
+            return elapsed
+
+    with MockServer(throttle_rate=1.0, retry_after=3) as server:
+        assert asyncio.run(scenario(server)) < 1.5
+
+
+def test_outputs_are_written_to_a_real_file(tmp_path):
+    async def scenario(url, job_id, path):
+        async with AsyncThematic(url, "key") as client:
+            with open(path, "wb") as f:
+                return await client.retrieve_csv(job_id, file_obj=f)
+
+    with MockServer(queue_seconds=0.01, processing_seconds=0.01) as server:
+        thematic = Thematic(server.url, "key")
+        survey_id = thematic.create_survey("s", 1, [[{"index": 0, "name": "Comment"}]], False)["survey_id"]
+        job_id = thematic.run_job(survey_id, EXAMPLE_CSV)
+        thematic.wait_for_job_completion(job_id)
+        path = str(tmp_path / "results.csv")
+        assert asyncio.run(scenario(server.url, job_id, path)) is True
+        with open(path, "rb") as f:
+            assert f.read() == thematic.retrieve_csv(job_id)
@@ -0,0 +1,43 @@
+import os
+import zipfile
+
+import pytest
+
+from thematic import Thematic
+from thematic.mock_server import MockServer
+
+EXAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example", "input.csv")
+
+
+@pytest.fixture
+def finished_job():
+    with MockServer(queue_seconds=0.01, processing_seconds=0.01) as server:
+        thematic = Thematic(server.url, "key")
+        survey_id = thematic.create_survey("s", 1, [[{"index": 0, "name": "Comment"}]], False)["survey_id"]
+        job_id = thematic.run_job(survey_id, EXAMPLE_CSV)
+        thematic.wait_for_job_completion(job_id)
+        yield thematic, job_id
+
+
+def test_a_missing_job_doesnt_stop_the_others_being_published(finished_job, tmp_path):
+    thematic, job_id = finished_job
+    dest = str(tmp_path / "bundle")
+    saved = thematic.retrieve_bundle([job_id, "nonexistent"], dest, outputs=["csv", "themes", "parameters"])
+    assert saved == {job_id: {"csv": "results.csv", "themes": "themes.json", "parameters": "parameters.json"}, "nonexistent": {}}
+    assert sorted(os.listdir(os.path.join(dest, job_id))) == ["parameters.json", "results.csv", "themes.json"]
+    assert os.listdir(os.path.join(dest, "nonexistent")) == []
+
+
+def test_an_output_that_raises_is_left_out(finished_job, tmp_path, monkeypatch):
+    thematic, job_id = finished_job
+
+    def broken(job_id, file_obj=None):
+        file_obj.write(b"partial")
+        raise Exception("retrieve_themes: connection lost")
+
+    monkeypatch.setattr(thematic, "retrieve_themes", broken)
+    dest = str(tmp_path / "bundle.zip")
+    saved = thematic.retrieve_bundle(job_id, dest, outputs=["csv", "themes"])
+    assert saved == {job_id: {"csv": "results.csv"}}
+    with zipfile.ZipFile(dest) as archive:
+        assert archive.namelist() == ["results.csv"]
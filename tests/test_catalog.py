@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from thematic import Thematic, JobCatalog
+from thematic.mock_server import MockServer
+
+EXAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example", "input.csv")
+
+
+class CountingThematic(Thematic):
+    list_jobs_calls = 0
+
+    def list_jobs(self, survey_id=None, job_type=None):
+        self.list_jobs_calls += 1
+        return Thematic.list_jobs(self, survey_id=survey_id, job_type=job_type)
+
+
+@pytest.fixture
+def setup():
+    with MockServer(queue_seconds=0.01, processing_seconds=0.01) as server:
+        thematic = CountingThematic(server.url, "key")
+        survey_id = thematic.create_survey("s", 1, [[{"index": 0, "name": "Comment"}]], False)["survey_id"]
+        yield server, thematic, survey_id
+
+
+def test_sync_lists_a_survey_again_only_once_max_age_has_passed(setup, tmp_path):
+    server, thematic, survey_id = setup
+    thematic.wait_for_job_completion(thematic.run_job(survey_id, EXAMPLE_CSV))
+    catalog = JobCatalog(thematic, str(tmp_path / "catalog.sqlite"), max_age=3600)
+    assert catalog.sync(survey_id) == 1
+    assert thematic.list_jobs_calls == 1
+
+    thematic.wait_for_job_completion(thematic.run_job(survey_id, EXAMPLE_CSV))
+    assert catalog.sync(survey_id) == 0
+    assert len(catalog.jobs(survey_id)) == 1
+    assert thematic.list_jobs_calls == 1
+
+    assert catalog.sync(survey_id, force=True) == 1
+    assert len(catalog.jobs(survey_id)) == 2
+    assert thematic.list_jobs_calls == 2
+
+    # a catalog whose listings are always stale lists every time, and only counts what changed
+    stale = JobCatalog(thematic, str(tmp_path / "catalog.sqlite"), max_age=0)
+    assert stale.sync(survey_id) == 0
+    assert thematic.list_jobs_calls == 3
+
+
+def test_ancestors_and_descendants_follow_a_branched_chain(setup, tmp_path):
+    server, thematic, survey_id = setup
+    root = thematic.run_job(survey_id, EXAMPLE_CSV)
+    thematic.wait_for_job_completion(root)
+    left = thematic.configure_parameters({"min_freq": 2}, root)
+    right = thematic.configure_parameters({"min_freq": 3}, root)
+    thematic.wait_for_job_completion(left)
+    leaf = thematic.configure_parameters({"min_freq": 4}, left)
+    thematic.wait_for_jobs([right, leaf])
+
+    catalog = JobCatalog(thematic, str(tmp_path / "catalog.sqlite"))
+    catalog.sync(survey_id)
+    assert [job["job_id"] for job in catalog.ancestors(leaf)] == [leaf, left, root]
+    assert [job["job_id"] for job in catalog.ancestors(right)] == [right, root]
+    assert [job["job_id"] for job in catalog.descendants(root)] == [left, right]
+    assert [job["job_id"] for job in catalog.descendants(left)] == [leaf]
+    assert catalog.descendants(leaf) == []
@@ -0,0 +1,23 @@
+import os
+
+from thematic import cli
+from thematic.mock_server import MockServer
+
+EXAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example", "input.csv")
+
+
+def test_a_survey_that_fails_to_set_up_doesnt_stop_the_others(tmp_path, capsys):
+    with MockServer(queue_seconds=0.01, processing_seconds=0.01) as server:
+        manifest = tmp_path / "manifest.ini"
+        manifest.write_text(
+            "[server]\nbase_url = {}\napi_key = key\n"
+            "[DEFAULT]\ntotal_columns = 1\ncolumns = [[{{\"index\": 0, \"name\": \"Comment\"}}]]\nfilename = {}\n"
+            "[survey good]\n"
+            "[survey missing]\nsurvey_id = no-such-survey\n".format(server.url, EXAMPLE_CSV)
+        )
+        assert cli.main([str(manifest), "--progress-interval", "60"]) == 1
+
+    summary = dict(line.split("\t", 1) for line in capsys.readouterr().out.splitlines())
+    assert summary["good"].endswith("\tok")
+    assert "survey setup failed" in summary["missing"]
+    assert sorted(os.listdir(str(tmp_path / "data_out" / "good"))) == ["results.csv", "themes.json"]
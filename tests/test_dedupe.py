@@ -0,0 +1,116 @@
+import os
+import csv
+import io
+
+import pytest
+
+from thematic import Thematic
+from thematic.mock_server import MockServer
+
+
+@pytest.fixture
+def client(tmp_path):
+    with MockServer(queue_seconds=0.01, processing_seconds=0.01) as server:
+        yield server, Thematic(server.url, "key", duplicate_map_dir=str(tmp_path / "duplicates"))
+
+
+def write_csv(path, rows):
+    with io.open(path, "w", encoding="utf-8", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+
+def test_collapses_on_survey_columns_despite_differing_ids(client, tmp_path):
+    server, thematic = client
+    survey_id = thematic.create_survey("s", 2, [[{"index": 1, "name": "Comment"}]], True)["survey_id"]
+    filename = str(tmp_path / "input.csv")
+    rows = [["id", "comment"], ["1", "great"], ["2", "slow"], ["3", "great"], ["4", "great"], ["5", "slow"]]
+    write_csv(filename, rows)
+
+    job_id = thematic.run_job(survey_id, filename, collapse_duplicates=True)
+    with open(server.jobs[job_id]["files"]["csv_file"], newline="", encoding="utf-8") as f:
+        uploaded = list(csv.reader(f))
+    assert uploaded == [["id", "comment"], ["1", "great"], ["2", "slow"]]
+
+    thematic.wait_for_job_completion(job_id)
+    results = list(csv.reader(io.StringIO(thematic.retrieve_csv(job_id).decode("utf-8"), newline="")))
+    assert [row[:2] for row in results] == rows
+
+
+def test_expanding_refuses_a_changed_original(client, tmp_path):
+    server, thematic = client
+    survey_id = thematic.create_survey("s", 2, [[{"index": 1, "name": "Comment"}]], False)["survey_id"]
+    filename = str(tmp_path / "input.csv")
+    write_csv(filename, [["1", "great"], ["2", "great"], ["3", "slow"]])
+    job_id = thematic.run_job(survey_id, filename, collapse_duplicates=True)
+    thematic.wait_for_job_completion(job_id)
+
+    write_csv(filename, [["3", "slow"], ["1", "great"], ["2", "great"]])
+    with pytest.raises(Exception, match="has changed"):
+        thematic.retrieve_csv(job_id, path=str(tmp_path / "out.csv"))
+    assert not os.path.exists(str(tmp_path / "out.csv"))
+
+
+def test_expanding_accepts_an_original_that_was_only_touched(client, tmp_path):
+    server, thematic = client
+    survey_id = thematic.create_survey("s", 2, [[{"index": 1, "name": "Comment"}]], False)["survey_id"]
+    filename = str(tmp_path / "input.csv")
+    write_csv(filename, [["1", "great"], ["2", "great"]])
+    job_id = thematic.run_job(survey_id, filename, collapse_duplicates=True)
+    thematic.wait_for_job_completion(job_id)
+
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert thematic.retrieve_csv(job_id, path=str(tmp_path / "out.csv"))
+    with open(str(tmp_path / "out.csv"), newline="", encoding="utf-8") as f:
+        assert [row[:2] for row in csv.reader(f)] == [["1", "great"], ["2", "great"]]
+
+
+def test_a_missing_map_raises_rather_than_returning_collapsed_rows(client, tmp_path):
+    server, thematic = client
+    survey_id = thematic.create_survey("s", 2, [[{"index": 1, "name": "Comment"}]], False)["survey_id"]
+    filename = str(tmp_path / "input.csv")
+    write_csv(filename, [["1", "great"], ["2", "great"]])
+    job_id = thematic.run_job(survey_id, filename, collapse_duplicates=True)
+    thematic.wait_for_job_completion(job_id)
+
+    for name in os.listdir(thematic.duplicate_map_dir):
+        if name.startswith(job_id):
+            os.remove(os.path.join(thematic.duplicate_map_dir, name))
+    with pytest.raises(Exception, match="duplicate map of job {} is missing".format(job_id)):
+        thematic.retrieve_csv(job_id)
+
+
+def test_configured_jobs_share_the_map_of_the_job_they_build_on(client, tmp_path):
+    server, thematic = client
+    survey_id = thematic.create_survey("s", 2, [[{"index": 1, "name": "Comment"}]], False)["survey_id"]
+    filename = str(tmp_path / "input.csv")
+    rows = [["1", "great"], ["2", "great"], ["3", "slow"]]
+    write_csv(filename, rows)
+    job_id = thematic.run_job(survey_id, filename, collapse_duplicates=True)
+    thematic.wait_for_job_completion(job_id)
+
+    themes = tmp_path / "themes.json"
+    themes.write_bytes(thematic.retrieve_themes(job_id))
+    themes_job_id = thematic.configure_themes(str(themes), job_id)
+    params_job_id = thematic.configure_parameters({"min_freq": 2}, themes_job_id)
+    thematic.wait_for_job_completion(params_job_id)
+    results = list(csv.reader(io.StringIO(thematic.retrieve_csv(params_job_id).decode("utf-8"), newline="")))
+    assert [row[:2] for row in results] == rows
+
+
+def test_the_full_results_of_an_update_to_a_collapsed_job_are_refused(client, tmp_path):
+    server, thematic = client
+    survey_id = thematic.create_survey("s", 2, [[{"index": 1, "name": "Comment"}]], False)["survey_id"]
+    filename = str(tmp_path / "input.csv")
+    write_csv(filename, [["1", "great"], ["2", "great"]])
+    job_id = thematic.run_job(survey_id, filename, collapse_duplicates=True)
+    thematic.wait_for_job_completion(job_id)
+
+    update = str(tmp_path / "update.csv")
+    write_csv(update, [["3", "slow"], ["4", "slow"]])
+    update_job_id = thematic.run_incremental_update(survey_id, update, job_id, collapse_duplicates=True)
+    thematic.wait_for_job_completion(update_job_id)
+    with pytest.raises(Exception, match="adds or deletes rows of job {}".format(job_id)):
+        thematic.retrieve_csv(update_job_id)
+    results = list(csv.reader(io.StringIO(thematic.retrieve_incremental_csv(update_job_id).decode("utf-8"), newline="")))
+    assert [row[:2] for row in results] == [["3", "slow"], ["4", "slow"]]
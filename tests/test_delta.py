@@ -0,0 +1,92 @@
+import csv
+import io
+
+import pytest
+
+from thematic import Thematic, DeltaSync
+from thematic.mock_server import MockServer
+
+
+@pytest.fixture
+def setup(tmp_path):
+    with MockServer(queue_seconds=0.01, processing_seconds=0.01) as server:
+        thematic = Thematic(server.url, "key")
+        survey_id = thematic.create_survey("s", 2, [[{"index": 1, "name": "Comment"}]], False)["survey_id"]
+        yield server, thematic, survey_id, DeltaSync(thematic, str(tmp_path / "index"))
+
+
+def write_csv(path, rows):
+    with io.open(path, "w", encoding="utf-8", newline="") as f:
+        csv.writer(f).writerows(rows)
+    return path
+
+
+def uploaded(server, job_id):
+    with io.open(server.jobs[job_id]["files"]["csv_file"], encoding="utf-8", newline="") as f:
+        return sorted(csv.reader(f))
+
+
+def test_fewer_copies_of_a_row_deletes_it_and_adds_the_rest_back(setup, tmp_path):
+    server, thematic, survey_id, delta_sync = setup
+    first = write_csv(str(tmp_path / "first.csv"), [["1", "same"]] * 3 + [["2", "kept"]])
+    job_id = thematic.run_job(survey_id, first)
+    thematic.wait_for_job_completion(job_id)
+    delta_sync.seed(survey_id, first, job_id)
+
+    second = write_csv(str(tmp_path / "second.csv"), [["1", "same"]] * 2 + [["2", "kept"], ["3", "new"]])
+    result = delta_sync.sync(survey_id, second, ["0"])
+    assert (result["added"], result["removed"]) == (3, 1)
+
+    incremental_job = server.jobs[result["job_id"]]
+    assert uploaded(server, result["job_id"]) == [["1", "same"], ["1", "same"], ["3", "new"]]
+    assert uploaded(server, incremental_job["previous_job_id"]) == [["1", "same"]]
+
+    # the index now matches the second export, so nothing is sent again
+    assert delta_sync.sync(survey_id, second, ["0"]) == {"job_id": result["job_id"], "added": 0, "removed": 0}
+
+
+def test_a_failed_job_leaves_its_rows_to_be_sent_again(setup, tmp_path):
+    server, thematic, survey_id, delta_sync = setup
+    first = write_csv(str(tmp_path / "first.csv"), [["1", "a"]])
+    job_id = thematic.run_job(survey_id, first)
+    thematic.wait_for_job_completion(job_id)
+    delta_sync.seed(survey_id, first, job_id)
+
+    second = write_csv(str(tmp_path / "second.csv"), [["1", "a"], ["2", "b"]])
+    server.job_error_rate = 1.0
+    with pytest.raises(Exception, match="errored"):
+        delta_sync.sync(survey_id, second, ["0"])
+
+    server.job_error_rate = 0.0
+    result = delta_sync.sync(survey_id, second, ["0"])
+    assert result["added"] == 1
+    assert server.jobs[result["job_id"]]["previous_job_id"] == job_id
+    assert uploaded(server, result["job_id"]) == [["2", "b"]]
+
+
+def test_rows_sharing_a_deleted_key_are_added_again(setup, tmp_path):
+    server, thematic, survey_id, delta_sync = setup
+    first = write_csv(str(tmp_path / "first.csv"), [["1", "a"], ["1", "b"], ["2", "c"]])
+    job_id = thematic.run_job(survey_id, first)
+    thematic.wait_for_job_completion(job_id)
+    delta_sync.seed(survey_id, first, job_id)
+
+    # deleting ["1", "a"] by its key also deletes ["1", "b"] on the server, so it has to be sent again
+    second = write_csv(str(tmp_path / "second.csv"), [["1", "b"], ["2", "c"]])
+    result = delta_sync.sync(survey_id, second, [0])
+    assert (result["added"], result["removed"]) == (1, 1)
+    assert uploaded(server, server.jobs[result["job_id"]]["previous_job_id"]) == [["1", "a"]]
+    assert uploaded(server, result["job_id"]) == [["1", "b"]]
+    assert delta_sync.sync(survey_id, second, [0]) == {"job_id": result["job_id"], "added": 0, "removed": 0}
+
+
+def test_disambiguation_columns_can_be_named_in_the_header(setup, tmp_path):
+    server, thematic, survey_id, delta_sync = setup
+    first = write_csv(str(tmp_path / "first.csv"), [["id", "comment"], ["1", "a"], ["1", "b"]])
+    job_id = thematic.run_job(survey_id, first)
+    thematic.wait_for_job_completion(job_id)
+    delta_sync.seed(survey_id, first, job_id, has_header=True)
+
+    second = write_csv(str(tmp_path / "second.csv"), [["id", "comment"], ["1", "b"]])
+    result = delta_sync.sync(survey_id, second, ["id"])
+    assert uploaded(server, result["job_id"]) == [["1", "b"], ["id", "comment"]]
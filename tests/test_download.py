@@ -0,0 +1,150 @@
+import os
+import json
+
+import pytest
+import requests
+
+from thematic import Thematic
+from thematic.download import Downloader
+from thematic.mock_server import MockServer
+
+EXAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example", "input.csv")
+HEADERS = {"X-API-Authentication": "key"}
+
+
+def finished_job(server):
+    thematic = Thematic(server.url, "key")
+    survey_id = thematic.create_survey("s", 1, [[{"index": 0, "name": "Comment"}]], False)["survey_id"]
+    job_id = thematic.run_job(survey_id, EXAMPLE_CSV)
+    thematic.wait_for_job_completion(job_id)
+    return server.jobs[job_id], server.url + "/job/" + job_id + "/artifacts/"
+
+
+@pytest.fixture
+def server():
+    with MockServer(queue_seconds=0.01, processing_seconds=0.01, artifact_bytes=256 * 1024) as server:
+        yield server
+
+
+@pytest.fixture
+def session():
+    with requests.Session() as session:
+        yield session
+
+
+class Recorder(object):
+    # a request function that notes the headers sent, and can cut a response off after limit bytes
+    def __init__(self, session, limit=None):
+        self.session = session
+        self.limit = limit
+        self.headers = []
+
+    def __call__(self, method, url, headers=None, stream=True):
+        self.headers.append(headers)
+        r = self.session.request(method, url, headers=headers, stream=stream)
+        return r if self.limit is None else _Truncated(r, self.limit)
+
+
+class _Truncated(object):
+    def __init__(self, r, limit):
+        self.r = r
+        self.limit = limit
+
+    def __getattr__(self, name):
+        return getattr(self.r, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.r.close()
+
+    def iter_content(self, chunk_size):
+        sent = 0
+        for chunk in self.r.iter_content(chunk_size=chunk_size):
+            if sent + len(chunk) > self.limit:
+                yield chunk[: self.limit - sent]
+                raise requests.ConnectionError("connection reset")
+            sent += len(chunk)
+            yield chunk
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def change_output(server, job):
+    path = server.output_path(job, "artifacts")
+    with open(path + ".new", "wb") as f:
+        f.write(os.urandom(300 * 1024))
+    os.replace(path + ".new", path)
+    return read(path)
+
+
+def test_a_truncated_download_resumes_from_where_it_stopped(server, session, tmp_path):
+    job, url = finished_job(server)
+    path = str(tmp_path / "artifacts.bin")
+    with pytest.raises(requests.ConnectionError):
+        Downloader(Recorder(session, limit=100000), chunk_size=16 * 1024).to_path(url, HEADERS, path)
+    assert os.path.getsize(path + ".part") == 100000
+    validator = json.loads(read(path + ".part.json"))["validator"]
+
+    recorder = Recorder(session)
+    assert Downloader(recorder, chunk_size=16 * 1024).to_path(url, HEADERS, path)
+    assert recorder.headers[0]["Range"] == "bytes=100000-"
+    assert recorder.headers[0]["If-Range"] == validator
+    assert read(path) == read(server.output_path(job, "artifacts"))
+    assert not os.path.exists(path + ".part") and not os.path.exists(path + ".part.json")
+
+
+def test_a_changed_etag_restarts_a_single_stream_download(server, session, tmp_path):
+    job, url = finished_job(server)
+    path = str(tmp_path / "artifacts.bin")
+    with pytest.raises(requests.ConnectionError):
+        Downloader(Recorder(session, limit=100000), chunk_size=16 * 1024).to_path(url, HEADERS, path)
+    content = change_output(server, job)
+
+    recorder = Recorder(session)
+    assert Downloader(recorder, chunk_size=16 * 1024).to_path(url, HEADERS, path)
+    assert "If-Range" in recorder.headers[0]
+    assert read(path) == content
+
+
+def test_a_changed_etag_restarts_a_segmented_download(server, session, tmp_path):
+    job, url = finished_job(server)
+    path = str(tmp_path / "artifacts.bin")
+    downloader = Downloader(Recorder(session, limit=20000), chunk_size=4096, segments=4, min_segment_size=32 * 1024)
+    with pytest.raises(requests.ConnectionError):
+        downloader.to_path(url, HEADERS, path)
+    assert json.loads(read(path + ".part.json"))["segments"]
+    content = change_output(server, job)
+
+    assert Downloader(Recorder(session), chunk_size=4096, segments=4, min_segment_size=32 * 1024).to_path(url, HEADERS, path)
+    assert read(path) == content
+
+
+def test_a_server_that_ignores_ranges_gets_the_whole_file(session, tmp_path):
+    with MockServer(queue_seconds=0.01, processing_seconds=0.01, artifact_bytes=256 * 1024, ranges=False) as server:
+        job, url = finished_job(server)
+        path = str(tmp_path / "artifacts.bin")
+        assert Downloader(Recorder(session), chunk_size=4096, segments=4, min_segment_size=32 * 1024).to_path(url, HEADERS, path)
+        assert read(path) == read(server.output_path(job, "artifacts"))
+
+        # a part file can't be resumed from a server that answers with the whole file, so it is replaced
+        with pytest.raises(requests.ConnectionError):
+            Downloader(Recorder(session, limit=100000), chunk_size=16 * 1024).to_path(url, HEADERS, path)
+        assert Downloader(Recorder(session), chunk_size=16 * 1024).to_path(url, HEADERS, path)
+        assert read(path) == read(server.output_path(job, "artifacts"))
+
+
+def test_a_segmented_download_matches_a_single_stream(server, session, tmp_path):
+    job, url = finished_job(server)
+    recorder = Recorder(session)
+    segmented = str(tmp_path / "segmented.bin")
+    assert Downloader(recorder, chunk_size=4096, segments=4, min_segment_size=32 * 1024).to_path(url, HEADERS, segmented)
+    assert len([headers for headers in recorder.headers if "Range" in headers]) == 5
+
+    single = str(tmp_path / "single.bin")
+    assert Downloader(Recorder(session), min_segment_size=1024 * 1024).to_path(url, HEADERS, single)
+    assert read(segmented) == read(single) == Downloader(Recorder(session)).to_bytes(url, HEADERS)
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from thematic import Thematic, JobJournal
+from thematic.mock_server import MockServer
+
+EXAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example", "input.csv")
+
+
+class CrashingThematic(Thematic):
+    # makes the job, then dies before the journal hears its id back
+    def run_job(self, survey_id, csv_filename, **kwargs):
+        Thematic.run_job(self, survey_id, csv_filename, **kwargs)
+        raise KeyboardInterrupt()
+
+
+@pytest.fixture
+def setup(tmp_path):
+    with MockServer(queue_seconds=0.01, processing_seconds=0.01) as server:
+        thematic = Thematic(server.url, "key")
+        survey_id = thematic.create_survey("s", 1, [[{"index": 0, "name": "Comment"}]], False)["survey_id"]
+        # a job from long before, which mustn't be mistaken for the one that was lost
+        old_job_id = thematic.run_job(survey_id, EXAMPLE_CSV)
+        server.jobs[old_job_id]["created"] -= 3600
+        yield server, survey_id, str(tmp_path / "jobs.sqlite")
+
+
+def crash(server, path, survey_id):
+    # the id of the job made by a submission that died
+    before = set(server.jobs)
+    with pytest.raises(KeyboardInterrupt):
+        JobJournal(CrashingThematic(server.url, "key"), path).run(survey_id, "run_job", csv_filename=EXAMPLE_CSV)
+    (job_id,) = set(server.jobs) - before
+    return job_id
+
+
+def test_a_job_made_before_a_crash_is_found_instead_of_submitted_again(setup):
+    server, survey_id, path = setup
+    lost_job_id = crash(server, path, survey_id)
+    # the server's clock runs behind, by less than clock_skew
+    server.jobs[lost_job_id]["created"] -= 100
+
+    journal = JobJournal(Thematic(server.url, "key"), path)
+    assert journal.run(survey_id, "run_job", csv_filename=EXAMPLE_CSV) == lost_job_id
+    assert len(server.jobs) == 2
+    # the journal now has the job's id, so it isn't looked for again
+    journal.clock_skew = 0
+    assert journal.run(survey_id, "run_job", csv_filename=EXAMPLE_CSV) == lost_job_id
+    assert len(server.jobs) == 2
+
+
+def test_a_job_from_further_back_than_clock_skew_isnt_claimed(setup):
+    server, survey_id, path = setup
+    lost_job_id = crash(server, path, survey_id)
+    server.jobs[lost_job_id]["created"] -= 100
+
+    journal = JobJournal(Thematic(server.url, "key"), path)
+    journal.clock_skew = 10
+    assert journal.run(survey_id, "run_job", csv_filename=EXAMPLE_CSV) != lost_job_id
+    assert len(server.jobs) == 3
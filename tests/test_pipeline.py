@@ -0,0 +1,99 @@
+import os
+import json
+
+import pytest
+
+from thematic import Thematic, PipelineExecutor, Chain, Step
+from thematic.mock_server import MockServer
+
+EXAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example", "input.csv")
+
+
+class FlakyThematic(Thematic):
+    # fails the first upload_failures calls to run_job before they reach the server
+    upload_failures = 0
+
+    def run_job(self, *args, **kwargs):
+        if self.upload_failures:
+            self.upload_failures -= 1
+            raise Exception("run_job: connection reset")
+        return Thematic.run_job(self, *args, **kwargs)
+
+
+@pytest.fixture
+def setup():
+    with MockServer(queue_seconds=0.2, processing_seconds=0.2) as server:
+        thematic = FlakyThematic(server.url, "key")
+        survey_id = thematic.create_survey("s", 1, [[{"index": 0, "name": "Comment"}]], False)["survey_id"]
+        yield server, thematic, survey_id
+
+
+def chain(survey_id):
+    steps = [Step("run_job", survey_id=survey_id, csv_filename=EXAMPLE_CSV), Step("configure_parameters", parameters={"min_freq": 2})]
+    return Chain("survey", steps, survey_id=survey_id)
+
+
+def states(state_dir):
+    found = []
+    for name in os.listdir(state_dir):
+        if name.endswith(".json"):
+            with open(os.path.join(state_dir, name)) as f:
+                found.extend(record.get("state") for record in json.load(f)["steps"])
+    return found
+
+
+def test_a_killed_run_reattaches_to_its_submitted_job(setup, tmp_path):
+    server, thematic, survey_id = setup
+    state_dir = str(tmp_path / "state")
+    executor = PipelineExecutor(thematic, state_dir=state_dir, check_continue=lambda: "submitted" not in states(state_dir))
+    with pytest.raises(Exception, match="Interrupted"):
+        executor.run([chain(survey_id)])
+    assert len(server.jobs) == 1
+    job_id = list(server.jobs)[0]
+
+    result = PipelineExecutor(thematic, state_dir=state_dir).run([chain(survey_id)])["survey"]
+    assert result["error"] is None
+    assert result["jobs"][0] == job_id
+    assert len(server.jobs) == 2
+    assert server.jobs[result["job_id"]]["previous_job_id"] == job_id
+
+
+def test_a_restart_reattaches_to_jobs_in_the_saved_state(setup, tmp_path):
+    server, thematic, survey_id = setup
+    state_dir = str(tmp_path / "state")
+    executor = PipelineExecutor(thematic, state_dir=state_dir)
+    job_id = thematic.run_job(survey_id, EXAMPLE_CSV)
+    # the state a run leaves behind when it stops after submitting the first step
+    records = [{"signature": step.signature()} for step in chain(survey_id).steps]
+    records[0].update({"job_id": job_id, "state": "submitted"})
+    with open(executor._state_path(chain(survey_id)), "w") as f:
+        json.dump({"key": "survey", "previous_job_id": None, "steps": records}, f)
+
+    result = executor.run([chain(survey_id)])["survey"]
+    assert result["jobs"][0] == job_id
+    assert len(server.jobs) == 2
+    assert states(state_dir) == ["finished", "finished"]
+
+
+def test_errored_jobs_are_retried_until_the_steps_retries_run_out(setup):
+    server, thematic, survey_id = setup
+    server.job_error_rate = 1.0
+    result = PipelineExecutor(thematic, retries=2).run([chain(survey_id)])["survey"]
+    assert "errored" in result["error"]
+    assert result["jobs"] == []
+    assert len(server.jobs) == 3
+
+    steps = [Step("run_job", retries=0, survey_id=survey_id, csv_filename=EXAMPLE_CSV)]
+    result = PipelineExecutor(thematic, retries=2).run([Chain("once", steps, survey_id=survey_id)])["once"]
+    assert "errored" in result["error"]
+    assert len(server.jobs) == 4
+
+
+def test_a_step_that_raises_is_submitted_again(setup):
+    server, thematic, survey_id = setup
+    thematic.upload_failures = 2
+    result = PipelineExecutor(thematic, retries=2).run([chain(survey_id)])["survey"]
+    assert result["error"] is None
+    assert len(result["jobs"]) == 2
+    assert len(server.jobs) == 2
+    assert thematic.upload_failures == 0
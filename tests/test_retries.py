@@ -0,0 +1,27 @@
+import time
+
+import pytest
+
+from thematic import Thematic, RateLimiter, RetryPolicy
+from thematic.mock_server import MockServer
+
+
+def test_retry_after_is_capped():
+    policy = RetryPolicy(max_backoff=60, max_retry_after=30)
+    assert policy.delay(0, retry_after=5) == 5
+    assert policy.delay(0, retry_after=86400) == 30
+    assert policy.delay(0, retry_after=-10) == 0
+
+
+def test_a_huge_retry_after_doesnt_stall_requests():
+    with MockServer(throttle_rate=1.0, retry_after=86400) as server:
+        limiter = RateLimiter(rate=1000)
+        thematic = Thematic(server.url, "key", rate_limiter=limiter, retry_policy=RetryPolicy(max_retries=2, max_retry_after=0.1))
+        start = time.time()
+        with pytest.raises(Exception, match="list_jobs: Bad Response: 429"):
+            thematic.list_jobs(survey_id="survey")
+        assert time.time() - start < 5
+        # the limiter is held back by the capped delay too, not the server's value
+        start = time.time()
+        limiter.acquire()
+        assert time.time() - start < 5
@@ -0,0 +1,52 @@
+import io
+import csv
+import collections
+
+from thematic.sampling import sample_csv
+
+
+def write_csv(path, rows):
+    with io.open(path, "w", encoding="utf-8", newline="") as f:
+        csv.writer(f).writerows(rows)
+    return path
+
+
+def sample(filename, sample_size, **kwargs):
+    out = io.StringIO(newline="")
+    counts = sample_csv(filename, out, sample_size, **kwargs)
+    return counts, list(csv.reader(io.StringIO(out.getvalue(), newline="")))
+
+
+def test_the_same_seed_gives_the_same_sample(tmp_path):
+    filename = write_csv(str(tmp_path / "input.csv"), [["id", "comment"]] + [[str(i), "comment {}".format(i)] for i in range(1000)])
+    counts, first = sample(filename, 50, has_header=True, seed=7)
+    assert counts == (1000, 50)
+    assert first[0] == ["id", "comment"]
+    assert sample(filename, 50, has_header=True, seed=7)[1] == first
+    assert sample(filename, 50, has_header=True, seed=8)[1] != first
+    # rows keep their order in the file
+    assert [int(row[0]) for row in first[1:]] == sorted(int(row[0]) for row in first[1:])
+
+
+def test_strata_are_sampled_in_proportion_to_their_size(tmp_path):
+    rows = [[str(i), "a" if i % 10 < 6 else "b" if i % 10 < 9 else "c"] for i in range(1000)]
+    filename = write_csv(str(tmp_path / "input.csv"), rows)
+    counts, rows = sample(filename, 100, stratify_column=1)
+    assert counts == (1000, 100)
+    assert collections.Counter(row[1] for row in rows) == {"a": 60, "b": 30, "c": 10}
+
+    # a stratum too small for a whole row of the sample still gets one
+    filename = write_csv(str(tmp_path / "small.csv"), [[str(i), "a"] for i in range(999)] + [["999", "b"]])
+    assert collections.Counter(row[1] for row in sample(filename, 10, stratify_column=1)[1]) == {"a": 9, "b": 1}
+
+
+def test_collapse_duplicates_samples_distinct_rows(tmp_path):
+    rows = [["great"]] * 500 + [["slow"]] * 300 + [["comment {}".format(i)] for i in range(20)]
+    filename = write_csv(str(tmp_path / "input.csv"), rows)
+    counts, sampled = sample(filename, 15, collapse_duplicates=True)
+    assert counts == (820, 15)
+    assert len(set(row[0] for row in sampled)) == 15
+
+    # fewer distinct rows than the sample size gives each of them once
+    filename = write_csv(str(tmp_path / "few.csv"), [["a", "1"], ["b", "2"], ["a", "3"], ["b", "4"], ["c", "5"]])
+    assert sorted(row[0] for row in sample(filename, 10, collapse_duplicates=[0])[1]) == ["a", "b", "c"]
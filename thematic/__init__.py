@@ -1,4 +1,38 @@
 __author__ = 'a_medelyan'
 
+import importlib
 
-from .thematic import Thematic
\ No newline at end of file
+# the public names and the modules they come from; each module is only imported when one of its
+# names is first used, so that importing the package (e.g. to start the command line runner)
+# doesn't load requests, aiohttp or sqlite until they are needed
+_EXPORTS = {
+    "Thematic": ".thematic",
+    "AsyncThematic": ".async_thematic",
+    "ResultCache": ".cache",
+    "RateLimiter": ".ratelimit",
+    "RetryPolicy": ".ratelimit",
+    "Metrics": ".metrics",
+    "ThemeIndex": ".theme_index",
+    "DeltaSync": ".delta",
+    "PipelineExecutor": ".pipeline",
+    "Chain": ".pipeline",
+    "Step": ".pipeline",
+    "JobJournal": ".journal",
+    "LogTail": ".logs",
+    "JobCatalog": ".catalog",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
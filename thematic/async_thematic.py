@@ -0,0 +1,677 @@
+import json
+import time
+import asyncio
+import datetime
+import logging
+import contextlib
+from urllib.parse import urlencode
+
+from . import thematic as _thematic
+from .polling import AdaptivePolling, JobWatch
+from .upload import MultipartStream
+from .ratelimit import RetryPolicy, parse_retry_after, request_category
+from .metrics import endpoint_of, job_event
+
+log = logging.getLogger(__name__)
+
+
+def _import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise Exception("AsyncThematic requires aiohttp, install it with `pip install thematic_sdk[async]`")
+    return aiohttp
+
+
+async def _maybe_await(value):
+    if asyncio.iscoroutine(value) or isinstance(value, asyncio.Future):
+        return await value
+    return value
+
+
+def _is_real_file(file_obj):
+    try:
+        file_obj.fileno()
+    except (AttributeError, OSError, ValueError):
+        return False
+    return True
+
+
+class AsyncThematic(object):
+    num_retries = 5000
+    upload_chunk_size = 1024 * 1024
+    download_chunk_size = 1024 * 1024
+
+    @classmethod
+    async def FromLogin(cls, base_url, username, password, **kwargs):
+        # create with unknown key
+        thematic = cls(base_url, "", **kwargs)
+        # login which will fill in key
+        await thematic.retrieve_apikey(username, password)
+        return thematic
+
+    def __init__(
+        self,
+        base_url,
+        api_key,
+        max_concurrency=100,
+        max_connections=100,
+        max_connections_per_host=0,
+        polling=None,
+        compress_uploads=False,
+        upload_progress=None,
+        rate_limiter=None,
+        retry_policy=None,
+        metrics=None,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        # uploads are streamed, optionally gzipped, and upload_progress(bytes_sent, total_bytes, elapsed) is called as they go
+        self.compress_uploads = compress_uploads
+        self.upload_progress = upload_progress
+        # the polling strategy learns from the jobs it has seen, so it is shared by all waits on this instance
+        self.polling = polling or AdaptivePolling()
+        # max_concurrency bounds the number of requests in flight, the connection limits bound the pool itself
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        # a RateLimiter can be shared with other clients, sync or async, talking to the same server
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        # hooks are called with the same events as on Thematic, and may be coroutine functions
+        self.request_hooks = []
+        self.job_hooks = []
+        self.metrics = metrics
+        if metrics is not None:
+            self.request_hooks.append(metrics.record_request)
+            self.job_hooks.append(metrics.record_job)
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            aiohttp = _import_aiohttp()
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_connections_per_host)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _headers(self):
+        return {"X-API-Authentication": self.api_key}
+
+    def _form(self, data):
+        return {k: str(v) for k, v in data.items()} if data else None
+
+    def _upload(self, files, data):
+        # returns the request arguments for a form, streaming any files through MultipartStream
+        if not files:
+            return {"headers": self._headers(), "data": self._form(data)}
+        stream = MultipartStream(data, files, chunk_size=self.upload_chunk_size, compress=self.compress_uploads, progress=self.upload_progress)
+        headers = self._headers()
+        headers["Content-Type"] = stream.content_type
+        if self.compress_uploads:
+            headers["Content-Encoding"] = "gzip"
+        if stream.len is not None:
+            headers["Content-Length"] = str(stream.len)
+        return {"headers": headers, "data": _AsyncUpload(stream, self.upload_chunk_size)}
+
+    @contextlib.asynccontextmanager
+    async def _send(self, method, url, **kwargs):
+        # yields the response, after sending the request again for as long as the retry policy allows
+        aiohttp = _import_aiohttp()
+        if _thematic.LOG_REQUESTS:
+            log.info("Calling URL: {}".format(url))
+        session = self._get_session()
+        body = kwargs.pop("data", None)
+        category = request_category(method, url, uploading=isinstance(body, _AsyncUpload))
+        attempt = 0
+        r = None
+        bytes_received = None
+        start_time = time.time()
+        try:
+            while True:
+                if self.rate_limiter:
+                    delay = self.rate_limiter.reserve(category)
+                    if delay:
+                        await asyncio.sleep(delay)
+                data = body.chunks() if isinstance(body, _AsyncUpload) else body
+                # a concurrency slot is held while a request is in flight, never while waiting to send one
+                async with self._semaphore:
+                    try:
+                        r = await session.request(method, url, data=data, **kwargs)
+                    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                        if not self.retry_policy or not self.retry_policy.should_retry(method, url, attempt):
+                            raise
+                        log.warning("{} {} failed, retrying ({})".format(method, url, e))
+                        delay = self.retry_policy.delay(attempt)
+                    else:
+                        if not self.retry_policy or not self.retry_policy.should_retry(method, url, attempt, r.status):
+                            async with r:
+                                try:
+                                    yield r
+                                finally:
+                                    bytes_received = r.content.total_bytes
+                            return
+                        retry_after = parse_retry_after(r.headers.get("Retry-After"))
+                        delay = self.retry_policy.delay(attempt, retry_after)
+                        if retry_after is not None and self.rate_limiter:
+                            # the server wants every request to back off, not just this one
+                            self.rate_limiter.block_for(delay)
+                        log.warning("{} {} returned {}, retrying".format(method, url, r.status))
+                        r.release()
+                        r = None
+                attempt += 1
+                await asyncio.sleep(delay)
+        finally:
+            if self.request_hooks:
+                if isinstance(body, _AsyncUpload):
+                    bytes_sent = body.stream.bytes_sent
+                elif isinstance(body, dict):
+                    bytes_sent = len(urlencode(body))
+                else:
+                    bytes_sent = 0
+                event = {
+                    "endpoint": endpoint_of(self.base_url, url),
+                    "method": method,
+                    "url": url,
+                    "status": r.status if r is not None else None,
+                    "seconds": time.time() - start_time,
+                    "retries": attempt,
+                    "bytes_sent": bytes_sent,
+                    "bytes_received": bytes_received,
+                }
+                await self._call_hooks(self.request_hooks, event)
+
+    async def _call_hooks(self, hooks, event):
+        for hook in hooks:
+            try:
+                await _maybe_await(hook(event))
+            except Exception as e:
+                # instrumentation must never break a request
+                log.warning("Instrumentation hook {} failed: {}".format(hook, e))
+
+    async def _job_done(self, watch):
+        if self.job_hooks:
+            await self._call_hooks(self.job_hooks, job_event(watch))
+
+    async def _request(self, method, url, **kwargs):
+        async with self._send(method, url, **kwargs) as r:
+            body = await r.read()
+            return r.status, r.headers, body
+
+    def _load_json(self, name, status, body):
+        try:
+            return json.loads(body.decode("utf-8"))
+        except Exception:
+            log.error("Bad Response, has status {} and body {}".format(status, body))
+            raise Exception("{}: Bad Response".format(name))
+
+    async def retrieve_apikey(self, username, password):
+        payload = {"username": username, "password": password}
+        status, headers, body = await self._request("POST", self.base_url + "/login", data=payload)
+        response = self._load_json("retrieve_apikey", status, body)
+
+        if response["status"] != "success":
+            raise Exception("retrieve_apikey: Failed to login (" + response["error"]["message"] + ")")
+        self.api_key = response["data"]["api_key"]
+        self.login_cookie = headers.get("Set-cookie")
+
+    async def create_survey(self, name, total_columns, columns, has_header, modelset_id=None, output_format=None):
+        payload = {"name": name, "total_columns": total_columns, "columns": json.dumps(columns), "has_header": has_header}
+        # optional modelsetid
+        if modelset_id:
+            payload["modelset_id"] = modelset_id
+        if output_format:
+            payload["output_format"] = output_format
+        status, headers, body = await self._request("POST", self.base_url + "/create_survey", headers=self._headers(), data=self._form(payload))
+        response = self._load_json("create_survey", status, body)
+
+        if response["status"] != "success":
+            raise Exception("create_survey: Failed to create survey (" + response["error"]["message"] + ")")
+        if "survey_id" not in response["data"]:
+            raise Exception("create_survey: Bad Response")
+        return response["data"]
+
+    async def update_survey(self, survey_id, name=None, total_columns=None, columns=None, has_header=None, modelset_id=None, output_format=None):
+        payload = {}
+        if name:
+            payload["name"] = name
+        if columns:
+            payload["columns"] = columns if isinstance(columns, str) else json.dumps(columns)
+        if has_header is not None:
+            payload["has_header"] = has_header
+        if total_columns:
+            payload["total_columns"] = total_columns
+        if modelset_id:
+            payload["modelset_id"] = modelset_id
+        if output_format:
+            payload["output_format"] = output_format
+        url = self.base_url + "/survey/{}".format(survey_id)
+        status, headers, body = await self._request("PUT", url, headers=self._headers(), data=self._form(payload))
+        response = self._load_json("update_survey", status, body)
+
+        if response["status"] != "success":
+            raise Exception("update_survey: Failed to create survey (" + response["error"]["message"] + ")")
+        return response["data"]
+
+    async def get_survey_details(self, survey_id):
+        url = self.base_url + "/survey/{}".format(survey_id)
+        status, headers, body = await self._request("GET", url, headers=self._headers())
+        response = self._load_json("get_survey_details", status, body)
+
+        if response["status"] != "success":
+            raise Exception("get_survey_details: Failed to create survey (" + response["error"]["message"] + ")")
+        return response["data"]
+
+    async def run_job_with_file_object(self, survey_id, files, previous_job_id=None, params=None):
+        payload = {"survey_id": survey_id}
+        if params:
+            payload.update(params)
+        if previous_job_id:
+            payload["previous_job_id"] = previous_job_id
+        url = self.base_url + "/create_job"
+        status, headers, body = await self._request("POST", url, **self._upload(files, payload))
+        response = self._load_json("run_job", status, body)
+        if response["status"] != "success":
+            raise Exception("run_job: Failed to create job (" + response["error"]["message"] + ")")
+        if "jobid" not in response["data"]:
+            raise Exception("run_job: Bad Response")
+        return response["data"]["jobid"]
+
+    async def run_job(self, survey_id, csv_filename, themes_file=None, previous_job_id=None, params=None):
+        files = {"csv_file": csv_filename}
+        if themes_file:
+            files["themes_file"] = themes_file
+        with _OpenFiles(files) as file_objs:
+            return await self.run_job_with_file_object(survey_id, file_objs, previous_job_id=previous_job_id, params=params)
+
+    async def create_job_from_artifacts(self, survey_id, artifacts_filename):
+        with _OpenFiles({"artifacts_file": artifacts_filename}) as file_objs:
+            return await self.run_job_with_file_object(survey_id, file_objs)
+
+    async def delete_rows(self, survey_id, delete_rows_sort_file, previous_job_id, disambiguation_columns):
+        params = {"job_type": "deleterows", "updated_parameters": json.dumps({"disambiguation_columns": disambiguation_columns})}
+
+        with _OpenFiles({"csv_file": delete_rows_sort_file}) as file_objs:
+            return await self.run_job_with_file_object(survey_id, file_objs, previous_job_id=previous_job_id, params=params)
+
+    async def cancel_job(self, job_id):
+        url = self.base_url + "/job/" + job_id + "/cancel"
+        status, headers, body = await self._request("POST", url, headers=self._headers())
+        return body.decode("utf-8")
+
+    async def delete_job(self, job_id):
+        url = self.base_url + "/job/" + job_id + "/delete"
+        status, headers, body = await self._request("GET", url, headers=self._headers())
+        return body.decode("utf-8")
+
+    async def _run_post_request_with_json_response(self, url, files, data):
+        log.info("Posting URL: {}".format(url))
+        status, headers, body = await self._request("POST", url, **self._upload(files, data))
+        if status != 200:
+            raise Exception("Failed with code {} and reason: {}".format(status, body))
+
+        response = self._load_json("run_incremental_update", status, body)
+
+        if response["status"] != "success":
+            raise Exception("run_incremental_update: Failed to create job (" + response["error"]["message"] + ")")
+        return response
+
+    async def _run_job_request(self, name, url, filenames, data):
+        with _OpenFiles(filenames) as file_objs:
+            response = await self._run_post_request_with_json_response(url, file_objs, data)
+        if "jobid" not in response["data"]:
+            raise Exception("{}: Bad Response".format(name))
+        return response["data"]["jobid"]
+
+    async def run_incremental_update_with_file_object(
+        self, survey_id, csv_file_obj, previous_job_id, replace_data, disambiguation_columns=None, themes_filename=None, job_options={}
+    ):
+        payload = {"survey_id": survey_id, "job_type": "apply", "job_options": json.dumps(job_options)}
+        if not replace_data:
+            payload["job_type"] = "incremental_data"
+            payload["updated_parameters"] = json.dumps({"disambiguation_columns": disambiguation_columns})
+        if previous_job_id:
+            payload["previous_job_id"] = previous_job_id
+        with _OpenFiles({"themes_file": themes_filename}) as file_objs:
+            files = dict(file_objs, csv_file=csv_file_obj)
+            response = await self._run_post_request_with_json_response(self.base_url + "/create_job", files, payload)
+
+        if "jobid" not in response["data"]:
+            raise Exception("run_incremental_update: Bad Response")
+        return response["data"]["jobid"]
+
+    async def run_replace_data(self, survey_id, csv_filename, previous_job_id, themes_filename=None, job_options={}):
+        with open(csv_filename, "rb") as csv_file_obj:
+            return await self.run_incremental_update_with_file_object(
+                survey_id, csv_file_obj, previous_job_id, True, themes_filename=themes_filename, job_options=job_options
+            )
+
+    async def run_incremental_update(self, survey_id, csv_filename, previous_job_id, disambiguation_columns=None, job_options={}):
+        with open(csv_filename, "rb") as csv_file_obj:
+            return await self.run_incremental_update_with_file_object(
+                survey_id, csv_file_obj, previous_job_id, False, disambiguation_columns=disambiguation_columns, job_options=job_options
+            )
+
+    async def run_translations(self, survey_id, csv_filename, columns=None, job_options={}):
+        payload = {"survey_id": survey_id, "job_type": "translate"}
+        job_options = dict(job_options)
+        if columns:
+            job_options["columns"] = columns
+        payload["job_options"] = json.dumps(job_options)
+        return await self._run_job_request("run_translations", self.base_url + "/create_job", {"csv_file": csv_filename}, payload)
+
+    async def configure_concepts(self, concepts_filename, previous_job_id, data_filename=None, themes_filename=None, job_options={}):
+        files = {"concepts_file": concepts_filename, "csv_file": data_filename, "themes_file": themes_filename}
+        url = self.base_url + "/job/" + previous_job_id + "/concepts"
+        return await self._run_job_request("configure_concepts", url, files, {"job_options": json.dumps(job_options)})
+
+    async def configure_word_frequencies(
+        self, nouns_filename, verbs_filename, adjectives_filename, previous_job_id, data_filename=None, themes_filename=None, job_options={}
+    ):
+        files = {
+            "nouns_file": nouns_filename,
+            "verbs_file": verbs_filename,
+            "adjectives_file": adjectives_filename,
+            "csv_file": data_filename,
+            "themes_file": themes_filename,
+        }
+        url = self.base_url + "/job/" + previous_job_id + "/word_frequencies"
+        return await self._run_job_request("configure_word_frequencies", url, files, {"job_options": json.dumps(job_options)})
+
+    async def configure_themes(self, themes_filename, previous_job_id, data_filename=None, job_options={}):
+        files = {"themes_file": themes_filename, "csv_file": data_filename}
+        url = self.base_url + "/job/" + previous_job_id + "/themes"
+        return await self._run_job_request("configure_themes", url, files, {"job_options": json.dumps(job_options)})
+
+    async def configure_language_model(self, language_model_filename, previous_job_id, data_filename=None, themes_filename=None, job_options={}):
+        files = {"model_file": language_model_filename, "csv_file": data_filename, "themes_file": themes_filename}
+        url = self.base_url + "/job/" + previous_job_id + "/language_model"
+        return await self._run_job_request("configure_language_model", url, files, {"job_options": json.dumps(job_options)})
+
+    async def configure_stopwords(self, stopwords_filename, previous_job_id, data_filename=None, themes_filename=None, job_options={}):
+        files = {"stopwords_file": stopwords_filename, "csv_file": data_filename, "themes_file": themes_filename}
+        url = self.base_url + "/job/" + previous_job_id + "/stopwords"
+        return await self._run_job_request("configure_stopwords", url, files, {"job_options": json.dumps(job_options)})
+
+    async def configure_parameters(self, parameters, previous_job_id, data_filename=None, themes_filename=None):
+        files = {"csv_file": data_filename, "themes_file": themes_filename}
+        url = self.base_url + "/job/" + previous_job_id + "/params"
+        return await self._run_job_request("configure_parameters", url, files, parameters)
+
+    async def get_job_details(self, job_id):
+        url = self.base_url + "/job/" + job_id + "/info"
+        status, headers, body = await self._request("GET", url, headers=self._headers())
+        if status != 200:
+            raise Exception("get_job_status: Bad Response: {} {}".format(status, body))
+
+        response = self._load_json("get_job_status", status, body)
+
+        if response["status"] != "success":
+            raise Exception("get_job_status: Failed to get job status (" + response["error"]["message"] + ")")
+        if "state" not in response["data"]:
+            raise Exception("get_job_status: Bad Response")
+        return response["data"]
+
+    async def get_job_logs(self, job_id):
+        url = self.base_url + "/job/" + job_id + "/log"
+        status, headers, body = await self._request("GET", url, headers=self._headers())
+        return body.decode("utf-8")
+
+    async def wait_for_job_completion(self, job_id, check_continue=None, polling=None, on_poll=None):
+        polling = polling or self.polling
+        watch = JobWatch(job_id, polling)
+        log.info("Waiting for results of job " + job_id + " ...")
+        num_exceptions = 0
+        log.info("\tStarted at {}".format(datetime.datetime.now()))
+        while True:
+            # protect the endpoint to get job details against transmission errors (because we call it so much)
+            try:
+                job_details = await self.get_job_details(job_id)
+                num_exceptions = 0
+            except Exception as e:
+                num_exceptions += 1
+                if num_exceptions > self.num_retries:
+                    raise Exception("Failure waiting for job completion after {} tries: {}".format(num_exceptions, e))
+                log.warning("\tFailed to get job status, retrying ({})".format(e))
+                await asyncio.sleep(polling.error_interval(num_exceptions))
+                continue
+
+            status = job_details["state"]
+            if watch.update(status):
+                log.info("\tStatus is " + status)
+                if status in _thematic.TERMINAL_STATES:
+                    await self._job_done(watch)
+            if status == "finished":
+                log.info("\tFinished at {}".format(datetime.datetime.now()))
+                break
+            elif status == "errored":
+                log.error("\tErrored at {}".format(datetime.datetime.now()))
+                raise Exception("wait_for_job_completion: Job errored and did not complete")
+            elif status == "canceled":
+                log.info("\tCancelled at {}".format(datetime.datetime.now()))
+                raise Exception("wait_for_job_completion: Job was canceled")
+
+            if on_poll:
+                await _maybe_await(on_poll(job_id, job_details, watch.eta()))
+
+            # check if we should still be waiting for this job
+            if check_continue and not await _maybe_await(check_continue()):
+                raise Exception("wait_for_job_completion: Interrupted")
+
+            await asyncio.sleep(watch.next_interval())
+        if watch.process_start_time:
+            # only prints if we spent time processing
+            log.info(
+                "\tWaited {}s in queue and spent {}s processing".format(
+                    datetime.timedelta(seconds=watch.queue_seconds), datetime.timedelta(seconds=watch.processing_seconds)
+                )
+            )
+        return job_details
+
+    async def _poll_job_states(self, pending, job_surveys):
+        states = {}
+        by_survey, singles = _thematic.group_jobs_for_polling(pending, job_surveys)
+        listings = await asyncio.gather(*[self.list_jobs(survey_id=survey_id) for survey_id in by_survey])
+        for job_ids, jobs in zip(by_survey.values(), listings):
+            listed = {_thematic.job_id_of(job): job for job in jobs}
+            for job_id in job_ids:
+                if listed.get(job_id, {}).get("state"):
+                    states[job_id] = listed[job_id]
+                else:
+                    singles.append(job_id)
+        details = await asyncio.gather(*[self.get_job_details(job_id) for job_id in singles])
+        for job_id, job_details in zip(singles, details):
+            states[job_id] = job_details
+            if job_details.get("survey_id"):
+                job_surveys[job_id] = job_details["survey_id"]
+        return states
+
+    async def as_completed(self, job_ids, survey_id=None, check_continue=None, polling=None, on_poll=None):
+        polling = polling or self.polling
+        watches = {job_id: JobWatch(job_id, polling) for job_id in job_ids}
+        pending = list(watches)
+        job_surveys = _thematic.initial_job_surveys(pending, survey_id)
+        num_exceptions = 0
+        log.info("Waiting for results of {} jobs ...".format(len(pending)))
+        while pending:
+            try:
+                states = await self._poll_job_states(pending, job_surveys)
+                num_exceptions = 0
+            except Exception as e:
+                num_exceptions += 1
+                if num_exceptions > self.num_retries:
+                    raise Exception("Failure waiting for job completion after {} tries: {}".format(num_exceptions, e))
+                log.warning("\tFailed to get job states, retrying ({})".format(e))
+                await asyncio.sleep(polling.error_interval(num_exceptions))
+                continue
+
+            for job_id in list(pending):
+                job_details = states[job_id]
+                watches[job_id].update(job_details["state"])
+                if job_details["state"] in _thematic.TERMINAL_STATES:
+                    await self._job_done(watches[job_id])
+                    pending.remove(job_id)
+                    log.info("\tJob {} is {}".format(job_id, job_details["state"]))
+                    yield job_id, job_details
+                elif on_poll:
+                    await _maybe_await(on_poll(job_id, job_details, watches[job_id].eta()))
+            if not pending:
+                break
+
+            # check if we should still be waiting for these jobs
+            if check_continue and not await _maybe_await(check_continue()):
+                raise Exception("as_completed: Interrupted")
+
+            # a single poll serves every job, so wait for whichever job is expected to change first
+            await asyncio.sleep(min(watches[job_id].next_interval() for job_id in pending))
+
+    async def wait_for_jobs(self, job_ids, survey_id=None, check_continue=None, polling=None, on_poll=None):
+        results = {}
+        async for job_id, job_details in self.as_completed(job_ids, survey_id=survey_id, check_continue=check_continue, polling=polling, on_poll=on_poll):
+            results[job_id] = job_details
+        return results
+
+    async def list_jobs(self, survey_id=None, job_type=None):
+        payload = {}
+        if survey_id:
+            payload["survey_id"] = survey_id
+        if job_type:
+            payload["job_type"] = job_type
+
+        url = self.base_url + "/jobs/"
+        status, headers, body = await self._request("GET", url, headers=self._headers(), params=payload)
+        if status != 200:
+            raise Exception("list_jobs: Bad Response: {} {}".format(status, body))
+
+        response = self._load_json("list_jobs", status, body)
+        return response["data"]["jobs"]
+
+    async def _internal_request_to_text_or_file(self, url, file_obj):
+        async with self._send("GET", url, headers=self._headers()) as r:
+            if r.status != 200:
+                log.error("Failed to retrieve. Code {} message {}".format(r.status, await r.text()))
+                return None
+            if not file_obj:
+                return await r.read()
+            # writes to a real file go through the default executor so a slow disk doesn't stall the event loop
+            loop = asyncio.get_event_loop() if _is_real_file(file_obj) else None
+            async for chunk in r.content.iter_chunked(self.download_chunk_size):
+                if loop:
+                    await loop.run_in_executor(None, file_obj.write, chunk)
+                else:
+                    file_obj.write(chunk)
+            return True
+
+    async def retrieve_csv(self, job_id, file_obj=None):
+        url = self.base_url + "/job/" + job_id + "/csv/"
+        return await self._internal_request_to_text_or_file(url, file_obj)
+
+    async def retrieve_incremental_csv(self, job_id, file_obj=None):
+        url = self.base_url + "/job/" + job_id + "/incremental_csv/"
+        return await self._internal_request_to_text_or_file(url, file_obj)
+
+    async def retrieve_themes(self, job_id, file_obj=None):
+        url = self.base_url + "/job/" + job_id + "/themes/"
+        return await self._internal_request_to_text_or_file(url, file_obj)
+
+    async def retrieve_stopwords(self, job_id, file_obj=None):
+        url = self.base_url + "/job/" + job_id + "/stopwords/"
+        return await self._internal_request_to_text_or_file(url, file_obj)
+
+    async def retrieve_concepts(self, job_id, file_obj=None):
+        url = self.base_url + "/job/" + job_id + "/concepts/"
+        return await self._internal_request_to_text_or_file(url, file_obj)
+
+    async def retrieve_nouns(self, job_id, file_obj=None):
+        url = self.base_url + "/job/" + job_id + "/nouns/"
+        return await self._internal_request_to_text_or_file(url, file_obj)
+
+    async def retrieve_verbs(self, job_id, file_obj=None):
+        url = self.base_url + "/job/" + job_id + "/verbs/"
+        return await self._internal_request_to_text_or_file(url, file_obj)
+
+    async def retrieve_adjectives(self, job_id, file_obj=None):
+        url = self.base_url + "/job/" + job_id + "/adjectives/"
+        return await self._internal_request_to_text_or_file(url, file_obj)
+
+    async def retrieve_artifacts(self, job_id, file_obj=None):
+        if file_obj is None:
+            raise Exception("Artifacts must be retrieved into a file object")
+        url = self.base_url + "/job/" + job_id + "/artifacts/"
+        return await self._internal_request_to_text_or_file(url, file_obj)
+
+    async def retrieve_language_model(self, job_id):
+        url = self.base_url + "/job/" + job_id + "/language_model/"
+        status, headers, body = await self._request("GET", url, headers=self._headers())
+        if status != 200:
+            return None
+        return body
+
+    async def retrieve_parameters(self, job_id):
+        url = self.base_url + "/job/" + job_id + "/params"
+        status, headers, body = await self._request("GET", url, headers=self._headers())
+        response = self._load_json("retrieve_parameters", status, body)
+
+        if response["status"] != "success":
+            raise Exception("retrieve_parameters: Failed to get job parameters (" + response["error"]["message"] + ")")
+        return response["data"]
+
+    async def discover_new_themes(self, job_id, csv_filename, themes_filename=None):
+        payload = {"job_id": job_id}
+        with _OpenFiles({"csv_file": csv_filename, "themes_file": themes_filename}) as file_objs:
+            response = await self._run_post_request_with_json_response(self.base_url + "/helpers/discoverThemes", file_objs, payload)
+        return response["data"]
+
+
+class _AsyncUpload(object):
+    # A MultipartStream sent from the event loop. Each call to chunks() starts the body over, so a
+    # retried request sends it again in full.
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+
+    async def chunks(self):
+        # file reads happen off the event loop
+        loop = asyncio.get_running_loop()
+        self.stream.reset()
+        while True:
+            chunk = await loop.run_in_executor(None, self.stream.read, self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class _OpenFiles(object):
+    # opens a dict of field name -> filename, skipping empty filenames, and closes them all on exit
+    def __init__(self, filenames):
+        self.filenames = filenames
+        self.file_objs = {}
+
+    def __enter__(self):
+        try:
+            for key, filename in self.filenames.items():
+                if filename:
+                    self.file_objs[key] = open(filename, "rb")
+        except Exception:
+            self.close()
+            raise
+        return self.file_objs
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for file_obj in self.file_objs.values():
+            file_obj.close()
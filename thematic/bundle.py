@@ -0,0 +1,57 @@
+import os
+import shutil
+import zipfile
+
+# the outputs retrieve_bundle fetches by default, and the file each one is saved as
+BUNDLE_FILES = (
+    ("csv", "results.csv"),
+    ("themes", "themes.json"),
+    ("concepts", "concepts.json"),
+    ("stopwords", "stopwords"),
+    ("nouns", "nouns"),
+    ("verbs", "verbs"),
+    ("adjectives", "adjectives"),
+    ("parameters", "parameters.json"),
+    ("language_model", "language_model"),
+)
+# outputs that can be asked for by name but aren't fetched unless they are
+EXTRA_BUNDLE_FILES = (
+    ("incremental_csv", "incremental_results.csv"),
+    ("artifacts", "artifacts"),
+)
+
+
+def bundle_filename(output):
+    for name, filename in BUNDLE_FILES + EXTRA_BUNDLE_FILES:
+        if name == output:
+            return filename
+    raise Exception("retrieve_bundle: Unknown output {}".format(output))
+
+
+def publish_directory(tmp_dir, dest):
+    # moves a finished bundle into place, replacing what was there only once it is complete
+    parent = os.path.dirname(os.path.abspath(dest))
+    if not os.path.isdir(parent):
+        os.makedirs(parent, exist_ok=True)
+    if not os.path.exists(dest):
+        shutil.move(tmp_dir, dest)
+        return
+    old_dir = dest + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    os.rename(dest, old_dir)
+    shutil.move(tmp_dir, dest)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def publish_zip(tmp_dir, dest, compression=zipfile.ZIP_DEFLATED):
+    # zips a finished bundle next to the destination and renames it into place once complete
+    parent = os.path.dirname(os.path.abspath(dest))
+    if not os.path.isdir(parent):
+        os.makedirs(parent, exist_ok=True)
+    with zipfile.ZipFile(dest + ".part", "w", compression=compression, allowZip64=True) as archive:
+        for directory, sub_dirs, filenames in os.walk(tmp_dir):
+            sub_dirs.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                archive.write(path, os.path.relpath(path, tmp_dir).replace(os.sep, "/"))
+    os.replace(dest + ".part", dest)
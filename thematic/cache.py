@@ -0,0 +1,129 @@
+import os
+import hashlib
+import tempfile
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on windows
+    fcntl = None
+
+
+class ResultCache(object):
+    # An on-disk cache of job outputs, shared safely between threads and processes.
+    # Entries are keyed by job id and output type, written to a temporary file and renamed into place
+    # so readers never see partial files, and evicted least recently used first once the cache
+    # grows beyond max_bytes. Only outputs of jobs in a terminal state should be stored, as they
+    # can no longer change.
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id, artifact):
+        key = hashlib.sha256("{}/{}".format(job_id, artifact).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def open(self, job_id, artifact):
+        path = self._path(job_id, artifact)
+        try:
+            file_obj = open(path, "rb")
+        except (IOError, OSError):
+            return None
+        try:
+            # the modification time is the recency used for eviction
+            os.utime(path, None)
+        except OSError:
+            pass
+        return file_obj
+
+    def get(self, job_id, artifact):
+        file_obj = self.open(job_id, artifact)
+        if file_obj is None:
+            return None
+        with file_obj:
+            return file_obj.read()
+
+    def store(self, job_id, artifact, write):
+        # write(file_obj) fills in the entry and returns something falsy if it failed.
+        # Returns the stored entry opened for reading, or None.
+        path = self._path(job_id, artifact)
+        entry_dir = os.path.dirname(path)
+        os.makedirs(entry_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, prefix=".tmp-")
+        file_obj = os.fdopen(fd, "w+b")
+        try:
+            if not write(file_obj):
+                file_obj.close()
+                os.remove(tmp_path)
+                return None
+            file_obj.flush()
+            os.replace(tmp_path, path)
+        except BaseException:
+            file_obj.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        file_obj.seek(0)
+        self.evict()
+        return file_obj
+
+    def put(self, job_id, artifact, data):
+        file_obj = self.store(job_id, artifact, lambda f: f.write(data) is not None)
+        if file_obj is not None:
+            file_obj.close()
+
+    @contextlib.contextmanager
+    def _lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entries(self):
+        entries = []
+        for sub_dir in os.listdir(self.directory):
+            sub_path = os.path.join(self.directory, sub_dir)
+            if len(sub_dir) != 2 or not os.path.isdir(sub_path):
+                continue
+            for name in os.listdir(sub_path):
+                if name.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(sub_path, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(sub_path, name)))
+        return entries
+
+    def size(self):
+        return sum(size for mtime, size, path in self._entries())
+
+    def evict(self):
+        with self._lock():
+            entries = self._entries()
+            total = sum(size for mtime, size, path in entries)
+            if total <= self.max_bytes:
+                return
+            for mtime, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def clear(self):
+        with self._lock():
+            for mtime, size, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+
+from .thematic import TERMINAL_STATES, job_id_of, job_created
+
+log = logging.getLogger(__name__)
+
+_COLUMNS = "job_id, survey_id, job_type, state, created, previous_job_id, details"
+
+
+class JobCatalog(object):
+    # A local index of the jobs of surveys, kept in an SQLite database and filled from list_jobs
+    # and get_job_details, so questions like "the latest finished apply job of this survey" or
+    # "the jobs this job was built on" are answered without listing every job again.
+    #
+    # A survey is listed again when its last listing is more than max_age seconds old, and only
+    # jobs that are new or have changed are written. Jobs that have ended never change, so chains
+    # of previous jobs are followed locally, looking up only jobs the catalog hasn't seen. The
+    # catalog registers a job hook on the client, so jobs that are waited for are kept up to date.
+    #
+    #   catalog = JobCatalog(client, "catalog.sqlite")
+    #   job = catalog.latest(survey_id, job_type="apply")
+    #   chain = catalog.ancestors(job["job_id"])
+    def __init__(self, client, path, max_age=300):
+        self.client = client
+        self.path = path
+        self.max_age = max_age
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, survey_id TEXT, job_type TEXT, state TEXT, created REAL, "
+                "previous_job_id TEXT, details TEXT, detailed INTEGER NOT NULL DEFAULT 0, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_survey ON jobs (survey_id, job_type, state, created)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_previous ON jobs (previous_job_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS surveys (survey_id TEXT PRIMARY KEY, synced REAL NOT NULL)")
+            conn.commit()
+        finally:
+            conn.close()
+        client.job_hooks.append(self._job_ended)
+
+    def _connect(self):
+        # a connection per call, so the catalog can be used from several threads and processes
+        return sqlite3.connect(self.path, timeout=60)
+
+    def _job(self, row):
+        job = json.loads(row[6]) if row[6] else {}
+        job.update({"job_id": row[0], "survey_id": row[1], "job_type": row[2], "state": row[3], "created": row[4], "previous_job_id": row[5]})
+        return job
+
+    def _store(self, conn, job, survey_id=None, detailed=False):
+        # writes a listed job or the details of a job, returning True if anything changed
+        job_id = job_id_of(job)
+        if not job_id:
+            return False
+        existing = conn.execute("SELECT " + _COLUMNS + ", detailed FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        created = job_created(job)
+        values = (
+            job_id,
+            job.get("survey_id") or survey_id or (existing[1] if existing else None),
+            job.get("job_type") or job.get("type") or (existing[2] if existing else None),
+            job.get("state") or (existing[3] if existing else None),
+            created if created is not None else (existing[4] if existing else None),
+            job.get("previous_job_id") or (existing[5] if existing else None),
+            json.dumps(job, sort_keys=True, default=str),
+            1 if detailed or (existing and existing[7]) else 0,
+        )
+        if existing is not None and tuple(existing) == values:
+            return False
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (" + _COLUMNS + ", detailed, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            values + (time.time(),),
+        )
+        return True
+
+    def _job_ended(self, event):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE job_id = ?", (event["state"], time.time(), event["job_id"]))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def sync(self, survey_id, force=False):
+        # lists the survey's jobs if the last listing is older than max_age (or always with force),
+        # returning the number of jobs that were new or changed
+        conn = self._connect()
+        try:
+            if not force:
+                row = conn.execute("SELECT synced FROM surveys WHERE survey_id = ?", (str(survey_id),)).fetchone()
+                if row is not None and time.time() - row[0] < self.max_age:
+                    return 0
+            synced = time.time()
+            jobs = self.client.list_jobs(survey_id=survey_id)
+            changed = sum(1 for job in jobs if self._store(conn, job, survey_id=str(survey_id)))
+            conn.execute("INSERT OR REPLACE INTO surveys (survey_id, synced) VALUES (?, ?)", (str(survey_id), synced))
+            conn.commit()
+            log.debug("Synced {} jobs of survey {}, {} changed".format(len(jobs), survey_id, changed))
+            return changed
+        finally:
+            conn.close()
+
+    def refresh(self, job_id):
+        # looks a single job up with get_job_details
+        job = dict(self.client.get_job_details(job_id))
+        job.setdefault("id", job_id)
+        conn = self._connect()
+        try:
+            self._store(conn, job, detailed=True)
+            conn.commit()
+        finally:
+            conn.close()
+        return self.get(job_id, fetch=False)
+
+    def _row(self, job_id):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT " + _COLUMNS + ", detailed FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+
+    def get(self, job_id, fetch=True):
+        # the catalog's record of a job, looked up if it isn't known or may still change
+        row = self._row(job_id)
+        if fetch and (row is None or row[3] not in TERMINAL_STATES):
+            return self.refresh(job_id)
+        return self._job(row) if row is not None else None
+
+    def jobs(self, survey_id, job_type=None, state=None, since=None, limit=None, sync=True):
+        # the survey's jobs, newest first, optionally only those of a job type or state, or created since a time
+        if sync:
+            self.sync(survey_id)
+        query = "SELECT " + _COLUMNS + " FROM jobs WHERE survey_id = ?"
+        params = [str(survey_id)]
+        if job_type is not None:
+            query += " AND job_type = ?"
+            params.append(job_type)
+        if state is not None:
+            query += " AND state = ?"
+            params.append(state)
+        if since is not None:
+            query += " AND created >= ?"
+            params.append(since)
+        query += " ORDER BY created DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        conn = self._connect()
+        try:
+            return [self._job(row) for row in conn.execute(query, params)]
+        finally:
+            conn.close()
+
+    def latest(self, survey_id, job_type=None, state="finished", sync=True):
+        jobs = self.jobs(survey_id, job_type=job_type, state=state, limit=1, sync=sync)
+        return jobs[0] if jobs else None
+
+    def ancestors(self, job_id):
+        # the job followed by the job it was built on, that job's previous job and so on
+        chain = []
+        seen = set()
+        while job_id and job_id not in seen:
+            seen.add(job_id)
+            row = self._row(job_id)
+            if row is None or (row[5] is None and not row[7]):
+                # listings may leave out previous jobs, the job's details have them
+                job = self.refresh(job_id)
+            else:
+                job = self._job(row)
+            chain.append(job)
+            job_id = job.get("previous_job_id")
+        return chain
+
+    def descendants(self, job_id):
+        # the jobs built directly on a job, among those the catalog knows of
+        conn = self._connect()
+        try:
+            return [self._job(row) for row in conn.execute("SELECT " + _COLUMNS + " FROM jobs WHERE previous_job_id = ? ORDER BY created", (job_id,))]
+        finally:
+            conn.close()
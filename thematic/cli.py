@@ -0,0 +1,355 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import configparser
+
+# Runs the analysis of many surveys from a manifest: creates or updates each survey, runs a job on
+# its input file, applies any concepts, stopwords, themes and parameters on top, and downloads the
+# results, with at most --concurrency uploads or downloads and --max-jobs jobs in flight at once.
+#
+#   thematic-batch manifest.ini --concurrency 8 --max-jobs 40 --state-dir state/
+#
+# The manifest is an ini file like example/config.ini, which is itself a manifest for one survey.
+# [server] has base_url and either api_key or username and password (THEMATIC_API_KEY in the
+# environment also works). Every other section whose name starts with "survey" is a survey:
+#
+#   [survey nps]
+#   name = NPS Survey
+#   total_columns = 5
+#   columns = [[{"index": 2, "name": "NPS Comment"}]]
+#   has_header = True
+#   filename = nps.csv
+#   ; optional: survey_id (to update an existing survey), modelset_id, conceptsfile,
+#   ; stopwordsfile, themesfile, parameters (json, or a json file), outputs, output_dir
+#
+# Values in [DEFAULT] apply to every survey, and relative paths are relative to the manifest.
+# Only the standard library is imported until surveys are actually run, so --help and --dry-run
+# start instantly.
+
+log = logging.getLogger(__name__)
+
+DEFAULT_OUTPUTS = "csv themes"
+# manifest keys for files applied after the first job, in order, with the step each one makes
+CONFIGURE_STEPS = (
+    ("conceptsfile", "configure_concepts", "concepts_filename"),
+    ("stopwordsfile", "configure_stopwords", "stopwords_filename"),
+    ("themesfile", "configure_themes", "themes_filename"),
+)
+
+
+class SurveySpec(object):
+    # one survey of a manifest
+    def __init__(self, key, section, base_dir):
+        def path(value):
+            return os.path.normpath(os.path.join(base_dir, value)) if value else None
+
+        self.key = key
+        self.name = section.get("name", key)
+        self.survey_id = section.get("survey_id") or None
+        self.modelset_id = section.get("modelset_id") or None
+        self.total_columns = section.getint("total_columns")
+        self.columns = json.loads(section.get("columns", "null"))
+        self.has_header = section.getboolean("has_header", False)
+        self.filename = path(section.get("filename"))
+        self.files = [(step, argument, path(section.get(key))) for key, step, argument in CONFIGURE_STEPS if section.get(key)]
+        parameters = section.get("parameters")
+        if parameters and not parameters.lstrip().startswith("{"):
+            with open(path(parameters)) as f:
+                parameters = f.read()
+        self.parameters = json.loads(parameters) if parameters else None
+        self.outputs = section.get("outputs", DEFAULT_OUTPUTS).replace(",", " ").split()
+        self.output_dir = path(os.path.join(section.get("output_dir", "data_out"), key))
+
+    def problems(self):
+        problems = []
+        if self.total_columns is None:
+            problems.append("total_columns is missing")
+        if self.columns is None:
+            problems.append("columns is missing")
+        if not self.filename:
+            problems.append("filename is missing")
+        for filename in [self.filename] + [filename for step, argument, filename in self.files]:
+            if filename and not os.path.isfile(filename):
+                problems.append("{} does not exist".format(filename))
+        return problems
+
+    def steps(self, survey_id=None):
+        # (method, kwargs) of the jobs to run, apart from previous_job_id
+        steps = [("run_job", {"survey_id": survey_id, "csv_filename": self.filename})]
+        for step, argument, filename in self.files:
+            steps.append((step, {argument: filename}))
+        if self.parameters:
+            steps.append(("configure_parameters", {"parameters": self.parameters}))
+        return steps
+
+
+def read_manifest(path):
+    # returns the server settings and the surveys of a manifest
+    parser = configparser.ConfigParser(interpolation=None)
+    if not parser.read(path):
+        raise Exception("read_manifest: Can't read {}".format(path))
+    base_dir = os.path.dirname(os.path.abspath(path))
+    server = dict(parser["server"]) if parser.has_section("server") else {}
+    surveys = []
+    for name in parser.sections():
+        if not name.startswith("survey"):
+            continue
+        section = parser[name]
+        if name == "survey" and parser.has_section("input") and not section.get("filename"):
+            # the single survey layout of example/config.ini
+            parser.set(name, "filename", parser.get("input", "filename"))
+        key = name[len("survey") :].strip(" :") or "survey"
+        surveys.append(SurveySpec(key, section, base_dir))
+    return server, surveys
+
+
+def _size(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            return "{:.1f} {}".format(num_bytes, unit) if unit != "B" else "{} B".format(int(num_bytes))
+        num_bytes /= 1024.0
+
+
+class Progress(object):
+    # prints a line of counts and throughput every interval seconds, from the Metrics of the client
+    def __init__(self, metrics, num_jobs, num_surveys, interval=5, out=sys.stderr):
+        self.metrics = metrics
+        self.num_jobs = num_jobs
+        self.num_surveys = num_surveys
+        self.done = 0
+        self.interval = interval
+        self.out = out
+        self.start_time = time.time()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._tty = hasattr(out, "isatty") and out.isatty()
+
+    def line(self):
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        sent = self.metrics.counter("bytes_sent")
+        received = self.metrics.counter("bytes_received")
+        return "[{:02d}:{:02d}:{:02d}] jobs {}/{} finished, {} failed | surveys {}/{} done | sent {} ({}/s) | received {} ({}/s) | {} requests".format(
+            int(elapsed // 3600),
+            int(elapsed % 3600 // 60),
+            int(elapsed % 60),
+            self.metrics.counter("jobs", state="finished"),
+            self.num_jobs,
+            self.metrics.counter("jobs", state="errored") + self.metrics.counter("jobs", state="canceled"),
+            self.done,
+            self.num_surveys,
+            _size(sent),
+            _size(sent / elapsed),
+            _size(received),
+            _size(received / elapsed),
+            self.metrics.counter("requests"),
+        )
+
+    def show(self, final=False):
+        if self._tty:
+            self.out.write("\r\033[K" + self.line() + ("\n" if final else ""))
+        else:
+            self.out.write(self.line() + "\n")
+        self.out.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.show()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stopped.set()
+        self._thread.join()
+        self.show(final=True)
+
+
+def dry_run(surveys, validate=True, out=sys.stdout):
+    # prints what would be done, checking the input files against their survey definitions locally
+    from .preflight import validate_csv
+
+    num_problems = 0
+    for survey in surveys:
+        action = "update survey {}".format(survey.survey_id) if survey.survey_id else "create survey"
+        out.write("{}: {} '{}'\n".format(survey.key, action, survey.name))
+        problems = survey.problems()
+        if not problems and validate:
+            report = validate_csv(survey.filename, survey.total_columns, columns=survey.columns, has_header=survey.has_header)
+            out.write("  {}: {} rows\n".format(survey.filename, report["rows"] - (1 if survey.has_header else 0)))
+            for error in report["errors"]:
+                where = "row {}".format(error["row"]) if error["row"] is not None else "file"
+                problems.append("{} {}: {}".format(survey.filename, where, error["message"]))
+        for method, kwargs in survey.steps():
+            out.write("  {} {}\n".format(method, " ".join("{}={}".format(k, v) for k, v in sorted(kwargs.items()) if v is not None)))
+        out.write("  download {} to {}\n".format(", ".join(survey.outputs), survey.output_dir))
+        for problem in problems:
+            out.write("  problem: {}\n".format(problem))
+        num_problems += len(problems)
+    out.write("{} surveys, {} jobs, {} problems\n".format(len(surveys), sum(len(survey.steps()) for survey in surveys), num_problems))
+    return num_problems
+
+
+def _connect(server, metrics, concurrency):
+    from .thematic import Thematic
+
+    base_url = server.get("base_url")
+    if not base_url:
+        raise Exception("The manifest has no base_url in [server]")
+    kwargs = {"metrics": metrics, "pool_maxsize": max(10, 2 * concurrency)}
+    api_key = os.environ.get("THEMATIC_API_KEY") or server.get("api_key")
+    if api_key:
+        return Thematic(base_url, api_key, **kwargs)
+    return Thematic.FromLogin(base_url, server.get("username"), server.get("password"), **kwargs)
+
+
+def _survey_ids(client, surveys, concurrency, state_dir):
+    # creates the surveys without an id, or updates those with one. Ids of created surveys are kept
+    # in state_dir so that running the manifest again doesn't create them again. Returns the survey
+    # ids and the errors of surveys that couldn't be set up, by survey key, so that one failing
+    # survey doesn't stop the others.
+    from concurrent.futures import ThreadPoolExecutor
+
+    saved_path = os.path.join(state_dir, "surveys.json") if state_dir else None
+    saved = {}
+    if saved_path and os.path.exists(saved_path):
+        with open(saved_path) as f:
+            saved = json.load(f)
+    lock = threading.Lock()
+
+    def prepare(survey):
+        survey_id = survey.survey_id or saved.get(survey.key)
+        if survey_id:
+            client.update_survey(
+                survey_id, name=survey.name, total_columns=survey.total_columns, columns=survey.columns, has_header=survey.has_header
+            )
+            return survey_id
+        survey_id = client.create_survey(survey.name, survey.total_columns, survey.columns, survey.has_header, modelset_id=survey.modelset_id)[
+            "survey_id"
+        ]
+        if saved_path:
+            with lock:
+                saved[survey.key] = survey_id
+                with open(saved_path + ".tmp", "w") as f:
+                    json.dump(saved, f, indent=2)
+                os.replace(saved_path + ".tmp", saved_path)
+        return survey_id
+
+    survey_ids = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [(survey, executor.submit(prepare, survey)) for survey in surveys]
+        for survey, future in futures:
+            try:
+                survey_ids[survey.key] = future.result()
+            except Exception as e:
+                log.error("Failed to set up survey {}: {}".format(survey.key, e))
+                errors[survey.key] = "survey setup failed: {}".format(e)
+    return survey_ids, errors
+
+
+def run(server, surveys, concurrency=4, max_jobs=20, state_dir=None, interval=5, out=sys.stderr):
+    # returns {survey key: {"survey_id", "job_id", "error"}}
+    from concurrent.futures import ThreadPoolExecutor
+    from .metrics import Metrics
+    from .pipeline import PipelineExecutor, Chain, Step
+
+    if state_dir and not os.path.isdir(state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+    metrics = Metrics()
+    client = _connect(server, metrics, concurrency)
+    num_jobs = sum(len(survey.steps()) for survey in surveys)
+    results = {}
+    try:
+        with Progress(metrics, num_jobs, len(surveys), interval=interval, out=out) as progress:
+            survey_ids, errors = _survey_ids(client, surveys, concurrency, state_dir)
+            for key, error in errors.items():
+                results[key] = {"survey_id": None, "job_id": None, "error": error}
+            progress.done = len(results)
+            chains = [
+                Chain(
+                    survey.key,
+                    [Step(method, **kwargs) for method, kwargs in survey.steps(survey_ids[survey.key])],
+                    survey_id=survey_ids[survey.key],
+                )
+                for survey in surveys
+                if survey.key in survey_ids
+            ]
+            specs = {survey.key: survey for survey in surveys}
+            lock = threading.Lock()
+
+            def download(key, result):
+                result = dict(result, survey_id=survey_ids[key])
+                if result["error"] is None:
+                    try:
+                        saved = client.retrieve_bundle(result["job_id"], specs[key].output_dir, outputs=specs[key].outputs, max_workers=1)
+                        missing = [output for output in specs[key].outputs if output not in saved[result["job_id"]]]
+                        if missing:
+                            result["error"] = "download failed: {} missing".format(", ".join(missing))
+                    except Exception as e:
+                        result["error"] = "download failed: {}".format(e)
+                with lock:
+                    results[key] = result
+                    progress.done = len(results)
+
+            # each survey's outputs are fetched as soon as its chain ends, one output at a time, so that
+            # concurrency bounds the downloads going on alongside the uploads of other surveys
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                executor = PipelineExecutor(
+                    client,
+                    max_workers=concurrency,
+                    max_jobs=max_jobs,
+                    state_dir=os.path.join(state_dir, "chains") if state_dir else None,
+                    on_chain_done=lambda key, result: pool.submit(download, key, result),
+                )
+                executor.run(chains)
+    finally:
+        client.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="thematic-batch", description="Run the analysis of many surveys from a manifest")
+    parser.add_argument("manifest", help="ini file of the server and the surveys to run")
+    parser.add_argument("--concurrency", type=int, default=4, help="uploads, and downloads, at once (default 4)")
+    parser.add_argument("--max-jobs", type=int, default=20, help="jobs in flight at once (default 20)")
+    parser.add_argument("--state-dir", help="keep progress here, so that running again carries on where it stopped")
+    parser.add_argument("--only", nargs="+", metavar="SURVEY", help="run only these surveys of the manifest")
+    parser.add_argument("--dry-run", action="store_true", help="check the manifest and input files and show what would run")
+    parser.add_argument("--no-validate", action="store_true", help="don't check input files against their surveys in a dry run")
+    parser.add_argument("--progress-interval", type=float, default=5, help="seconds between progress lines (default 5)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log each request and job")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    server, surveys = read_manifest(args.manifest)
+    if args.only:
+        unknown = set(args.only) - set(survey.key for survey in surveys)
+        if unknown:
+            parser.error("not in the manifest: {}".format(", ".join(sorted(unknown))))
+        surveys = [survey for survey in surveys if survey.key in args.only]
+    if args.dry_run:
+        return 1 if dry_run(surveys, validate=not args.no_validate) else 0
+
+    problems = ["{}: {}".format(survey.key, problem) for survey in surveys for problem in survey.problems()]
+    if problems:
+        for problem in problems:
+            sys.stderr.write(problem + "\n")
+        return 2
+    results = run(server, surveys, concurrency=args.concurrency, max_jobs=args.max_jobs, state_dir=args.state_dir, interval=args.progress_interval)
+    failed = {key: result for key, result in results.items() if result["error"]}
+    for key, result in sorted(results.items()):
+        sys.stdout.write("{}\t{}\t{}\t{}\n".format(key, result["survey_id"], result["job_id"], result["error"] or "ok"))
+    if failed:
+        sys.stderr.write("{} of {} surveys failed\n".format(len(failed), len(results)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+import io
+import os
+import csv
+import json
+import array
+import hashlib
+
+
+def _original_version(filename):
+    # the size, modification time and content digest of a file, to tell later whether it has changed
+    stat = os.stat(filename)
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256.hexdigest()}
+
+
+class DuplicateMap(object):
+    # For each row of an original file, the index of the row that was uploaded in its place.
+    # widths holds the number of columns of each uploaded row, which is where the coded columns
+    # added by the server start. original is the size, modification time and digest of the original
+    # file when it was collapsed, as the rows only map onto that version of it.
+    def __init__(self, original_filename, has_header, rows=None, widths=None, original=None):
+        self.original_filename = original_filename
+        self.has_header = has_header
+        self.original = original
+        self.rows = rows if rows is not None else array.array("q")
+        self.widths = widths if widths is not None else array.array("q")
+
+    @property
+    def num_unique(self):
+        return len(self.widths)
+
+    def save(self, path):
+        with open(path + ".rows", "wb") as f:
+            self.rows.tofile(f)
+        with open(path + ".widths", "wb") as f:
+            self.widths.tofile(f)
+        with open(path, "w") as f:
+            json.dump(
+                {"original_filename": self.original_filename, "has_header": self.has_header, "num_rows": len(self.rows), "original": self.original}, f
+            )
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            meta = json.load(f)
+        duplicates = cls(meta["original_filename"], meta["has_header"], original=meta.get("original"))
+        with open(path + ".rows", "rb") as f:
+            duplicates.rows.fromfile(f, meta["num_rows"])
+        with open(path + ".widths", "rb") as f:
+            duplicates.widths.frombytes(f.read())
+        return duplicates
+
+    def check_original(self):
+        # raises if the original file is gone or isn't the one that was collapsed any more
+        if not os.path.exists(self.original_filename):
+            raise Exception("expand_results: The original file {} no longer exists".format(self.original_filename))
+        if self.original is None:
+            return
+        stat = os.stat(self.original_filename)
+        if stat.st_size == self.original["size"] and stat.st_mtime_ns == self.original["mtime_ns"]:
+            return
+        if stat.st_size != self.original["size"] or _original_version(self.original_filename)["sha256"] != self.original["sha256"]:
+            raise Exception(
+                "expand_results: {} has changed since it was uploaded, so its rows no longer match the results".format(self.original_filename)
+            )
+
+
+def collapse_duplicates(csv_filename, out_file_obj, columns=None, has_header=False):
+    # Writes each distinct row of csv_filename to out_file_obj once, comparing only the given column
+    # indexes (or whole rows if columns is None). Rows are compared by digest, so memory grows with
+    # the number of distinct rows rather than the size of the file.
+    duplicates = DuplicateMap(csv_filename, has_header, original=_original_version(csv_filename))
+    seen = {}
+    with io.open(csv_filename, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        writer = csv.writer(out_file_obj)
+        if has_header:
+            header = next(reader, None)
+            if header is not None:
+                writer.writerow(header)
+        for row in reader:
+            key = row if columns is None else [row[i] if i < len(row) else "" for i in columns]
+            digest = hashlib.sha1(json.dumps(key, ensure_ascii=False).encode("utf-8")).digest()
+            index = seen.get(digest)
+            if index is None:
+                index = len(seen)
+                seen[digest] = index
+                duplicates.widths.append(len(row))
+                writer.writerow(row)
+            duplicates.rows.append(index)
+    return duplicates
+
+
+def expand_results(coded_file_obj, duplicates, out_file_obj):
+    # Re-expands the coded output of a collapsed upload to the rows of the original file, in order.
+    # Only the coded columns of each distinct row are kept in memory.
+    duplicates.check_original()
+    reader = csv.reader(coded_file_obj)
+    header = next(reader, None) if duplicates.has_header else None
+    codes = []
+    for row in reader:
+        if len(codes) == duplicates.num_unique:
+            raise Exception("expand_results: Got more coded rows than the {} that were uploaded".format(duplicates.num_unique))
+        codes.append(row[duplicates.widths[len(codes)] :])
+    if len(codes) != duplicates.num_unique:
+        raise Exception("expand_results: Expected {} coded rows but got {}".format(duplicates.num_unique, len(codes)))
+
+    writer = csv.writer(out_file_obj)
+    with io.open(duplicates.original_filename, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        if duplicates.has_header:
+            original_header = next(reader, None)
+            writer.writerow(header if header is not None else original_header)
+        for row, index in zip(reader, duplicates.rows):
+            writer.writerow(row + codes[index])
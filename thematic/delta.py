@@ -0,0 +1,196 @@
+import os
+import io
+import csv
+import json
+import shutil
+import sqlite3
+import hashlib
+import logging
+import tempfile
+
+log = logging.getLogger(__name__)
+
+_BATCH_SIZE = 10000
+
+
+def _key_columns(disambiguation_columns, header):
+    # the indexes of the disambiguation columns, which are given as indexes or as names in the header
+    if disambiguation_columns is None or disambiguation_columns == []:
+        return None
+    if isinstance(disambiguation_columns, (str, int)):
+        disambiguation_columns = [disambiguation_columns]
+    indexes = []
+    for column in disambiguation_columns:
+        if isinstance(column, int):
+            indexes.append(column)
+        elif header is not None and column in header:
+            indexes.append(header.index(column))
+        elif str(column).isdigit():
+            indexes.append(int(column))
+        else:
+            raise Exception("sync: Unknown disambiguation column {}".format(column))
+    return indexes
+
+
+def _read_header(csv_filename):
+    with io.open(csv_filename, "r", encoding="utf-8", newline="") as f:
+        return next(csv.reader(f), None)
+
+
+class DeltaSync(object):
+    # Keeps a local index of the rows already sent for each survey, and sends only the changes in
+    # a new export: removed rows through delete_rows and new rows through run_incremental_update.
+    # Rows are identified by a hash of their whole content, so a changed row is deleted and re-added.
+    # The index is an SQLite database per survey in index_dir, so comparing a file of any size
+    # needs little memory.
+    #
+    # The server deletes rows by their disambiguation columns, so a delete takes every row sharing
+    # those values with it: the identical copies of a row that only has fewer copies than before,
+    # and different rows with the same key. The index keeps each row's key, and the rows of a deleted
+    # key that are still in the export are added again after the delete. The index only records a job's changes once the job has finished, so a job that fails leaves
+    # them to be sent again by the next sync.
+    def __init__(self, client, index_dir):
+        self.client = client
+        self.index_dir = index_dir
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir, exist_ok=True)
+
+    def _connect(self, survey_id):
+        name = hashlib.sha1(str(survey_id).encode("utf-8")).hexdigest()
+        conn = sqlite3.connect(os.path.join(self.index_dir, name + ".sqlite"))
+        conn.execute("CREATE TABLE IF NOT EXISTS rows (hash TEXT PRIMARY KEY, row TEXT NOT NULL, count INTEGER NOT NULL, key TEXT)")
+        if "key" not in [column[1] for column in conn.execute("PRAGMA table_info(rows)")]:
+            # indexes made before rows had keys get them on the next sync
+            conn.execute("ALTER TABLE rows ADD COLUMN key TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS rows_key ON rows (key)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        return conn
+
+    def _use_key_columns(self, conn, key_columns):
+        # row_key(row) in queries gives a hash of the disambiguation columns of a row, or of the whole
+        # row without any
+        def row_key(encoded):
+            if key_columns is not None:
+                row = json.loads(encoded)
+                encoded = json.dumps([row[i] if i < len(row) else "" for i in key_columns], ensure_ascii=False)
+            return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+        conn.create_function("row_key", 1, row_key)
+        # the keys in the index are those of the columns last used, and are worked out again if they change
+        if self._get_meta(conn, "key_columns") != {"columns": key_columns}:
+            conn.execute("UPDATE rows SET key = row_key(row)")
+            self._set_meta(conn, "key_columns", {"columns": key_columns})
+
+    def _get_meta(self, conn, key):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def _load_incoming(self, conn, csv_filename, has_header):
+        # streams the export into a temporary table of (hash, row), then counts each distinct row
+        conn.execute("DROP TABLE IF EXISTS temp.incoming")
+        conn.execute("DROP TABLE IF EXISTS temp.counts")
+        conn.execute("CREATE TEMP TABLE incoming (hash TEXT, row TEXT)")
+        header = None
+        with io.open(csv_filename, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            if has_header:
+                header = next(reader, None)
+            batch = []
+            for row in reader:
+                encoded = json.dumps(row, ensure_ascii=False)
+                batch.append((hashlib.sha1(encoded.encode("utf-8")).hexdigest(), encoded))
+                if len(batch) >= _BATCH_SIZE:
+                    conn.executemany("INSERT INTO incoming VALUES (?, ?)", batch)
+                    batch = []
+            conn.executemany("INSERT INTO incoming VALUES (?, ?)", batch)
+        conn.execute("CREATE TEMP TABLE counts AS SELECT hash, row, count, row_key(row) AS key FROM (SELECT hash, MIN(row) AS row, COUNT(*) AS count FROM incoming GROUP BY hash)")
+        conn.execute("CREATE INDEX temp.counts_hash ON counts (hash)")
+        conn.execute("CREATE INDEX temp.counts_key ON counts (key)")
+        conn.execute("DROP TABLE temp.incoming")
+        return header
+
+    def _write_rows(self, conn, query, path, header):
+        num_rows = 0
+        with io.open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            if header is not None:
+                writer.writerow(header)
+            for encoded, count in conn.execute(query):
+                row = json.loads(encoded)
+                for _ in range(count):
+                    writer.writerow(row)
+                num_rows += count
+        return num_rows
+
+    def seed(self, survey_id, csv_filename, job_id, has_header=False):
+        # records the rows of a file that has already been uploaded, e.g. by run_job or run_replace_data
+        conn = self._connect(survey_id)
+        try:
+            self._use_key_columns(conn, None)
+            self._load_incoming(conn, csv_filename, has_header)
+            conn.execute("DELETE FROM rows")
+            conn.execute("INSERT INTO rows (hash, row, count, key) SELECT hash, row, count, key FROM counts")
+            self._set_meta(conn, "job_id", job_id)
+            self._set_meta(conn, "has_header", has_header)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def sync(self, survey_id, csv_filename, disambiguation_columns, previous_job_id=None, has_header=None, job_options={}):
+        conn = self._connect(survey_id)
+        tmp_dir = tempfile.mkdtemp(prefix="thematic-delta-")
+        try:
+            if previous_job_id is None:
+                previous_job_id = self._get_meta(conn, "job_id")
+            if previous_job_id is None:
+                raise Exception("sync: No index for survey {}, call seed() with the data of its last job first".format(survey_id))
+            if has_header is None:
+                has_header = bool(self._get_meta(conn, "has_header"))
+
+            self._use_key_columns(conn, _key_columns(disambiguation_columns, _read_header(csv_filename) if has_header else None))
+            header = self._load_incoming(conn, csv_filename, has_header)
+            removed_path = os.path.join(tmp_dir, "removed.csv")
+            added_path = os.path.join(tmp_dir, "added.csv")
+            # the keys of rows with fewer copies than before, each deleted once, which removes every
+            # row with that key
+            conn.execute("DROP TABLE IF EXISTS temp.removed")
+            conn.execute(
+                "CREATE TEMP TABLE removed AS SELECT r.key AS key, MIN(r.row) AS row FROM rows r LEFT JOIN counts c ON c.hash = r.hash "
+                "WHERE r.count > IFNULL(c.count, 0) GROUP BY r.key"
+            )
+            conn.execute("CREATE INDEX temp.removed_key ON removed (key)")
+            num_removed = self._write_rows(conn, "SELECT row, 1 FROM removed", removed_path, header)
+            # new copies of rows, and every copy of the rows in the export whose key is deleted
+            num_added = self._write_rows(
+                conn,
+                "SELECT c.row, CASE WHEN c.key IN (SELECT key FROM removed) THEN c.count ELSE c.count - IFNULL(r.count, 0) END "
+                "FROM counts c LEFT JOIN rows r ON r.hash = c.hash WHERE c.key IN (SELECT key FROM removed) OR c.count > IFNULL(r.count, 0)",
+                added_path,
+                header,
+            )
+            log.info("Survey {}: {} rows to add and {} keys to delete since job {}".format(survey_id, num_added, num_removed, previous_job_id))
+
+            job_id = previous_job_id
+            # deletes go first, so that rows which changed aren't removed again after being re-added
+            if num_removed:
+                job_id = self.client.delete_rows(survey_id, removed_path, job_id, disambiguation_columns)
+                # raises if the job fails, leaving the index as it was
+                self.client.wait_for_job_completion(job_id)
+                conn.execute("DELETE FROM rows WHERE key IN (SELECT key FROM removed)")
+                self._set_meta(conn, "job_id", job_id)
+                conn.commit()
+            if num_added:
+                job_id = self.client.run_incremental_update(
+                    survey_id, added_path, job_id, disambiguation_columns=disambiguation_columns, job_options=job_options
+                )
+                self.client.wait_for_job_completion(job_id)
+                conn.execute("INSERT OR REPLACE INTO rows (hash, row, count, key) SELECT hash, row, count, key FROM counts")
+                self._set_meta(conn, "job_id", job_id)
+                conn.commit()
+            return {"job_id": job_id, "added": num_added, "removed": num_removed}
+        finally:
+            conn.close()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
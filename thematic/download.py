@@ -0,0 +1,261 @@
+import os
+import re
+import json
+import mmap
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+
+class DownloadError(Exception):
+    pass
+
+
+class _Changed(DownloadError):
+    # the file changed on the server since part of it was downloaded
+    pass
+
+
+def _validator(r):
+    # what identifies this version of the file, to send as If-Range when resuming: a strong ETag, or Last-Modified
+    etag = r.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return r.headers.get("Last-Modified")
+
+
+def content_range(r):
+    match = _CONTENT_RANGE.match(r.headers.get("Content-Range", ""))
+    if not match:
+        raise DownloadError("Bad Content-Range in response: {}".format(r.headers.get("Content-Range")))
+    return int(match.group(1)), int(match.group(2)), int(match.group(3))
+
+
+class Downloader(object):
+    # Downloads a URL into memory, a file object, or a path.
+    # Paths are written through a ".part" file next to the destination. When the server supports
+    # range requests, files bigger than min_segment_size are fetched as parallel segments written
+    # straight into a memory map of the part file, and progress is kept in a small ".part.json"
+    # state file so that an interrupted download carries on where it stopped. The state holds the
+    # URL and the ETag (or Last-Modified) of the file, and a part file is only resumed for the same
+    # URL, with If-Range so that a file that has changed since is fetched again from the start.
+    def __init__(self, request, chunk_size=1024 * 1024, segments=4, min_segment_size=8 * 1024 * 1024):
+        self.request = request
+        self.chunk_size = chunk_size
+        self.segments = segments
+        self.min_segment_size = min_segment_size
+
+    def _get(self, url, headers, byte_range=None, stream=True, validator=None):
+        headers = dict(headers or {})
+        if byte_range is not None:
+            # ranges refer to the encoded bytes, so ask for them unencoded
+            headers["Range"] = "bytes={}-{}".format(*byte_range)
+            headers["Accept-Encoding"] = "identity"
+            if validator:
+                headers["If-Range"] = validator
+        return self.request("GET", url, headers=headers, stream=stream)
+
+    def _failed(self, r):
+        log.error("Failed to retrieve. Code {} message {}".format(r.status_code, r.text))
+        return None
+
+    def open(self, url, headers):
+        # the streamed response, for the caller to read and close, or None if the request failed
+        r = self._get(url, headers)
+        if r.status_code != 200:
+            with r:
+                return self._failed(r)
+        return r
+
+    def to_bytes(self, url, headers):
+        r = self._get(url, headers, stream=False)
+        if r.status_code != 200:
+            return self._failed(r)
+        return r.content
+
+    def to_file(self, url, headers, file_obj):
+        r = self._get(url, headers)
+        with r:
+            if r.status_code != 200:
+                return self._failed(r)
+            self._copy(r, file_obj)
+        return True
+
+    def _copy(self, r, file_obj):
+        for chunk in r.iter_content(chunk_size=self.chunk_size):
+            file_obj.write(chunk)
+
+    def to_path(self, url, headers, path, resume=True):
+        part_path = path + ".part"
+        state_path = part_path + ".json"
+        state = self._load_state(state_path, part_path, url) if resume else None
+        if not resume:
+            self._discard(part_path, state_path)
+            state_path = None
+
+        if state is not None:
+            try:
+                if state.get("segments"):
+                    self._download_segments(url, headers, part_path, state_path, state)
+                elif self._resume_stream(url, headers, part_path, state_path, state) is None:
+                    return None
+            except _Changed:
+                log.warning("{} changed since it was partly downloaded, downloading it again".format(url))
+                self._discard(part_path, state_path)
+                state = None
+        if state is None:
+            first = self._get(url, headers, byte_range=(0, self.min_segment_size - 1))
+            state = self._start(first, url, headers, part_path, state_path)
+            if state is None:
+                return None
+            if state.get("segments"):
+                self._download_segments(url, headers, part_path, state_path, state, first)
+        os.replace(part_path, path)
+        if state_path and os.path.exists(state_path):
+            os.remove(state_path)
+        return True
+
+    def _start(self, r, url, headers, part_path, state_path):
+        state = {"url": url, "validator": _validator(r)}
+        if r.status_code == 416:
+            # an empty file has no ranges
+            r.close()
+            self._save_state(state_path, state)
+            return self._resume_stream(url, headers, part_path, state_path, dict(state, offset=0))
+        if r.status_code not in (200, 206):
+            with r:
+                return self._failed(r)
+        if r.status_code == 206:
+            start, end, total = content_range(r)
+        if r.status_code == 200 or end + 1 >= total:
+            # no range support, or small enough to come in one response: the whole file is in this
+            # response, written as a plain stream that can resume from its size
+            self._save_state(state_path, state)
+            with r, open(part_path, "wb") as f:
+                self._copy(r, f)
+            return state
+        # the first response is the first segment, the rest is split between parallel requests. The
+        # state is saved before the part file gets its full size, so that a full size part file
+        # always has the state that says which of its bytes have been written.
+        state.update({"total": total, "segments": [[0, end, 0]] + self._split(end + 1, total)})
+        self._save_state(state_path, state)
+        with open(part_path, "wb") as f:
+            f.truncate(total)
+        return state
+
+    def _resume_stream(self, url, headers, part_path, state_path, state):
+        offset = state["offset"]
+        if offset:
+            r = self._get(url, headers, byte_range=(offset, ""), validator=state.get("validator"))
+        else:
+            r = self._get(url, headers)
+        with r:
+            if r.status_code in (206, 416) and None not in (state.get("validator"), _validator(r)) and _validator(r) != state["validator"]:
+                raise _Changed(url)
+            if r.status_code == 416:
+                # nothing left to fetch, unless the file is now a different size
+                match = re.match(r"bytes \*/(\d+)", r.headers.get("Content-Range", ""))
+                if match and int(match.group(1)) != offset:
+                    raise _Changed(url)
+                return state
+            if r.status_code == 206 and content_range(r)[0] == offset:
+                mode = "ab"
+            elif r.status_code == 200:
+                # the server sent the whole file, because it has changed or doesn't do ranges
+                mode = "wb"
+                state = {"url": url, "validator": _validator(r)}
+                self._save_state(state_path, state)
+            else:
+                return self._failed(r)
+            with open(part_path, mode) as f:
+                self._copy(r, f)
+        return state
+
+    def _load_state(self, state_path, part_path, url):
+        # the state of an interrupted download of url, or None after removing a part file that can't be resumed
+        if not os.path.exists(part_path):
+            return None
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+            if state.get("url") == url:
+                if not state.get("segments"):
+                    # a single stream download, which carries on from the end of the part file
+                    return dict(state, offset=os.path.getsize(part_path))
+                if os.path.getsize(part_path) == state["total"]:
+                    return state
+        except (ValueError, KeyError, OSError):
+            pass
+        # a part file of another download, or one without the state to tell what it holds
+        self._discard(part_path, state_path)
+        return None
+
+    def _discard(self, part_path, state_path):
+        for stale_path in (part_path, state_path):
+            if stale_path and os.path.exists(stale_path):
+                os.remove(stale_path)
+
+    def _save_state(self, state_path, state):
+        if not state_path:
+            return
+        tmp_path = state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_path)
+
+    def _split(self, start, total):
+        if start >= total:
+            return []
+        count = max(1, min(self.segments, (total - start) // self.min_segment_size))
+        size = (total - start + count - 1) // count
+        return [[offset, min(total, offset + size) - 1, 0] for offset in range(start, total, size)]
+
+    def _download_segments(self, url, headers, part_path, state_path, state, first=None):
+        lock = threading.Lock()
+
+        def fetch(segment, r=None):
+            start, end, done = segment
+            if start + done > end:
+                if r is not None:
+                    r.close()
+                return
+            if r is None:
+                r = self._get(url, headers, byte_range=(start + done, end), validator=state.get("validator"))
+            with r:
+                if r.status_code == 200 or (None not in (state.get("validator"), _validator(r)) and _validator(r) != state["validator"]):
+                    raise _Changed(url)
+                if r.status_code != 206 or content_range(r)[0] != start + done:
+                    raise DownloadError("Range request failed with code {}".format(r.status_code))
+                position = start + done
+                since_save = 0
+                try:
+                    for chunk in r.iter_content(chunk_size=self.chunk_size):
+                        mm[position : position + len(chunk)] = chunk
+                        position += len(chunk)
+                        since_save += len(chunk)
+                        if since_save >= 8 * self.chunk_size:
+                            with lock:
+                                segment[2] = position - start
+                                self._save_state(state_path, state)
+                            since_save = 0
+                finally:
+                    with lock:
+                        segment[2] = position - start
+                        self._save_state(state_path, state)
+            if position != end + 1:
+                raise DownloadError("Segment ended early at {} instead of {}".format(position, end + 1))
+
+        with open(part_path, "r+b") as f:
+            mm = mmap.mmap(f.fileno(), state["total"])
+            try:
+                with ThreadPoolExecutor(max_workers=len(state["segments"])) as executor:
+                    futures = [executor.submit(fetch, segment, first if i == 0 else None) for i, segment in enumerate(state["segments"])]
+                    for future in futures:
+                        future.result()
+                mm.flush()
+            finally:
+                mm.close()
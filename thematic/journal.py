@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import inspect
+import logging
+
+from .thematic import TERMINAL_STATES, job_id_of, job_created
+
+log = logging.getLogger(__name__)
+
+
+def _is_file_argument(name, value):
+    return isinstance(value, str) and (name.endswith("filename") or name.endswith("_file")) and os.path.isfile(value)
+
+
+class JobJournal(object):
+    # A local record of the jobs submitted through it, kept in an SQLite database so it survives the
+    # process dying at any point. Each job is keyed by survey, operation (the Thematic method that
+    # made it) and a hash of its inputs, where files count by their content. Running the same
+    # operation on the same inputs again gives back the job already submitted, whether it is still
+    # in flight or finished, instead of uploading everything again.
+    #
+    # The submission is recorded before the upload starts, so a job whose id never came back
+    # because the process died mid-request can be found again with list_jobs. The journal registers
+    # a job hook on the client, so waiting for a job in any way records how it ended.
+    #
+    #   journal = JobJournal(client, "jobs.sqlite")
+    #   job_id = journal.run(survey_id, "run_job", csv_filename="input.csv")
+    #   client.wait_for_job_completion(job_id)
+    #
+    # Finished jobs are reused for max_age seconds, or for good if it is None.
+    # Jobs listed up to clock_skew seconds before a submission started can be matched to it.
+    clock_skew = 300
+
+    def __init__(self, client, path, max_age=None):
+        self.client = client
+        self.path = path
+        self.max_age = max_age
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "survey_id TEXT NOT NULL, operation TEXT NOT NULL, input_hash TEXT NOT NULL, job_id TEXT, state TEXT NOT NULL, "
+                "submitted REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY (survey_id, operation, input_hash))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_job_id ON jobs (job_id)")
+            conn.commit()
+        finally:
+            conn.close()
+        client.job_hooks.append(self._job_ended)
+
+    def _connect(self):
+        # a connection per call, so the journal can be used from several threads and processes
+        return sqlite3.connect(self.path, timeout=60)
+
+    def input_hash(self, survey_id, operation, kwargs):
+        inputs = {}
+        for name, value in kwargs.items():
+            if _is_file_argument(name, value):
+                value = {"sha256": self.client._file_digest(value)}
+            inputs[name] = value
+        encoded = json.dumps([str(survey_id), operation, inputs], sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _entry(self, conn, key):
+        row = conn.execute("SELECT job_id, state, submitted, updated FROM jobs WHERE survey_id = ? AND operation = ? AND input_hash = ?", key).fetchone()
+        if row is None:
+            return None
+        return {"job_id": row[0], "state": row[1], "submitted": row[2], "updated": row[3]}
+
+    def _set(self, conn, key, job_id, state, submitted=None):
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (survey_id, operation, input_hash, job_id, state, submitted, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            key + (job_id, state, submitted if submitted is not None else now, now),
+        )
+        conn.commit()
+
+    def _set_state(self, job_id, state):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE job_id = ? AND state != ?", (state, time.time(), job_id, state))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _job_ended(self, event):
+        self._set_state(event["job_id"], event["state"])
+
+    def _find_submitted(self, conn, survey_id, submitted):
+        # the job made by a submission whose id was lost: the one job of the survey created after it
+        # started that the journal doesn't already know of
+        jobs = self.client.list_jobs(survey_id=survey_id)
+        known = set(row[0] for row in conn.execute("SELECT job_id FROM jobs WHERE survey_id = ? AND job_id IS NOT NULL", (str(survey_id),)))
+        candidates = []
+        for job in jobs:
+            created = job_created(job)
+            job_id = job_id_of(job)
+            if job_id and job_id not in known and created is not None and created >= submitted - self.clock_skew:
+                candidates.append(job)
+        if len(candidates) != 1:
+            if candidates:
+                log.warning("{} jobs of survey {} could belong to an interrupted submission, not reattaching".format(len(candidates), survey_id))
+            return None
+        return candidates[0]
+
+    def _reattach(self, conn, key, entry):
+        # the job id to carry on with for a journal entry, or None if the job has to be submitted again
+        survey_id, operation = key[0], key[1]
+        if entry["state"] == "submitting":
+            job = self._find_submitted(conn, survey_id, entry["submitted"])
+            if job is None:
+                log.warning("{} for survey {} was interrupted before a job was made, submitting again".format(operation, survey_id))
+                return None
+            entry["job_id"] = job_id_of(job)
+            log.info("Found job {} from the interrupted {} for survey {}".format(entry["job_id"], operation, survey_id))
+            state = job.get("state") or self.client.get_job_details(entry["job_id"])["state"]
+        elif entry["state"] == "finished":
+            if self.max_age is not None and time.time() - entry["updated"] > self.max_age:
+                return None
+            log.info("{} for survey {} already finished as job {}".format(operation, survey_id, entry["job_id"]))
+            return entry["job_id"]
+        elif entry["state"] in TERMINAL_STATES:
+            return None
+        else:
+            state = self.client.get_job_details(entry["job_id"])["state"]
+        if state in ("errored", "canceled"):
+            log.warning("Job {} from an earlier {} for survey {} is {}, submitting again".format(entry["job_id"], operation, survey_id, state))
+            self._set(conn, key, entry["job_id"], state, entry["submitted"])
+            return None
+        self._set(conn, key, entry["job_id"], state, entry["submitted"])
+        if state != "finished":
+            log.info("Reattaching to job {} from an earlier {} for survey {}".format(entry["job_id"], operation, survey_id))
+        return entry["job_id"]
+
+    def run(self, survey_id, operation, **kwargs):
+        # calls the client method named operation, passing survey_id too if it takes one, unless the
+        # journal already has a job for the same inputs. Returns the job id.
+        method = getattr(self.client, operation)
+        key = (str(survey_id), operation, self.input_hash(survey_id, operation, kwargs))
+        conn = self._connect()
+        try:
+            entry = self._entry(conn, key)
+            if entry is not None:
+                job_id = self._reattach(conn, key, entry)
+                if job_id is not None:
+                    return job_id
+            self._set(conn, key, None, "submitting")
+            if "survey_id" in inspect.signature(method).parameters:
+                kwargs = dict(kwargs, survey_id=survey_id)
+            try:
+                job_id = method(**kwargs)
+            except BaseException as e:
+                # a failed request made no job, but a process that is stopping may have
+                if isinstance(e, Exception):
+                    conn.execute("DELETE FROM jobs WHERE survey_id = ? AND operation = ? AND input_hash = ?", key)
+                    conn.commit()
+                raise
+            self._set(conn, key, job_id, "submitted")
+            return job_id
+        finally:
+            conn.close()
+
+    def in_flight(self, survey_id=None):
+        # (survey id, operation, job id) of the jobs not yet known to have ended
+        conn = self._connect()
+        try:
+            query = "SELECT survey_id, operation, job_id FROM jobs WHERE state NOT IN ('finished', 'errored', 'canceled')"
+            params = ()
+            if survey_id is not None:
+                query += " AND survey_id = ?"
+                params = (str(survey_id),)
+            return [tuple(row) for row in conn.execute(query + " ORDER BY submitted", params)]
+        finally:
+            conn.close()
+
+    def reconcile(self, survey_id=None):
+        # brings the journal up to date with the server after a restart: looks up the jobs of
+        # interrupted submissions and the current state of every job in flight, with one list_jobs
+        # call per survey. Returns {job id: survey id} of the jobs still to wait for, e.g. with
+        # client.wait_for_jobs(list(job_surveys), survey_id=job_surveys).
+        conn = self._connect()
+        try:
+            query = "SELECT survey_id, operation, input_hash, job_id, state, submitted FROM jobs WHERE state NOT IN ('finished', 'errored', 'canceled')"
+            params = ()
+            if survey_id is not None:
+                query += " AND survey_id = ?"
+                params = (str(survey_id),)
+            rows = conn.execute(query, params).fetchall()
+            job_surveys = {}
+            for row_survey_id, operation, input_hash, job_id, state, submitted in rows:
+                key = (row_survey_id, operation, input_hash)
+                if state != "submitting":
+                    job_surveys[job_id] = row_survey_id
+                    continue
+                job = self._find_submitted(conn, row_survey_id, submitted)
+                if job is None:
+                    conn.execute("DELETE FROM jobs WHERE survey_id = ? AND operation = ? AND input_hash = ?", key)
+                    conn.commit()
+                    continue
+                self._set(conn, key, job_id_of(job), job.get("state") or "submitted", submitted)
+                job_surveys[job_id_of(job)] = row_survey_id
+            if not job_surveys:
+                return {}
+            states = self.client._poll_job_states(list(job_surveys), dict(job_surveys))
+            for job_id, job_details in states.items():
+                conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE job_id = ?", (job_details["state"], time.time(), job_id))
+            conn.commit()
+            return {job_id: job_surveys[job_id] for job_id, job_details in states.items() if job_details["state"] not in TERMINAL_STATES}
+        finally:
+            conn.close()
+
+    def forget(self, survey_id=None, operation=None):
+        # drops entries so that the next run submits again
+        conn = self._connect()
+        try:
+            query = "DELETE FROM jobs WHERE 1 = 1"
+            params = []
+            if survey_id is not None:
+                query += " AND survey_id = ?"
+                params.append(str(survey_id))
+            if operation is not None:
+                query += " AND operation = ?"
+                params.append(operation)
+            conn.execute(query, params)
+            conn.commit()
+        finally:
+            conn.close()
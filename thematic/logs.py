@@ -0,0 +1,33 @@
+import codecs
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class LogTail(object):
+    # Where a reader of a job's log is up to. offset is the number of bytes of the log already
+    # seen, which is asked for as a Range so only new bytes are sent. Servers that ignore the
+    # Range send the whole log, and the part already seen is skipped here instead. Lines are only
+    # given out once complete, and text is decoded incrementally so characters split between
+    # responses come out whole.
+    def __init__(self, offset=0):
+        self.offset = offset
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._partial = ""
+
+    def feed(self, data, start=0):
+        # data is the log from byte start on; returns the lines completed by it
+        if start > self.offset:
+            log.warning("Log skipped from byte {} to {}".format(self.offset, start))
+            self.offset = start
+        data = data[self.offset - start :]
+        self.offset += len(data)
+        lines = (self._partial + self._decoder.decode(data)).split("\n")
+        self._partial = lines.pop()
+        return [line.rstrip("\r") for line in lines]
+
+    def flush(self):
+        # the last line if the log doesn't end with a line break, once no more is coming
+        partial = self._partial + self._decoder.decode(b"", final=True)
+        self._partial = ""
+        return [partial.rstrip("\r")] if partial else []
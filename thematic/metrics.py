@@ -0,0 +1,196 @@
+import re
+import time
+import bisect
+import logging
+import threading
+from urllib.parse import urlparse
+
+log = logging.getLogger(__name__)
+
+# upper bounds in seconds, wide enough for both single requests and whole jobs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+_ID_SEGMENT = re.compile(r"/(job|survey)/[^/]+")
+
+
+def endpoint_of(base_url, url):
+    # the route of a url with job and survey ids replaced, e.g. /job/{id}/info, so requests can be grouped
+    if url.startswith(base_url):
+        url = url[len(base_url) :]
+    path = urlparse(url).path.rstrip("/") or "/"
+    return _ID_SEGMENT.sub(lambda m: "/" + m.group(1) + "/{id}", path)
+
+
+def job_event(watch):
+    # the timings of a job that has ended, from the JobWatch that followed it
+    return {
+        "job_id": watch.job_id,
+        "state": watch.state,
+        "queue_seconds": watch.queue_seconds,
+        "processing_seconds": watch.processing_seconds,
+        "wait_seconds": (watch.end_time or time.time()) - watch.start_time,
+    }
+
+
+def call_hooks(hooks, event):
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception as e:
+            # instrumentation must never break a request
+            log.warning("Instrumentation hook {} failed: {}".format(hook, e))
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # the last count is for values above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        # estimated by interpolating within the bucket the percentile falls in
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else self.min
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def to_dict(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append([bound, total])
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": cumulative,
+        }
+
+
+class Metrics(object):
+    # Counters and latency histograms built from the events of one or more clients. Pass an instance
+    # as metrics= to Thematic or AsyncThematic, and read it back with snapshot() or to_prometheus().
+    #
+    # Requests are counted per endpoint, method and status, along with their retries and the bytes
+    # sent and received, and their latency (including time spent on retries) goes to request_seconds.
+    # Jobs that were waited for are counted per final state, with their time in the queue and
+    # processing in job_queue_seconds and job_processing_seconds.
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def record_request(self, event):
+        labels = {"endpoint": event["endpoint"], "method": event["method"]}
+        status = event["status"] if event["status"] is not None else "error"
+        self.increment("requests", status=str(status), **labels)
+        if event["retries"]:
+            self.increment("request_retries", event["retries"], **labels)
+        if event["bytes_sent"]:
+            self.increment("bytes_sent", event["bytes_sent"], **labels)
+        if event["bytes_received"]:
+            self.increment("bytes_received", event["bytes_received"], **labels)
+        self.observe("request_seconds", event["seconds"], **labels)
+
+    def record_job(self, event):
+        self.increment("jobs", state=event["state"])
+        if event["queue_seconds"] is not None:
+            self.observe("job_queue_seconds", event["queue_seconds"], state=event["state"])
+        if event["processing_seconds"] is not None:
+            self.observe("job_processing_seconds", event["processing_seconds"], state=event["state"])
+        self.observe("job_wait_seconds", event["wait_seconds"], state=event["state"])
+
+    def counter(self, name, **labels):
+        # the sum over every series of the counter matching the given labels
+        with self._lock:
+            return sum(
+                value for (key, key_labels), value in self._counters.items() if key == name and set(labels.items()) <= set(key_labels)
+            )
+
+    def snapshot(self):
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(self._counters.items())]
+            histograms = [dict(histogram.to_dict(), name=name, labels=dict(labels)) for (name, labels), histogram in sorted(self._histograms.items())]
+        return {"counters": counters, "histograms": histograms}
+
+    def to_prometheus(self, prefix="thematic_"):
+        # the text exposition format, to be served or written for a node exporter's textfile collector
+        def format_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            names = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in names:
+                    names.add(name)
+                    lines.append("# TYPE {}{}_total counter".format(prefix, name))
+                lines.append("{}{}_total{} {}".format(prefix, name, format_labels(labels), value))
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in names:
+                    names.add(name)
+                    lines.append("# TYPE {}{} histogram".format(prefix, name))
+                total = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    total += count
+                    lines.append("{}{}_bucket{} {}".format(prefix, name, format_labels(labels, [("le", bound)]), total))
+                lines.append("{}{}_bucket{} {}".format(prefix, name, format_labels(labels, [("le", "+Inf")]), histogram.count))
+                lines.append("{}{}_sum{} {}".format(prefix, name, format_labels(labels), histogram.sum))
+                lines.append("{}{}_count{} {}".format(prefix, name, format_labels(labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
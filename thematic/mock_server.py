@@ -0,0 +1,541 @@
+import io
+import os
+import re
+import csv
+import json
+import time
+import uuid
+import zlib
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A stand-in for the Thematic API, for benchmarking and trying out the SDK without the real service.
+# Jobs don't analyse anything: they move from queued to in_progress to finished on a timer, and the
+# coded csv is the uploaded data with placeholder theme columns added. Uploads are streamed to disk,
+# so files of any size can be sent to it.
+#
+#   python -m thematic.mock_server --port 8080 --queue-seconds 1 --processing-seconds 5
+
+_JOB_OUTPUTS = ("csv", "incremental_csv", "themes", "stopwords", "concepts", "nouns", "verbs", "adjectives", "artifacts", "language_model")
+_CONFIGURE_ROUTES = ("concepts", "word_frequencies", "themes", "language_model", "stopwords", "params")
+
+
+class _BodyReader(object):
+    # reads a request body of known length or in chunked encoding, gunzipping it if needed
+    def __init__(self, handler):
+        self.rfile = handler.rfile
+        self.chunked = handler.headers.get("Transfer-Encoding", "").lower() == "chunked"
+        self.remaining = int(handler.headers.get("Content-Length") or 0)
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if handler.headers.get("Content-Encoding") == "gzip" else None
+        self.bytes_read = 0
+
+    def _read_raw(self, size):
+        if self.chunked:
+            if self.remaining == 0:
+                line = self.rfile.readline().strip()
+                if not line:
+                    return b""
+                self.remaining = int(line.split(b";")[0], 16)
+                if self.remaining == 0:
+                    # trailers end with an empty line
+                    while self.rfile.readline().strip():
+                        pass
+                    self.chunked = False
+                    return b""
+            data = self.rfile.read(min(size, self.remaining))
+            self.remaining -= len(data)
+            if self.remaining == 0:
+                self.rfile.readline()
+            return data
+        if self.remaining <= 0:
+            return b""
+        data = self.rfile.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+    def read(self, size=1024 * 1024):
+        while True:
+            data = self._read_raw(size)
+            self.bytes_read += len(data)
+            if not data:
+                return self.decompressor.flush() if self.decompressor else b""
+            if self.decompressor:
+                data = self.decompressor.decompress(data)
+                if not data:
+                    continue
+            return data
+
+    def drain(self):
+        while self.read():
+            pass
+
+
+def _parse_multipart(reader, boundary, open_file):
+    # streams a multipart/form-data body, returning the plain fields and writing each file part to
+    # the file object returned by open_file(name)
+    delimiter = b"\r\n--" + boundary
+    fields, files = {}, {}
+    # the first boundary isn't preceded by a line break, pretend it is so every delimiter looks the same
+    buffer = b"\r\n"
+    while True:
+        # skip to the next delimiter and find out whether it is the closing one
+        while delimiter not in buffer:
+            data = reader.read()
+            if not data:
+                return fields, files
+            buffer = buffer[-len(delimiter) :] + data
+        buffer = buffer[buffer.index(delimiter) + len(delimiter) :]
+        while len(buffer) < 2:
+            data = reader.read()
+            if not data:
+                return fields, files
+            buffer += data
+        if buffer.startswith(b"--"):
+            reader.drain()
+            return fields, files
+
+        while b"\r\n\r\n" not in buffer:
+            data = reader.read()
+            if not data:
+                return fields, files
+            buffer += data
+        raw_headers, buffer = buffer.split(b"\r\n\r\n", 1)
+        disposition = ""
+        for line in raw_headers.decode("utf-8").split("\r\n"):
+            if line.lower().startswith("content-disposition:"):
+                disposition = line
+        name = re.search(r'\bname="((?:[^"\\]|\\.)*)"', disposition)
+        name = name.group(1).replace('\\"', '"').replace("\\\\", "\\") if name else ""
+        is_file = re.search(r'\bfilename="', disposition) is not None
+        out = open_file(name) if is_file else io.BytesIO()
+
+        while True:
+            index = buffer.find(delimiter)
+            if index >= 0:
+                out.write(buffer[:index])
+                buffer = buffer[index:]
+                break
+            # keep enough to recognise a delimiter split across reads
+            keep = len(delimiter) - 1
+            if len(buffer) > keep:
+                out.write(buffer[:-keep])
+                buffer = buffer[-keep:]
+            data = reader.read()
+            if not data:
+                break
+            buffer += data
+        if is_file:
+            out.close()
+            files[name] = out.name
+        else:
+            fields[name] = out.getvalue().decode("utf-8")
+
+
+class MockServer(object):
+    # queue_seconds and processing_seconds set how long each job stays in those states.
+    # latency is added to every response. error_rate is the fraction of requests answered with a 500,
+    # throttle_rate the fraction answered with a 429 and a Retry-After of retry_after seconds, and
+    # job_error_rate the fraction of jobs that end up errored instead of finished.
+    # output_columns is the number of coded columns added to each row, and artifact_bytes and
+    # language_model_bytes the sizes of those downloads. With ranges=False downloads ignore Range
+    # headers and always send the whole file, like servers without range support.
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        queue_seconds=1.0,
+        processing_seconds=2.0,
+        latency=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        retry_after=1,
+        job_error_rate=0.0,
+        output_columns=3,
+        artifact_bytes=1024 * 1024,
+        language_model_bytes=1024 * 1024,
+        ranges=True,
+        data_dir=None,
+        seed=None,
+    ):
+        self.host = host
+        self.port = port
+        self.queue_seconds = queue_seconds
+        self.processing_seconds = processing_seconds
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.job_error_rate = job_error_rate
+        self.output_columns = output_columns
+        self.artifact_bytes = artifact_bytes
+        self.language_model_bytes = language_model_bytes
+        self.ranges = ranges
+        self._own_data_dir = data_dir is None
+        self.data_dir = data_dir or tempfile.mkdtemp(prefix="thematic-mock-")
+        self.random = random.Random(seed)
+        self.surveys = {}
+        self.jobs = {}
+        self.stats = {"requests": {}, "bytes_received": 0, "bytes_sent": 0}
+        self.lock = threading.Lock()
+        self._output_lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}/api".format(self.host, self._httpd.server_address[1])
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+        if self._own_data_dir:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def count(self, endpoint, bytes_received=0, bytes_sent=0):
+        with self.lock:
+            self.stats["requests"][endpoint] = self.stats["requests"].get(endpoint, 0) + 1
+            self.stats["bytes_received"] += bytes_received
+            self.stats["bytes_sent"] += bytes_sent
+
+    def job_state(self, job):
+        if job.get("canceled"):
+            return "canceled"
+        elapsed = time.time() - job["created"]
+        if elapsed < self.queue_seconds:
+            return "queued"
+        if elapsed < self.queue_seconds + self.processing_seconds or not job["ready"].is_set():
+            return "in_progress"
+        return "errored" if job["fails"] else "finished"
+
+    def create_job(self, fields, files, previous_job_id=None, job_type=None):
+        job_id = str(uuid.uuid4())
+        previous = self.jobs.get(previous_job_id) or {}
+        job = {
+            "id": job_id,
+            "survey_id": fields.get("survey_id") or previous.get("survey_id"),
+            "job_type": job_type or fields.get("job_type") or "full",
+            "previous_job_id": previous_job_id,
+            "created": time.time(),
+            "fails": self.random.random() < self.job_error_rate,
+            "files": dict(previous.get("files", {})),
+            "fields": fields,
+        }
+        # uploaded files replace the ones the job inherits from the job it builds on
+        job["files"].update(files)
+        with self.lock:
+            self.jobs[job_id] = job
+        # prepare the coded csv while the job "runs", so downloads measure the transfer alone
+        job["ready"] = threading.Event()
+        threading.Thread(target=self._prepare, args=(job,), daemon=True).start()
+        return job
+
+    def _prepare(self, job):
+        try:
+            self.output_path(job, "csv")
+        finally:
+            job["ready"].set()
+
+    def job_details(self, job):
+        return {
+            "id": job["id"],
+            "survey_id": job["survey_id"],
+            "job_type": job["job_type"],
+            "previous_job_id": job["previous_job_id"],
+            "state": self.job_state(job),
+            "created": job["created"],
+        }
+
+    def output_path(self, job, name):
+        # outputs are made on first request and kept, so that range requests see the same bytes
+        path = os.path.join(self.data_dir, job["id"] + "." + name)
+        with self._output_lock:
+            if os.path.exists(path):
+                return path
+            tmp_path = path + ".tmp"
+            if name in ("csv", "incremental_csv"):
+                self._write_coded_csv(job, tmp_path)
+            elif name in ("artifacts", "language_model"):
+                size = self.artifact_bytes if name == "artifacts" else self.language_model_bytes
+                with open(tmp_path, "wb") as f:
+                    block = os.urandom(min(size, 1024 * 1024))
+                    written = 0
+                    while written < size:
+                        written += f.write(block[: size - written])
+            elif name + "_file" in job["files"]:
+                shutil.copyfile(job["files"][name + "_file"], tmp_path)
+            elif name == "themes":
+                with open(tmp_path, "w") as f:
+                    json.dump({"titles": {"t1": "Theme one", "t1.a": "Sub theme", "t2": "Theme two"}, "themes0": {"t1": {"sub_themes": ["t1.a"], "freq": 2}, "t2": {"sub_themes": [], "freq": 1}}}, f)
+            else:
+                with open(tmp_path, "w") as f:
+                    f.write("\n".join("{} {}".format(name, i) for i in range(100)) + "\n")
+            os.replace(tmp_path, path)
+        return path
+
+    def _write_coded_csv(self, job, path):
+        survey = self.surveys.get(job["survey_id"]) or {}
+        has_header = str(survey.get("has_header", "")).lower() in ("true", "1")
+        codes = ["t1;t2", "t1.a", "0.5"]
+        codes = (codes * (self.output_columns // len(codes) + 1))[: self.output_columns]
+        with open(path, "w", newline="", encoding="utf-8") as out:
+            writer = csv.writer(out)
+            source = job["files"].get("csv_file")
+            if not source:
+                return
+            with open(source, newline="", encoding="utf-8") as f:
+                for i, row in enumerate(csv.reader(f)):
+                    if i == 0 and has_header:
+                        writer.writerow(row + ["code_{}".format(c) for c in range(self.output_columns)])
+                    else:
+                        writer.writerow(row + codes)
+
+    def log_text(self, job):
+        # the log grows while the job runs, one line per tenth of a second
+        lines = int((time.time() - job["created"]) * 10) + 1
+        if self.job_state(job) in ("finished", "errored", "canceled"):
+            lines = int((self.queue_seconds + self.processing_seconds) * 10) + 1
+        return "".join("{} line {}\n".format(job["id"], i) for i in range(lines)).encode("utf-8")
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type="application/json", headers=None):
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body)
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+            return len(body)
+
+        def _success(self, data):
+            return self._send(200, {"status": "success", "data": data})
+
+        def _fail(self, status, message):
+            return self._send(status, {"status": "fail", "error": {"message": message}})
+
+        def _send_range(self, size, content_type, read, etag=None):
+            # answers Range requests with a 206, which parallel and resumed downloads rely on, unless
+            # If-Range names another version of the content
+            start, end = 0, size - 1
+            status = 200
+            match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+            if not server.ranges or (self.headers.get("If-Range") and self.headers.get("If-Range") != etag):
+                match = None
+            if match and size:
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                else:
+                    start = max(0, size - int(match.group(2)))
+                if start >= size:
+                    return self._send(416, b"", "text/plain", {"Content-Range": "bytes */{}".format(size)})
+                status = 206
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Accept-Ranges", "bytes")
+            if etag:
+                self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(max(0, end - start + 1)))
+            if status == 206:
+                self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+            self.end_headers()
+            if self.command == "HEAD":
+                return 0
+            sent = 0
+            for chunk in read(start, end - start + 1):
+                self.wfile.write(chunk)
+                sent += len(chunk)
+            return sent
+
+        def _send_file(self, path, content_type):
+            def read(offset, length):
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    while length > 0:
+                        chunk = f.read(min(length, 1024 * 1024))
+                        if not chunk:
+                            break
+                        length -= len(chunk)
+                        yield chunk
+
+            stat = os.stat(path)
+            return self._send_range(stat.st_size, content_type, read, etag='"{:x}-{:x}"'.format(stat.st_size, stat.st_mtime_ns))
+
+        def _send_bytes(self, data, content_type):
+            return self._send_range(len(data), content_type, lambda offset, length: [data[offset : offset + length]])
+
+        def _read_form(self, reader):
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.startswith("multipart/form-data"):
+                boundary = re.search(r"boundary=\"?([^\";]+)", content_type).group(1).encode("ascii")
+                upload_dir = os.path.join(server.data_dir, "uploads", uuid.uuid4().hex)
+                os.makedirs(upload_dir)
+                return _parse_multipart(reader, boundary, lambda name: open(os.path.join(upload_dir, name or "file"), "wb"))
+            raw = b""
+            while True:
+                data = reader.read()
+                if not data:
+                    break
+                raw += data
+            return {key: values[0] for key, values in parse_qs(raw.decode("utf-8")).items()}, {}
+
+        def _handle(self):
+            url = urlparse(self.path)
+            path = url.path.rstrip("/")
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            endpoint = re.sub(r"/(job|survey)/[^/]+", lambda m: "/" + m.group(1) + "/{id}", path.split("/api", 1)[-1] or "/")
+            reader = _BodyReader(self)
+            sent = 0
+            try:
+                if server.latency:
+                    time.sleep(server.latency)
+                if path.endswith("/_stats"):
+                    with server.lock:
+                        return self._send(200, server.stats)
+                roll = server.random.random()
+                if roll < server.throttle_rate:
+                    reader.drain()
+                    sent = self._send(429, {"status": "fail", "error": {"message": "Too many requests"}}, headers={"Retry-After": str(server.retry_after)})
+                    return
+                if roll < server.throttle_rate + server.error_rate:
+                    reader.drain()
+                    sent = self._fail(500, "Internal server error")
+                    return
+                sent = self._route(path, query, reader)
+            finally:
+                reader.drain()
+                server.count(endpoint, reader.bytes_read, sent or 0)
+
+        def _route(self, path, query, reader):
+            method = self.command
+            if path.endswith("/login"):
+                self._read_form(reader)
+                return self._send(200, {"status": "success", "data": {"api_key": uuid.uuid4().hex}}, headers={"Set-Cookie": "session=mock"})
+            if path.endswith("/create_survey"):
+                fields, _ = self._read_form(reader)
+                survey_id = str(uuid.uuid4())
+                survey = dict(fields, survey_id=survey_id, modelset_id=fields.get("modelset_id", 1))
+                server.surveys[survey_id] = survey
+                return self._success(survey)
+            match = re.match(r".*/survey/([^/]+)$", path)
+            if match:
+                survey = server.surveys.get(match.group(1))
+                if survey is None:
+                    return self._fail(404, "Survey not found")
+                if method == "PUT":
+                    fields, _ = self._read_form(reader)
+                    survey.update(fields)
+                return self._success(survey)
+            if path.endswith("/create_job") and method == "POST":
+                fields, files = self._read_form(reader)
+                job = server.create_job(fields, files, previous_job_id=fields.get("previous_job_id"))
+                return self._success({"jobid": job["id"]})
+            if path.endswith("/helpers/discoverThemes") and method == "POST":
+                fields, files = self._read_form(reader)
+                return self._success({"themes": [{"title": "New theme", "freq": 1}], "job_id": fields.get("job_id")})
+            if path.endswith("/jobs"):
+                with server.lock:
+                    jobs = list(server.jobs.values())
+                jobs = [server.job_details(job) for job in jobs if not query.get("survey_id") or job["survey_id"] == query["survey_id"]]
+                if query.get("job_type"):
+                    jobs = [job for job in jobs if job["job_type"] == query["job_type"]]
+                return self._success({"jobs": jobs})
+
+            match = re.match(r".*/job/([^/]+)/(\w+)$", path)
+            if not match:
+                return self._fail(404, "Not found")
+            job_id, action = match.groups()
+            job = server.jobs.get(job_id)
+            if job is None:
+                return self._fail(404, "Job not found")
+            if method == "POST" and action in _CONFIGURE_ROUTES:
+                fields, files = self._read_form(reader)
+                if action == "params":
+                    fields = {"parameters": fields}
+                return self._success({"jobid": server.create_job(fields, files, previous_job_id=job_id, job_type=action)["id"]})
+            if action == "info":
+                return self._success(server.job_details(job))
+            if action == "log":
+                return self._send_bytes(server.log_text(job), "text/plain")
+            if action == "cancel":
+                job["canceled"] = True
+                return self._success({})
+            if action == "delete":
+                with server.lock:
+                    del server.jobs[job_id]
+                return self._success({})
+            if action == "params":
+                return self._success(job["fields"].get("parameters") or {})
+            if action in _JOB_OUTPUTS:
+                if server.job_state(job) != "finished":
+                    return self._fail(400, "Job is not finished")
+                content_type = "text/csv" if action in ("csv", "incremental_csv") else "application/octet-stream"
+                return self._send_file(server.output_path(job, action), content_type)
+            return self._fail(404, "Not found")
+
+        do_GET = do_POST = do_PUT = do_HEAD = _handle
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a stand-in Thematic API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--queue-seconds", type=float, default=1.0)
+    parser.add_argument("--processing-seconds", type=float, default=2.0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--job-error-rate", type=float, default=0.0)
+    parser.add_argument("--output-columns", type=int, default=3)
+    parser.add_argument("--artifact-bytes", type=int, default=1024 * 1024)
+    parser.add_argument("--language-model-bytes", type=int, default=1024 * 1024)
+    parser.add_argument("--no-ranges", dest="ranges", action="store_false")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    server = MockServer(**vars(args)).start()
+    print("Serving a mock Thematic API at {}".format(server.url), flush=True)
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
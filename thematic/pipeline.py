@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .polling import JobWatch
+
+log = logging.getLogger(__name__)
+
+
+class Step(object):
+    # One job in a chain: the name of a Thematic method and its arguments, apart from previous_job_id
+    # which is filled in with the job id of the step before.
+    def __init__(self, method, retries=None, **kwargs):
+        self.method = method
+        self.retries = retries
+        self.kwargs = kwargs
+
+    def signature(self):
+        return json.dumps([self.method, self.kwargs], sort_keys=True, default=str)
+
+
+class Chain(object):
+    # A list of steps run one after another. key names the chain for resuming, previous_job_id is
+    # what the first step builds on, and survey_id lets the chain's jobs be polled with list_jobs.
+    def __init__(self, key, steps, previous_job_id=None, survey_id=None):
+        self.key = key
+        self.steps = steps
+        self.previous_job_id = previous_job_id
+        self.survey_id = survey_id
+
+
+class _ChainRun(object):
+    def __init__(self, chain, records):
+        self.chain = chain
+        self.records = records
+        self.attempts = 0
+        self.error = None
+
+    @property
+    def step_index(self):
+        for i, record in enumerate(self.records):
+            if record.get("state") != "finished":
+                return i
+        return len(self.records)
+
+    @property
+    def previous_job_id(self):
+        index = self.step_index
+        if index == 0:
+            return self.chain.previous_job_id
+        return self.records[index - 1]["job_id"]
+
+    @property
+    def done(self):
+        return self.error is not None or self.step_index == len(self.chain.steps)
+
+
+class PipelineExecutor(object):
+    # Runs chains of jobs for many surveys at once. Uploads for up to max_workers steps happen in
+    # parallel, at most max_jobs jobs are in flight on the server, and all in-flight jobs are polled
+    # together. Failed steps are retried, and with a state_dir the progress of each chain is saved
+    # so that running the same chains again carries on from where they stopped, reattaching to
+    # jobs that were already submitted. on_chain_done(key, result) is called as each chain ends,
+    # with the result run gives for it, so its outputs can be fetched while other chains carry on.
+    def __init__(self, client, max_workers=4, max_jobs=20, retries=2, state_dir=None, check_continue=None, on_chain_done=None):
+        self.client = client
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.retries = retries
+        self.state_dir = state_dir
+        self.check_continue = check_continue
+        self.on_chain_done = on_chain_done
+        if state_dir and not os.path.isdir(state_dir):
+            os.makedirs(state_dir, exist_ok=True)
+
+    def _state_path(self, chain):
+        name = hashlib.sha1(str(chain.key).encode("utf-8")).hexdigest()
+        return os.path.join(self.state_dir, name + ".json")
+
+    def _load(self, chain):
+        records = [{"signature": step.signature()} for step in chain.steps]
+        if not self.state_dir or not os.path.exists(self._state_path(chain)):
+            return records
+        with open(self._state_path(chain)) as f:
+            saved = json.load(f)
+        if saved.get("previous_job_id") != chain.previous_job_id:
+            return records
+        # keep saved progress up to the first step that has changed since
+        for i, record in enumerate(saved.get("steps", [])[: len(records)]):
+            if record.get("signature") != records[i]["signature"]:
+                break
+            records[i] = record
+        return records
+
+    def _save(self, run):
+        if not self.state_dir:
+            return
+        path = self._state_path(run.chain)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"key": run.chain.key, "previous_job_id": run.chain.previous_job_id, "steps": run.records}, f)
+        os.replace(path + ".tmp", path)
+
+    def _submit(self, run):
+        step = run.chain.steps[run.step_index]
+        method = getattr(self.client, step.method)
+        # a chain that doesn't build on a job can start with a method that takes no previous_job_id
+        if run.previous_job_id is None:
+            return method(**step.kwargs)
+        return method(previous_job_id=run.previous_job_id, **step.kwargs)
+
+    def _failed(self, run, error, pending):
+        step = run.chain.steps[run.step_index]
+        retries = self.retries if step.retries is None else step.retries
+        run.attempts += 1
+        record = run.records[run.step_index]
+        record.pop("job_id", None)
+        record.pop("state", None)
+        self._save(run)
+        if run.attempts > retries:
+            log.error("Chain {} failed at step {} ({}): {}".format(run.chain.key, run.step_index, step.method, error))
+            run.error = str(error)
+            self._done(run)
+        else:
+            log.warning("Chain {} step {} ({}) failed, retrying: {}".format(run.chain.key, run.step_index, step.method, error))
+            pending.append(run)
+
+    def _next(self, run, pending, in_flight, watches):
+        # queues the run's next step, or reattaches to a job that was submitted before a restart
+        if run.done:
+            self._done(run)
+            return
+        record = run.records[run.step_index]
+        if record.get("state") == "submitted":
+            self._track(run, record["job_id"], in_flight, watches)
+        else:
+            pending.append(run)
+
+    def _result(self, run):
+        job_ids = [record.get("job_id") for record in run.records if record.get("state") == "finished"]
+        return {"job_id": job_ids[-1] if job_ids else run.chain.previous_job_id, "jobs": job_ids, "error": run.error}
+
+    def _done(self, run):
+        if self.on_chain_done is not None:
+            self.on_chain_done(run.chain.key, self._result(run))
+
+    def _track(self, run, job_id, in_flight, watches):
+        in_flight[job_id] = run
+        watches[job_id] = JobWatch(job_id, self.client.polling)
+        if run.chain.survey_id:
+            self._job_surveys[job_id] = run.chain.survey_id
+
+    def _poll(self, in_flight, watches, pending):
+        states = self.client._poll_job_states(list(in_flight), self._job_surveys)
+        for job_id, job_details in states.items():
+            run = in_flight[job_id]
+            state = job_details["state"]
+            watches[job_id].update(state)
+            if state in ("finished", "errored", "canceled"):
+                self.client._job_done(watches[job_id])
+            if state == "finished":
+                del in_flight[job_id]
+                del watches[job_id]
+                run.records[run.step_index]["state"] = "finished"
+                run.attempts = 0
+                self._save(run)
+                self._next(run, pending, in_flight, watches)
+            elif state in ("errored", "canceled"):
+                del in_flight[job_id]
+                del watches[job_id]
+                self._failed(run, "job {} {}".format(job_id, state), pending)
+
+    def run(self, chains):
+        runs = [_ChainRun(chain, self._load(chain)) for chain in chains]
+        pending = collections.deque()
+        in_flight = {}
+        watches = {}
+        self._job_surveys = {}
+        for run in runs:
+            self._next(run, pending, in_flight, watches)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            submitting = {}
+            num_exceptions = 0
+            next_poll_time = 0
+            while pending or submitting or in_flight:
+                while pending and len(submitting) + len(in_flight) < self.max_jobs:
+                    run = pending.popleft()
+                    submitting[executor.submit(self._submit, run)] = run
+
+                # one poll serves every job in flight
+                if in_flight and time.time() >= next_poll_time:
+                    try:
+                        self._poll(in_flight, watches, pending)
+                        num_exceptions = 0
+                        interval = min([watch.next_interval() for watch in watches.values()] or [0])
+                    except Exception as e:
+                        num_exceptions += 1
+                        if num_exceptions > self.client.num_retries:
+                            raise
+                        log.warning("Failed to get job states, retrying ({})".format(e))
+                        interval = self.client.polling.error_interval(num_exceptions)
+                    next_poll_time = time.time() + interval
+                    if pending and len(submitting) + len(in_flight) < self.max_jobs:
+                        continue
+
+                if self.check_continue and not self.check_continue():
+                    raise Exception("PipelineExecutor: Interrupted")
+
+                timeout = max(0, next_poll_time - time.time()) if in_flight else None
+                if submitting:
+                    done, _ = wait(list(submitting), timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        run = submitting.pop(future)
+                        try:
+                            job_id = future.result()
+                        except Exception as e:
+                            self._failed(run, e, pending)
+                            continue
+                        record = run.records[run.step_index]
+                        record["job_id"] = job_id
+                        record["state"] = "submitted"
+                        self._save(run)
+                        self._track(run, job_id, in_flight, watches)
+                elif in_flight:
+                    time.sleep(timeout)
+
+        return {run.chain.key: self._result(run) for run in runs}
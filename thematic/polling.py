@@ -0,0 +1,159 @@
+import time
+import random
+import threading
+
+
+class FixedPolling(object):
+    # polls on a fixed cycle, this is how wait_for_job_completion always used to behave
+    def __init__(self, interval=2):
+        self.interval = interval
+
+    def next_interval(self, state, elapsed, attempt):
+        return self.interval
+
+    def error_interval(self, num_errors):
+        return self.interval
+
+    def estimate(self, state, elapsed):
+        return None
+
+    def observe(self, queue_seconds, processing_seconds):
+        pass
+
+
+class BackoffPolling(FixedPolling):
+    # exponential backoff within each job state, restarting whenever the state changes
+    def __init__(self, initial=1, maximum=30, factor=1.5, jitter=0.2):
+        FixedPolling.__init__(self, initial)
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+
+    def _jittered(self, interval):
+        if self.jitter:
+            interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(0, interval)
+
+    def _backoff(self, attempt):
+        return min(self.maximum, self.initial * (self.factor ** attempt))
+
+    def next_interval(self, state, elapsed, attempt):
+        return self._jittered(self._backoff(attempt))
+
+    def error_interval(self, num_errors):
+        # full jitter for errors so that many clients don't retry in lockstep
+        return random.uniform(0, self._backoff(num_errors))
+
+
+class AdaptivePolling(BackoffPolling):
+    # learns how long jobs usually wait in the queue and take to process, and polls more often
+    # as the expected end of the current state approaches. Falls back to backoff before anything
+    # has been learnt, or once a job has overrun its expected time.
+    def __init__(self, initial=1, maximum=30, factor=1.5, jitter=0.2, minimum=0.5, smoothing=0.3, fraction=0.5):
+        BackoffPolling.__init__(self, initial=initial, maximum=maximum, factor=factor, jitter=jitter)
+        self.minimum = minimum
+        self.smoothing = smoothing
+        self.fraction = fraction
+        self.expected_queue_seconds = None
+        self.expected_processing_seconds = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _smooth(self, current, value):
+        if current is None:
+            return value
+        return current + self.smoothing * (value - current)
+
+    def observe(self, queue_seconds, processing_seconds):
+        with self._lock:
+            if queue_seconds is not None:
+                self.expected_queue_seconds = self._smooth(self.expected_queue_seconds, queue_seconds)
+            if processing_seconds is not None:
+                self.expected_processing_seconds = self._smooth(self.expected_processing_seconds, processing_seconds)
+
+    def _remaining_in_state(self, state, elapsed):
+        if state == "in_progress":
+            expected = self.expected_processing_seconds
+        else:
+            expected = self.expected_queue_seconds
+        if expected is None:
+            return None
+        return expected - elapsed
+
+    def estimate(self, state, elapsed):
+        remaining = self._remaining_in_state(state, elapsed)
+        if remaining is None:
+            return None
+        remaining = max(0, remaining)
+        if state != "in_progress":
+            if self.expected_processing_seconds is None:
+                return None
+            remaining += self.expected_processing_seconds
+        return remaining
+
+    def next_interval(self, state, elapsed, attempt):
+        remaining = self._remaining_in_state(state, elapsed)
+        if remaining is None or remaining <= 0:
+            return BackoffPolling.next_interval(self, state, elapsed, attempt)
+        interval = min(self.maximum, max(self.minimum, remaining * self.fraction))
+        return self._jittered(interval)
+
+
+class JobWatch(object):
+    # tracks the state transitions of a single job while it is being polled
+    def __init__(self, job_id, polling):
+        self.job_id = job_id
+        self.polling = polling
+        self.start_time = time.time()
+        self.state = None
+        self.state_start_time = self.start_time
+        self.process_start_time = None
+        self.end_time = None
+        self.num_polls = 0
+
+    def update(self, state):
+        now = time.time()
+        changed = state != self.state
+        if changed:
+            self.state = state
+            self.state_start_time = now
+            self.num_polls = 0
+        if state == "in_progress" and not self.process_start_time:
+            self.process_start_time = now
+        if changed and state in ("finished", "errored", "canceled"):
+            self.end_time = now
+            if state == "finished":
+                self.polling.observe(self.queue_seconds, self.processing_seconds)
+        return changed
+
+    @property
+    def queue_seconds(self):
+        if not self.process_start_time:
+            return None
+        return self.process_start_time - self.start_time
+
+    @property
+    def processing_seconds(self):
+        if not self.process_start_time or not self.end_time:
+            return None
+        return self.end_time - self.process_start_time
+
+    def elapsed_in_state(self):
+        return time.time() - self.state_start_time
+
+    def eta(self):
+        return self.polling.estimate(self.state, self.elapsed_in_state())
+
+    def next_interval(self):
+        interval = self.polling.next_interval(self.state, self.elapsed_in_state(), self.num_polls)
+        self.num_polls += 1
+        return interval
@@ -0,0 +1,172 @@
+import io
+import os
+import re
+import csv
+import json
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+# bytes that aren't valid utf-8 come out of decoding as these, so they can be found per row
+_INVALID_UTF8 = re.compile("[\udc80-\udcff]")
+_BLOCK_SIZE = 1024 * 1024
+
+
+def survey_columns(columns):
+    # the column indexes of a survey definition, given as a list of indexes, a list of groups of
+    # {"index": ...} entries, or either of those as json
+    if isinstance(columns, (bytes, str)):
+        columns = json.loads(columns)
+    indexes = []
+    for column in columns or []:
+        if isinstance(column, (list, tuple)):
+            indexes.extend(survey_columns(column))
+        elif isinstance(column, dict):
+            indexes.append(int(column["index"]))
+        else:
+            indexes.append(int(column))
+    return indexes
+
+
+def find_chunks(csv_filename, chunk_size):
+    # Splits a file into (start, end) byte ranges of about chunk_size that each start at the
+    # beginning of a record, so they can be parsed independently. A line break only ends a record
+    # when it is outside quotes, which is when an even number of quotes comes before it; escaped
+    # quotes come in pairs, so they don't change that. Also returns whether the file's quotes are
+    # balanced.
+    size = os.path.getsize(csv_filename)
+    chunks = []
+    start = 0
+    position = 0
+    quotes = 0
+    target = chunk_size
+    with open(csv_filename, "rb") as f:
+        while True:
+            block = f.read(_BLOCK_SIZE)
+            if not block:
+                break
+            offset = 0
+            while position + len(block) > target:
+                # look for the first line break past the target that isn't inside quotes
+                newline = block.find(b"\n", max(offset, target - position))
+                if newline < 0:
+                    break
+                quotes += block.count(b'"', offset, newline)
+                offset = newline
+                if quotes % 2 == 0:
+                    chunks.append((start, position + newline + 1))
+                    start = position + newline + 1
+                    target = start + chunk_size
+                else:
+                    target = position + newline + 1
+            quotes += block.count(b'"', offset)
+            position += len(block)
+    if start < size or not chunks:
+        chunks.append((start, size))
+    return chunks, quotes % 2 == 0
+
+
+def _check_chunk(args):
+    # runs in a worker process: parses one chunk, returning its number of records, the problems
+    # found as (record within the chunk, message), and writing the normalized records if asked
+    csv_filename, start, end, total_columns, first, has_header, normalize_path, max_errors = args
+    with open(csv_filename, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    text = data.decode("utf-8", "surrogateescape")
+    if first and text.startswith("\ufeff"):
+        text = text[1:]
+    errors = []
+    num_records = 0
+    out = writer = None
+    if normalize_path:
+        out = io.open(normalize_path, "w", encoding="utf-8", newline="")
+        writer = csv.writer(out)
+    try:
+        reader = csv.reader(io.StringIO(text, newline=""), strict=True)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as e:
+                if len(errors) < max_errors:
+                    errors.append((num_records, "bad quoting ({})".format(e)))
+                num_records += 1
+                continue
+            record = num_records
+            num_records += 1
+            if any(_INVALID_UTF8.search(value) for value in row):
+                if len(errors) < max_errors:
+                    errors.append((record, "is not valid UTF-8"))
+                row = [_INVALID_UTF8.sub("\ufffd", value) for value in row]
+            header = first and has_header and record == 0
+            # a blank line is an empty response when there is a single column
+            if not row and total_columns == 1:
+                row = [""]
+            if len(row) != total_columns and not header:
+                if len(errors) < max_errors:
+                    errors.append((record, "has {} columns, expected {}".format(len(row), total_columns)))
+                if len(row) < total_columns:
+                    row = row + [""] * (total_columns - len(row))
+            if writer is not None:
+                writer.writerow(row)
+    finally:
+        if out is not None:
+            out.close()
+    return num_records, errors
+
+
+def validate_csv(
+    csv_filename, total_columns, columns=None, has_header=False, workers=None, chunk_size=32 * 1024 * 1024, normalize_to=None, max_errors=100
+):
+    # Checks a csv against a survey definition before it is uploaded: that every row has
+    # total_columns columns, that the survey's columns are within them, and that the file is valid
+    # UTF-8 with balanced quoting. The file is split into chunks at record boundaries, which are
+    # checked in parallel by up to workers processes (one per core by default).
+    #
+    # With normalize_to, a cleaned copy is also written there: without a byte order mark, with
+    # invalid UTF-8 replaced, short rows padded to total_columns and quoting made uniform. Rows
+    # with too many columns are kept as they are, and records whose quoting can't be parsed are
+    # left out; both are still reported.
+    #
+    # Returns {"rows": records in the file, including any header, "errors": [{"row": record number
+    # from 1, or None for the whole file, "message": ...}], "ok": whether there were no errors}.
+    # Only the first max_errors errors are listed.
+    total_columns = int(total_columns)
+    errors = []
+    for index in survey_columns(columns):
+        if index < 0 or index >= total_columns:
+            errors.append({"row": None, "message": "column index {} is out of range for {} columns".format(index, total_columns)})
+
+    chunks, balanced = find_chunks(csv_filename, chunk_size)
+    part_paths = [normalize_to + ".part{}".format(i) for i in range(len(chunks))] if normalize_to else [None] * len(chunks)
+    tasks = [
+        (csv_filename, start, end, total_columns, i == 0, has_header, part_paths[i], max_errors) for i, (start, end) in enumerate(chunks)
+    ]
+    try:
+        if len(tasks) == 1 or workers == 1:
+            results = [_check_chunk(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_check_chunk, tasks))
+        if normalize_to:
+            with open(normalize_to + ".part", "wb") as out:
+                for part_path in part_paths:
+                    with open(part_path, "rb") as f:
+                        shutil.copyfileobj(f, out, _BLOCK_SIZE)
+            os.replace(normalize_to + ".part", normalize_to)
+    finally:
+        for part_path in part_paths:
+            if part_path and os.path.exists(part_path):
+                os.remove(part_path)
+
+    num_records = 0
+    for chunk_records, chunk_errors in results:
+        for record, message in chunk_errors:
+            errors.append({"row": num_records + record + 1, "message": message})
+        num_records += chunk_records
+    if not balanced:
+        errors.append({"row": None, "message": "a quoted field is never closed"})
+    if num_records == 0 or (has_header and num_records == 1):
+        errors.append({"row": None, "message": "has no rows"})
+    return {"rows": num_records, "errors": errors[:max_errors], "ok": not errors}
@@ -0,0 +1,148 @@
+import time
+import random
+import datetime
+import threading
+import email.utils
+from urllib.parse import urlparse
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class TokenBucket(object):
+    # Allows rate requests per second on average, with bursts of up to capacity requests.
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._updated = time.monotonic()
+
+    def reserve(self, tokens=1):
+        # takes the tokens now and returns how long the caller must wait before using them
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+
+class RateLimiter(object):
+    # Token buckets for the requests of one or more clients, with separate budgets for uploads and
+    # for polling (job info, job lists and logs). When the server asks to back off with Retry-After,
+    # every request through the limiter waits until then.
+    def __init__(self, rate=10, burst=None, upload_rate=None, upload_burst=None, poll_rate=None, poll_burst=None):
+        self.buckets = {"default": TokenBucket(rate, burst)}
+        if upload_rate is not None:
+            self.buckets["upload"] = TokenBucket(upload_rate, upload_burst)
+        if poll_rate is not None:
+            self.buckets["poll"] = TokenBucket(poll_rate, poll_burst)
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+
+    def block_for(self, seconds):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def reserve(self, category="default"):
+        bucket = self.buckets.get(category, self.buckets["default"])
+        delay = bucket.reserve()
+        with self._lock:
+            blocked = self._blocked_until - time.monotonic()
+        return max(delay, blocked, 0.0)
+
+    def acquire(self, category="default"):
+        delay = self.reserve(category)
+        if delay:
+            time.sleep(delay)
+
+
+def request_category(method, url, uploading=False):
+    if uploading:
+        return "upload"
+    path = urlparse(url).path.rstrip("/")
+    if method == "GET" and (path.endswith("/info") or path.endswith("/jobs") or path.endswith("/log")):
+        return "poll"
+    return "default"
+
+
+class RetryPolicy(object):
+    # Decides which failed requests are sent again.
+    # 429 means the request was turned away before it was processed, so it is always safe to retry.
+    # Other server errors and connection failures are only retried for requests that can be repeated
+    # without side effects: reads, updates, and the few POST endpoints that don't create anything.
+    # Job creation is never repeated after a 5xx, as the job may have been created anyway.
+    idempotent_methods = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+    safe_post_endpoints = ("/login", "/cancel", "/helpers/discoverThemes")
+
+    # A Retry-After from the server is waited for up to max_retry_after seconds, so that a bogus or
+    # huge value can't stall a worker for hours.
+    def __init__(self, max_retries=5, backoff=1.0, max_backoff=60, retry_statuses=(429, 500, 502, 503, 504), max_retry_after=300):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = retry_statuses
+
+    def is_safe(self, method, url):
+        if method.upper() in self.idempotent_methods:
+            return True
+        path = urlparse(url).path.rstrip("/")
+        return method.upper() == "POST" and path.endswith(self.safe_post_endpoints)
+
+    def should_retry(self, method, url, attempt, status=None):
+        # status is None when the request failed to get a response at all
+        if attempt >= self.max_retries:
+            return False
+        if status == 429:
+            return True
+        if status is not None and status not in self.retry_statuses:
+            return False
+        return self.is_safe(method, url)
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(max(retry_after, 0), self.max_retry_after)
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
@@ -0,0 +1,183 @@
+import io
+import os
+import re
+import csv
+import collections
+
+# The coded csv is the uploaded data with three columns added per group of response columns: the
+# base themes, the sub themes and the sentiment score of the response. Theme cells hold a list of
+# theme ids.
+ThemeCodes = collections.namedtuple("ThemeCodes", ["base_themes", "sub_themes", "sentiment"])
+CodedRow = collections.namedtuple("CodedRow", ["index", "values", "codes"])
+
+CODE_COLUMNS = ("base_themes", "sub_themes", "sentiment")
+
+_CODE_SEPARATOR = re.compile(r"[,;|]")
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise Exception("Columnar export requires pyarrow, install it with `pip install thematic_sdk[arrow]`")
+    return pyarrow
+
+
+class _StreamReader(io.RawIOBase):
+    # a file-like view of an iterator of byte chunks, e.g. a response body as it downloads
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def text_stream(chunks, encoding="utf-8"):
+    return io.TextIOWrapper(io.BufferedReader(_StreamReader(chunks), 1024 * 1024), encoding=encoding, newline="")
+
+
+def parse_theme_ids(value, separator=None):
+    if not value:
+        return []
+    parts = value.split(separator) if separator else _CODE_SEPARATOR.split(value)
+    return [part.strip() for part in parts if part.strip()]
+
+
+def parse_sentiment(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def coded_column_names(num_groups):
+    # base_themes, sub_themes, sentiment for the first group, then base_themes_1, ... for the next ones
+    names = []
+    for group in range(num_groups):
+        suffix = "_{}".format(group) if group else ""
+        names.extend(name + suffix for name in CODE_COLUMNS)
+    return names
+
+
+class CodedReader(object):
+    # Parses coded csv text one row at a time. num_input_columns is the number of columns of the
+    # uploaded data (the survey's total_columns), everything after them is theme codes. Rows for
+    # empty responses can come without codes, which are then empty. The number of coded column
+    # groups is worked out from the first rows unless it is given.
+    lookahead = 1000
+
+    def __init__(self, text_file, num_input_columns, has_header=False, separator=None, num_groups=None):
+        self.num_input_columns = int(num_input_columns)
+        self.separator = separator
+        self._reader = csv.reader(text_file)
+        self.header = next(self._reader, None) if has_header else None
+        self._peeked = []
+        if num_groups is None:
+            widths = [len(self.header)] if self.header else []
+            for row in self._reader:
+                self._peeked.append(row)
+                widths.append(len(row))
+                if len(row) > self.num_input_columns or len(self._peeked) >= self.lookahead:
+                    break
+            num_groups = max([(width - self.num_input_columns) // len(CODE_COLUMNS) for width in widths] + [0])
+        self.num_groups = num_groups
+
+    @property
+    def input_column_names(self):
+        names = []
+        for i in range(self.num_input_columns):
+            name = self.header[i] if self.header and i < len(self.header) else ""
+            names.append(name or "column_{}".format(i))
+        return names
+
+    def _parse(self, index, row):
+        values = row[: self.num_input_columns]
+        if len(values) < self.num_input_columns:
+            values = values + [""] * (self.num_input_columns - len(values))
+        codes = []
+        for group in range(self.num_groups):
+            start = self.num_input_columns + group * len(CODE_COLUMNS)
+            cells = row[start : start + len(CODE_COLUMNS)]
+            cells = cells + [""] * (len(CODE_COLUMNS) - len(cells))
+            codes.append(ThemeCodes(parse_theme_ids(cells[0], self.separator), parse_theme_ids(cells[1], self.separator), parse_sentiment(cells[2])))
+        return CodedRow(index, values, codes)
+
+    def __iter__(self):
+        index = 0
+        for row in self._peeked:
+            yield self._parse(index, row)
+            index += 1
+        self._peeked = []
+        for row in self._reader:
+            yield self._parse(index, row)
+            index += 1
+
+
+def write_columnar(reader, path, format="parquet", batch_size=50000, compression="snappy"):
+    # Writes the rows of a CodedReader to a Parquet or Arrow IPC file batch_size rows at a time, so
+    # memory stays bounded whatever the number of rows. Input columns are strings, theme columns
+    # lists of theme ids, and sentiment a nullable float.
+    pyarrow = _import_pyarrow()
+    names = reader.input_column_names + coded_column_names(reader.num_groups)
+    fields = [pyarrow.field(name, pyarrow.string()) for name in reader.input_column_names]
+    for name in coded_column_names(reader.num_groups):
+        if name.startswith("sentiment"):
+            fields.append(pyarrow.field(name, pyarrow.float64()))
+        else:
+            fields.append(pyarrow.field(name, pyarrow.list_(pyarrow.string())))
+    schema = pyarrow.schema(fields)
+
+    def to_table(columns):
+        return pyarrow.Table.from_arrays([pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
+    # written next to the destination and renamed into place once complete
+    part_path = path + ".part"
+    if format == "parquet":
+        import pyarrow.parquet
+
+        sink = None
+        writer = pyarrow.parquet.ParquetWriter(part_path, schema, compression=compression)
+    elif format in ("arrow", "ipc", "feather"):
+        import pyarrow.ipc
+
+        sink = pyarrow.OSFile(part_path, "wb")
+        writer = pyarrow.ipc.new_file(sink, schema)
+    else:
+        raise Exception("write_columnar: Unknown format {}".format(format))
+
+    num_rows = 0
+    try:
+        columns = [[] for _ in names]
+        for row in reader:
+            for i, value in enumerate(row.values):
+                columns[i].append(value)
+            i = len(row.values)
+            for codes in row.codes:
+                columns[i].append(codes.base_themes)
+                columns[i + 1].append(codes.sub_themes)
+                columns[i + 2].append(codes.sentiment)
+                i += len(CODE_COLUMNS)
+            num_rows += 1
+            if num_rows % batch_size == 0:
+                writer.write_table(to_table(columns))
+                columns = [[] for _ in names]
+        if num_rows % batch_size:
+            writer.write_table(to_table(columns))
+    finally:
+        writer.close()
+        if sink is not None:
+            sink.close()
+    os.replace(part_path, path)
+    return num_rows
@@ -0,0 +1,101 @@
+import io
+import os
+import csv
+import json
+import heapq
+import random
+import hashlib
+
+
+def _row_key(row, hash_key, columns):
+    # a pseudo random number in [0, 1) that only depends on the row's content (or the given
+    # columns) and the seed the hash key is made from, so duplicate rows always get the same one
+    content = row if columns is None else [row[i] if i < len(row) else "" for i in columns]
+    # cells are joined with a character csv text doesn't contain, so different rows can't join the same
+    encoded = "\x00".join(content).encode("utf-8", "surrogatepass")
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8, key=hash_key).digest(), "big") / 2.0 ** 64
+
+
+def _allocate(counts, sample_size):
+    # splits sample_size between strata in proportion to their sizes (largest remainders first),
+    # giving each stratum at least one row while there are rows to spare
+    total = sum(counts.values())
+    if total <= sample_size:
+        return dict(counts)
+    shares = {stratum: sample_size * count / float(total) for stratum, count in counts.items()}
+    least = 1 if len(counts) <= sample_size else 0
+    allocation = {stratum: min(counts[stratum], max(least, int(share))) for stratum, share in shares.items()}
+    remaining = sample_size - sum(allocation.values())
+    for stratum in sorted(shares, key=lambda s: shares[s] - int(shares[s]), reverse=True):
+        if remaining <= 0:
+            break
+        if allocation[stratum] < counts[stratum]:
+            allocation[stratum] += 1
+            remaining -= 1
+    return allocation
+
+
+def sample_csv(csv_filename, out_file_obj, sample_size, has_header=False, seed=0, stratify_column=None, collapse_duplicates=False):
+    # Writes a random sample of up to sample_size rows of csv_filename to out_file_obj, in their
+    # original order, in a single pass that keeps only the sample in memory.
+    #
+    # Every row gets a random key and the rows with the smallest keys are kept, which is a uniform
+    # sample. With collapse_duplicates (True for whole rows, or a list of column indexes) the key
+    # is a hash of the row, so duplicates share a key and the sample is drawn from distinct rows.
+    # With stratify_column, rows are grouped by that column's value and each group is sampled in
+    # proportion to its size; this keeps up to sample_size rows per group in memory.
+    # Returns (rows in the file, rows in the sample).
+    rng = random.Random(seed)
+    hash_key = hashlib.sha256(str(seed).encode("utf-8")).digest()
+    columns = None if collapse_duplicates is True else collapse_duplicates
+    # per stratum, a heap of (-key, row number, row) holding the rows with the smallest keys, and
+    # the keys in it so that duplicates of rows already in the sample are kept out
+    heaps = {}
+    keys = {}
+    counts = {}
+    num_rows = 0
+    with io.open(csv_filename, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None) if has_header else None
+        for row in reader:
+            key = _row_key(row, hash_key, columns) if collapse_duplicates else rng.random()
+            stratum = None
+            if stratify_column is not None:
+                stratum = row[stratify_column] if stratify_column < len(row) else ""
+            heap = heaps.get(stratum)
+            if heap is None:
+                heap = heaps[stratum] = []
+                keys[stratum] = set()
+                counts[stratum] = 0
+            counts[stratum] += 1
+            num_rows += 1
+            if len(heap) < sample_size:
+                if key not in keys[stratum]:
+                    heapq.heappush(heap, (-key, num_rows, row))
+                    keys[stratum].add(key)
+            elif key < -heap[0][0] and key not in keys[stratum]:
+                removed = heapq.heapreplace(heap, (-key, num_rows, row))
+                keys[stratum].discard(-removed[0])
+                keys[stratum].add(key)
+
+    if collapse_duplicates:
+        # strata are sized by the distinct rows they gave, which is what their heaps hold at most
+        counts = {stratum: len(heap) if len(heap) < sample_size else counts[stratum] for stratum, heap in heaps.items()}
+    allocation = _allocate(counts, sample_size)
+    sample = []
+    for stratum, heap in heaps.items():
+        sample.extend(heapq.nlargest(allocation[stratum], heap))
+    sample.sort(key=lambda entry: entry[1])
+
+    writer = csv.writer(out_file_obj)
+    if header is not None:
+        writer.writerow(header)
+    for entry in sample:
+        writer.writerow(entry[2])
+    return num_rows, len(sample)
+
+
+def sample_path(directory, digest, sample_size, has_header, seed, stratify_column, collapse_duplicates):
+    # where the sample of a file with the given content digest and sampling settings is cached
+    settings = json.dumps([digest, sample_size, has_header, seed, stratify_column, collapse_duplicates], sort_keys=True)
+    return os.path.join(directory, hashlib.sha256(settings.encode("utf-8")).hexdigest() + ".csv")
@@ -0,0 +1,52 @@
+import io
+import os
+import csv
+
+
+def split_csv(csv_filename, directory, shard_rows, has_header=False):
+    # Splits a csv into files of up to shard_rows rows each in one pass, repeating the header in
+    # every file. Rows are parsed, so responses with line breaks are never cut in two.
+    # Returns the paths of the shards in order.
+    paths = []
+    out = None
+    try:
+        with io.open(csv_filename, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None) if has_header else None
+            num_rows = 0
+            for row in reader:
+                if out is None or num_rows == shard_rows:
+                    if out is not None:
+                        out.close()
+                    paths.append(os.path.join(directory, "shard_{:05d}.csv".format(len(paths))))
+                    out = io.open(paths[-1], "w", encoding="utf-8", newline="")
+                    writer = csv.writer(out)
+                    if header is not None:
+                        writer.writerow(header)
+                    num_rows = 0
+                writer.writerow(row)
+                num_rows += 1
+    finally:
+        if out is not None:
+            out.close()
+    return paths
+
+
+def join_csv(paths, path, has_header=False):
+    # Concatenates csv files in order, keeping the header of the first only. Written next to the
+    # destination and renamed into place once complete. Returns the number of rows written.
+    num_rows = 0
+    with io.open(path + ".part", "w", encoding="utf-8", newline="") as out:
+        writer = csv.writer(out)
+        for i, shard_path in enumerate(paths):
+            with io.open(shard_path, "r", encoding="utf-8", newline="") as f:
+                reader = csv.reader(f)
+                if has_header:
+                    header = next(reader, None)
+                    if i == 0 and header is not None:
+                        writer.writerow(header)
+                for row in reader:
+                    writer.writerow(row)
+                    num_rows += 1
+    os.replace(path + ".part", path)
+    return num_rows
@@ -1,39 +1,309 @@
+import io
+import os
 import json
 import time
+import shutil
+import tempfile
 import datetime
+import hashlib
 import logging
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
 # pip
 import requests
+from requests.adapters import HTTPAdapter
+
+from .polling import AdaptivePolling, JobWatch
+from .upload import MultipartStream
+from .download import Downloader, content_range
+from .logs import LogTail
+from .ratelimit import RetryPolicy, parse_retry_after, request_category
+from .metrics import endpoint_of, job_event, call_hooks
+from .results import CodedReader, text_stream, write_columnar
+from .shards import split_csv, join_csv
+from .pipeline import PipelineExecutor, Chain, Step
+from .preflight import validate_csv, survey_columns
+from .sampling import sample_csv, sample_path
+from .bundle import BUNDLE_FILES, bundle_filename, publish_directory, publish_zip
+from .dedupe import DuplicateMap, collapse_duplicates as collapse_duplicates_in_file, expand_results
 
 log = logging.getLogger(__name__)
 
 LOG_REQUESTS = False
 
+TERMINAL_STATES = ("finished", "errored", "canceled")
+
 
 def set_log_requests(log_requests):
+    global LOG_REQUESTS
     LOG_REQUESTS = log_requests
 
 
+def job_id_of(job):
+    # job listings have used several names for the id over time
+    for key in ("id", "job_id", "jobid", "uuid"):
+        if job.get(key):
+            return job[key]
+    return None
+
+
+def job_created(job):
+    # the creation time of a listed job in epoch seconds; listings give it as a number or as iso 8601 text
+    value = job.get("created") or job.get("created_at")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        created = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=datetime.timezone.utc)
+    return created.timestamp()
+
+
+def group_jobs_for_polling(pending, job_surveys):
+    # jobs sharing a survey can be polled with a single list_jobs call, the rest need one call each
+    by_survey = {}
+    for job_id in pending:
+        survey_id = job_surveys.get(job_id)
+        if survey_id:
+            by_survey.setdefault(survey_id, []).append(job_id)
+    singles = [job_id for job_id in pending if not job_surveys.get(job_id)]
+    for survey_id, job_ids in list(by_survey.items()):
+        if len(job_ids) < 2:
+            singles.extend(job_ids)
+            del by_survey[survey_id]
+    return by_survey, singles
+
+
+def json_digest(data):
+    # a digest of json content that ignores formatting and key order
+    return hashlib.sha256(json.dumps(json.loads(data), sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def same_parameter(a, b):
+    # parameters are sent as form fields, so compare them as json where they parse and as text otherwise
+    def normalise(value):
+        if isinstance(value, (bytes, str)):
+            try:
+                return json.loads(value)
+            except ValueError:
+                return value
+        return value
+
+    return normalise(a) == normalise(b) or str(a) == str(b)
+
+
+class _DigestWriter(object):
+    # a write-only file object that only hashes what is written to it
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return len(data)
+
+
+def initial_job_surveys(job_ids, survey_id):
+    # survey_id can be a single survey for all jobs, or a dict of job id to survey id
+    if isinstance(survey_id, dict):
+        return dict(survey_id)
+    return {job_id: survey_id for job_id in job_ids if survey_id}
+
+
 class Thematic(object):
     num_retries = 5000
+    upload_chunk_size = 1024 * 1024
+    download_chunk_size = 1024 * 1024
+    # downloads to a path bigger than a segment are fetched as up to download_segments parallel range requests
+    download_segments = 4
+    download_segment_size = 8 * 1024 * 1024
+    # where the row maps of jobs run with collapse_duplicates are kept by job id. Results can't be re-expanded
+    # without them, so they live in the home directory rather than a temp dir that gets cleaned up.
+    duplicate_map_dir = os.path.join(os.path.expanduser("~"), ".thematic", "duplicates")
+    # where samples of files uploaded to discover_new_themes are kept
+    sample_dir = os.path.join(tempfile.gettempdir(), "thematic-samples")
 
     @classmethod
-    def FromLogin(self, base_url, username, password):
-        self.base_url = base_url
+    def FromLogin(cls, base_url, username, password, **kwargs):
         # create with unknown key
-        thematic = Thematic(base_url, "")
+        thematic = cls(base_url, "", **kwargs)
         # login which will fill in key
         thematic.retrieve_apikey(username, password)
         return thematic
 
-    def __init__(self, base_url, api_key):
+    def __init__(
+        self,
+        base_url,
+        api_key,
+        pool_connections=10,
+        pool_maxsize=10,
+        pool_block=False,
+        polling=None,
+        compress_uploads=False,
+        upload_progress=None,
+        cache=None,
+        rate_limiter=None,
+        retry_policy=None,
+        metrics=None,
+        duplicate_map_dir=None,
+    ):
         self.base_url = base_url
         self.api_key = api_key
+        if duplicate_map_dir is not None:
+            self.duplicate_map_dir = duplicate_map_dir
+        # uploads are streamed, optionally gzipped, and upload_progress(bytes_sent, total_bytes, elapsed) is called as they go
+        self.compress_uploads = compress_uploads
+        self.upload_progress = upload_progress
+        # the polling strategy learns from the jobs it has seen, so it is shared by all waits on this instance
+        self.polling = polling or AdaptivePolling()
+        # connection pool settings; pool_maxsize is the number of keep-alive connections kept per host
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        # optional ResultCache for the outputs of finished jobs
+        self.cache = cache
+        self._terminal_jobs = set()
+        # digests of local files and of the outputs of finished jobs, for skip_if_unchanged
+        self._file_digests = {}
+        self._output_digests = {}
+        # an optional RateLimiter, which can be shared between instances, and the policy for retrying
+        # throttled and failed requests
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        # request_hooks are called with an event for every request once it is done (after any retries),
+        # job_hooks with the timings of every job that was waited for until it ended; a Metrics
+        # instance collects both
+        self.request_hooks = []
+        self.job_hooks = []
+        self.metrics = metrics
+        if metrics is not None:
+            self.request_hooks.append(metrics.record_request)
+            self.job_hooks.append(metrics.record_job)
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def __getstate__(self):
+        # sessions and locks can't be pickled, a fresh pool is created lazily in the receiving process
+        state = self.__dict__.copy()
+        state["_session"] = None
+        del state["_session_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._session_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_session(self):
+        session = self._session
+        if session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, pool_block=self.pool_block)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+                session = self._session
+        return session
+
+    def _request(self, method, url, **kwargs):
+        body = kwargs.get("data")
+        category = request_category(method, url, uploading=isinstance(body, MultipartStream))
+        attempt = 0
+        r = None
+        start_time = time.time()
+        try:
+            while True:
+                if self.rate_limiter:
+                    self.rate_limiter.acquire(category)
+                try:
+                    r = self._get_session().request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if not self.retry_policy or not self.retry_policy.should_retry(method, url, attempt):
+                        raise
+                    log.warning("{} {} failed, retrying ({})".format(method, url, e))
+                    delay = self.retry_policy.delay(attempt)
+                else:
+                    if not self.retry_policy or not self.retry_policy.should_retry(method, url, attempt, r.status_code):
+                        return r
+                    retry_after = parse_retry_after(r.headers.get("Retry-After"))
+                    delay = self.retry_policy.delay(attempt, retry_after)
+                    if retry_after is not None and self.rate_limiter:
+                        # the server wants every request to back off, not just this one
+                        self.rate_limiter.block_for(delay)
+                    log.warning("{} {} returned {}, retrying".format(method, url, r.status_code))
+                    r.close()
+                    r = None
+                attempt += 1
+                time.sleep(delay)
+                if isinstance(body, MultipartStream):
+                    body.reset()
+        finally:
+            if self.request_hooks:
+                self._request_done(method, url, kwargs, r, attempt, time.time() - start_time)
+
+    def _request_done(self, method, url, kwargs, r, retries, seconds):
+        body = kwargs.get("data")
+        if isinstance(body, MultipartStream):
+            bytes_sent = body.bytes_sent
+        elif r is not None and isinstance(r.request.body, (bytes, str)):
+            bytes_sent = len(r.request.body)
+        else:
+            bytes_sent = 0
+        bytes_received = None
+        if r is not None:
+            if kwargs.get("stream"):
+                # the body hasn't been read yet, so go by what the server says it is sending
+                bytes_received = int(r.headers.get("Content-Length", 0)) or None
+            else:
+                bytes_received = len(r.content)
+        event = {
+            "endpoint": endpoint_of(self.base_url, url),
+            "method": method,
+            "url": url,
+            "status": r.status_code if r is not None else None,
+            "seconds": seconds,
+            "retries": retries,
+            "bytes_sent": bytes_sent,
+            "bytes_received": bytes_received,
+        }
+        call_hooks(self.request_hooks, event)
+
+    def _job_done(self, watch):
+        if self.job_hooks:
+            call_hooks(self.job_hooks, job_event(watch))
+
+    def _post_files(self, url, files, data):
+        if not files:
+            return self._request("POST", url, headers={"X-API-Authentication": self.api_key}, data=data)
+        body = MultipartStream(data, files, chunk_size=self.upload_chunk_size, compress=self.compress_uploads, progress=self.upload_progress)
+        headers = {"X-API-Authentication": self.api_key, "Content-Type": body.content_type}
+        if self.compress_uploads:
+            headers["Content-Encoding"] = "gzip"
+        return self._request("POST", url, headers=headers, data=body)
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
 
     def retrieve_apikey(self, username, password):
         payload = {"username": username, "password": password}
-        r = requests.post(self.base_url + "/login", data=payload)
+        r = self._request("POST", self.base_url + "/login", data=payload)
 
         try:
             response = json.loads(r.text)
@@ -56,7 +326,7 @@ class Thematic(object):
         url = self.base_url + "/create_survey"
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
-        r = requests.post(url, headers={"X-API-Authentication": self.api_key}, data=payload)
+        r = self._request("POST", url, headers={"X-API-Authentication": self.api_key}, data=payload)
 
         try:
             response = json.loads(r.text)
@@ -73,10 +343,10 @@ class Thematic(object):
     def update_survey(self, survey_id, name=None, total_columns=None, columns=None, has_header=None, modelset_id=None, output_format=None):
         payload = {}
         if name:
-            payload["columns"] = name
+            payload["name"] = name
         if columns:
-            payload["columns"] = columns
-        if has_header:
+            payload["columns"] = columns if isinstance(columns, str) else json.dumps(columns)
+        if has_header is not None:
             payload["has_header"] = has_header
         if total_columns:
             payload["total_columns"] = total_columns
@@ -87,7 +357,7 @@ class Thematic(object):
         url = self.base_url + "/survey/{}".format(survey_id)
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
-        r = requests.put(url, headers={"X-API-Authentication": self.api_key}, data=payload)
+        r = self._request("PUT", url, headers={"X-API-Authentication": self.api_key}, data=payload)
 
         try:
             response = json.loads(r.text)
@@ -103,7 +373,7 @@ class Thematic(object):
         url = self.base_url + "/survey/{}".format(survey_id)
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
-        r = requests.get(url, headers={"X-API-Authentication": self.api_key})
+        r = self._request("GET", url, headers={"X-API-Authentication": self.api_key})
 
         try:
             response = json.loads(r.text)
@@ -125,7 +395,7 @@ class Thematic(object):
         url = self.base_url + "/create_job"
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
-        r = requests.post(url, headers={"X-API-Authentication": self.api_key}, files=files, data=payload)
+        r = self._post_files(url, files, payload)
         try:
             response = json.loads(r.text)
         except Exception:
@@ -137,7 +407,17 @@ class Thematic(object):
             raise Exception("run_job: Bad Response")
         return response["data"]["jobid"]
 
-    def run_job(self, survey_id, csv_filename, themes_file=None, previous_job_id=None, params=None):
+    def run_job(self, survey_id, csv_filename, themes_file=None, previous_job_id=None, params=None, collapse_duplicates=False, validate=False):
+        if validate:
+            self._preflight("run_job", survey_id, csv_filename)
+        if collapse_duplicates:
+            return self._run_collapsed(
+                survey_id,
+                "csv",
+                csv_filename,
+                collapse_duplicates,
+                lambda filename: self.run_job(survey_id, filename, themes_file=themes_file, previous_job_id=previous_job_id, params=params),
+            )
         with open(csv_filename, "rb") as csv_file_obj:
             files = {"csv_file": csv_file_obj}
             if themes_file:
@@ -148,24 +428,180 @@ class Thematic(object):
                 return self.run_job_with_file_object(survey_id, files, previous_job_id=previous_job_id, params=params)
         return None
 
+    def validate_csv(self, survey_id, csv_filename, **kwargs):
+        # checks a file against the survey's definition before uploading it, see preflight.validate_csv
+        survey = self.get_survey_details(survey_id)
+        has_header = str(survey.get("has_header")).lower() in ("true", "1")
+        return validate_csv(csv_filename, survey["total_columns"], columns=survey.get("columns"), has_header=has_header, **kwargs)
+
+    def _preflight(self, name, survey_id, csv_filename):
+        report = self.validate_csv(survey_id, csv_filename)
+        if not report["ok"]:
+            for error in report["errors"]:
+                where = "row {}".format(error["row"]) if error["row"] is not None else "file"
+                log.error("{} {}: {}".format(csv_filename, where, error["message"]))
+            first = report["errors"][0]
+            raise Exception("{}: {} does not match survey {} ({} errors, the first: {})".format(name, csv_filename, survey_id, len(report["errors"]), first["message"]))
+
+    def _survey_has_header(self, survey_id):
+        has_header = self.get_survey_details(survey_id).get("has_header")
+        return str(has_header).lower() in ("true", "1")
+
+    def _file_digest(self, filename, canonical_json=False):
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, canonical_json)
+        digest = self._file_digests.get(key)
+        if digest is None:
+            with open(filename, "rb") as f:
+                if canonical_json:
+                    digest = json_digest(f.read())
+                else:
+                    writer = _DigestWriter()
+                    shutil.copyfileobj(f, writer, self.upload_chunk_size)
+                    digest = writer.sha256.hexdigest()
+            self._file_digests[key] = digest
+        return digest
+
+    def _output_digest(self, job_id, artifact, retrieve, canonical_json=False):
+        # only used for finished jobs, whose outputs can't change, so digests are kept for good
+        key = (job_id, artifact, canonical_json)
+        digest = self._output_digests.get(key)
+        if digest is not None:
+            return digest
+        cache_key = artifact + (".json.sha256" if canonical_json else ".sha256")
+        if self.cache is not None:
+            cached = self.cache.get(job_id, cache_key)
+            if cached is not None:
+                digest = cached.decode("ascii")
+        if digest is None:
+            if canonical_json:
+                data = retrieve(job_id)
+                if not data:
+                    return None
+                try:
+                    digest = json_digest(data)
+                except ValueError:
+                    return None
+            else:
+                writer = _DigestWriter()
+                if not retrieve(job_id, file_obj=writer):
+                    return None
+                digest = writer.sha256.hexdigest()
+            if self.cache is not None:
+                self.cache.put(job_id, cache_key, digest.encode("ascii"))
+        self._output_digests[key] = digest
+        return digest
+
+    def _unchanged(self, name, previous_job_id, outputs, data_filename=None, themes_filename=None, job_options=None, same=None):
+        # True if the previous job already has the files about to be configured, as a list of
+        # (artifact, local filename, retrieve method, compare as json), and same() if given.
+        # Sending data, extra themes or job options always makes a new job.
+        if data_filename or themes_filename or job_options:
+            return False
+        if self.get_job_details(previous_job_id)["state"] != "finished":
+            return False
+        for artifact, filename, retrieve, canonical_json in outputs:
+            digest = self._output_digest(previous_job_id, artifact, retrieve, canonical_json)
+            if digest is None or digest != self._file_digest(filename, canonical_json):
+                return False
+        if same is not None and not same():
+            return False
+        log.info("{}: Nothing changed since job {}, not starting a new job".format(name, previous_job_id))
+        return True
+
+    def _duplicate_map_path(self, job_id, artifact):
+        return os.path.join(self.duplicate_map_dir, "{}.{}.json".format(job_id, artifact))
+
+    def _record_duplicates(self, job_id, artifact, builds_on=None):
+        # every job with a collapsed output is noted in a ledger next to the maps, so that a map going
+        # missing is an error rather than results quietly coming back collapsed. builds_on is set for
+        # outputs that add or delete rows of a collapsed job, which no map can re-expand.
+        os.makedirs(self.duplicate_map_dir, exist_ok=True)
+        line = json.dumps({"job_id": job_id, "artifact": artifact, "builds_on": builds_on}) + "\n"
+        with open(os.path.join(self.duplicate_map_dir, "jobs.jsonl"), "a") as f:
+            f.write(line)
+
+    def _duplicates_record(self, job_id, artifact):
+        found = None
+        try:
+            with open(os.path.join(self.duplicate_map_dir, "jobs.jsonl")) as f:
+                for line in f:
+                    if job_id in line:
+                        record = json.loads(line)
+                        if record["job_id"] == job_id and record["artifact"] == artifact:
+                            found = record
+        except FileNotFoundError:
+            pass
+        if found is None and os.path.exists(self._duplicate_map_path(job_id, artifact)):
+            found = {"job_id": job_id, "artifact": artifact, "builds_on": None}
+        return found
+
+    def _inherit_duplicates(self, job_id, previous_job_id, changes_rows):
+        # a job built on a collapsed job has collapsed outputs too. When it recodes the same rows it
+        # shares the previous job's map, when it adds or deletes rows its full output matches no map.
+        for artifact in ("csv", "incremental_csv"):
+            record = self._duplicates_record(previous_job_id, artifact)
+            if record is None:
+                continue
+            if changes_rows:
+                if artifact == "csv":
+                    self._record_duplicates(job_id, artifact, builds_on=record["builds_on"] or previous_job_id)
+                continue
+            source = self._duplicate_map_path(previous_job_id, artifact)
+            if record["builds_on"] is None and os.path.exists(source):
+                target = self._duplicate_map_path(job_id, artifact)
+                for suffix in ("", ".rows", ".widths"):
+                    try:
+                        os.link(source + suffix, target + suffix)
+                    except OSError:
+                        shutil.copyfile(source + suffix, target + suffix)
+            self._record_duplicates(job_id, artifact, builds_on=record["builds_on"])
+
+    def _run_collapsed(self, survey_id, artifact, csv_filename, collapse_duplicates, submit):
+        # uploads each distinct row once, and keeps the map needed to re-expand the job's output. With
+        # collapse_duplicates=True rows are compared on the survey's response columns, so that rows
+        # that only differ in ids, dates and the like are still uploaded once.
+        survey = self.get_survey_details(survey_id)
+        has_header = str(survey.get("has_header")).lower() in ("true", "1")
+        columns = survey_columns(survey.get("columns")) if collapse_duplicates is True else collapse_duplicates
+        if not columns:
+            raise Exception("collapse_duplicates: Survey {} has no response columns to compare".format(survey_id))
+        fd, collapsed_filename = tempfile.mkstemp(suffix=".csv")
+        try:
+            with io.open(fd, "w", encoding="utf-8", newline="") as f:
+                duplicates = collapse_duplicates_in_file(csv_filename, f, columns=columns, has_header=has_header)
+            log.info("Uploading {} distinct rows out of {}".format(duplicates.num_unique, len(duplicates.rows)))
+            job_id = submit(collapsed_filename)
+        finally:
+            os.remove(collapsed_filename)
+        duplicates.original_filename = os.path.abspath(csv_filename)
+        os.makedirs(self.duplicate_map_dir, exist_ok=True)
+        duplicates.save(self._duplicate_map_path(job_id, artifact))
+        self._record_duplicates(job_id, artifact)
+        return job_id
+
     def create_job_from_artifacts(self, survey_id, artifacts_filename):
         with open(artifacts_filename, "rb") as artifacts_file_obj:
             files = {"artifacts_file": artifacts_file_obj}
             return self.run_job_with_file_object(survey_id, files)
 
-    def delete_rows(self, survey_id, delete_rows_sort_file, previous_job_id, disambiguation_columns):
+    def delete_rows(self, survey_id, delete_rows_sort_file, previous_job_id, disambiguation_columns, validate=False):
+        if validate:
+            self._preflight("delete_rows", survey_id, delete_rows_sort_file)
 
         params = {"job_type": "deleterows", "updated_parameters": json.dumps({"disambiguation_columns": disambiguation_columns})}
 
         with open(delete_rows_sort_file, "rb") as delete_rows_sort_file_obj:
             files = {"csv_file": delete_rows_sort_file_obj}
-            return self.run_job_with_file_object(survey_id, files, previous_job_id=previous_job_id, params=params)
+            job_id = self.run_job_with_file_object(survey_id, files, previous_job_id=previous_job_id, params=params)
+        self._inherit_duplicates(job_id, previous_job_id, True)
+        return job_id
 
     def cancel_job(self, job_id):
         url = self.base_url + "/job/" + job_id + "/cancel"
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
-        r = requests.post(url, headers={"X-API-Authentication": self.api_key})
+        r = self._request("POST", url, headers={"X-API-Authentication": self.api_key})
         response = r.text
         return response
 
@@ -173,13 +609,13 @@ class Thematic(object):
         url = self.base_url + "/job/" + job_id + "/delete"
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
-        r = requests.get(url, headers={"X-API-Authentication": self.api_key})
+        r = self._request("GET", url, headers={"X-API-Authentication": self.api_key})
         response = r.text
         return response
 
     def _run_post_request_with_json_response(self, url, files, data):
         log.info("Posting URL: {}".format(url))
-        r = requests.post(url, headers={"X-API-Authentication": self.api_key}, files=files, data=data)
+        r = self._post_files(url, files, data)
         if r.status_code != 200:
             raise Exception("Failed with code {} and reason: {}".format(r.status_code, r.text))
 
@@ -212,14 +648,32 @@ class Thematic(object):
 
         if "jobid" not in response["data"]:
             raise Exception("run_incremental_update: Bad Response")
+        if previous_job_id and not replace_data:
+            self._inherit_duplicates(response["data"]["jobid"], previous_job_id, True)
         return response["data"]["jobid"]
 
-    def run_replace_data(self, survey_id, csv_filename, previous_job_id, themes_filename=None, job_options={}):
+    def run_replace_data(self, survey_id, csv_filename, previous_job_id, themes_filename=None, job_options={}, validate=False):
+        if validate:
+            self._preflight("run_replace_data", survey_id, csv_filename)
         with open(csv_filename, "rb") as csv_file_obj:
             return self.run_incremental_update_with_file_object(survey_id, csv_file_obj, previous_job_id, True, themes_filename=themes_filename, job_options=job_options)
         return None
 
-    def run_incremental_update(self, survey_id, csv_filename, previous_job_id, disambiguation_columns=None, job_options={}):
+    def run_incremental_update(
+        self, survey_id, csv_filename, previous_job_id, disambiguation_columns=None, job_options={}, collapse_duplicates=False, validate=False
+    ):
+        if validate:
+            self._preflight("run_incremental_update", survey_id, csv_filename)
+        if collapse_duplicates:
+            return self._run_collapsed(
+                survey_id,
+                "incremental_csv",
+                csv_filename,
+                collapse_duplicates,
+                lambda filename: self.run_incremental_update(
+                    survey_id, filename, previous_job_id, disambiguation_columns=disambiguation_columns, job_options=job_options
+                ),
+            )
         with open(csv_filename, "rb") as csv_file_obj:
             return self.run_incremental_update_with_file_object(survey_id, csv_file_obj, previous_job_id, False, disambiguation_columns=disambiguation_columns, job_options=job_options)
         return None
@@ -228,7 +682,7 @@ class Thematic(object):
         files = {"csv_file": open(csv_filename, "rb")}
         payload = {"survey_id": survey_id, "job_type": "translate"}
         if columns:
-            job_options["columns"] = columns
+            job_options = dict(job_options, columns=columns)
         payload["job_options"] = json.dumps(job_options)
         response = self._run_post_request_with_json_response(self.base_url + "/create_job", files, payload)
         files["csv_file"].close()
@@ -237,7 +691,44 @@ class Thematic(object):
             raise Exception("run_translations: Bad Response")
         return response["data"]["jobid"]
 
-    def configure_concepts(self, concepts_filename, previous_job_id, data_filename=None, themes_filename=None, job_options={}):
+    def run_sharded_translations(
+        self, survey_id, csv_filename, output_path, columns=None, job_options={}, shard_rows=50000, max_jobs=8, max_workers=4, retries=2, has_header=None
+    ):
+        # Translates a large file as many smaller jobs: the rows are split into shards of shard_rows,
+        # up to max_jobs translate jobs run at once, a shard whose job fails is submitted again up to
+        # retries times, and the translated shards are joined in their original order into output_path.
+        # Returns the job ids of the shards in order.
+        if has_header is None:
+            has_header = self._survey_has_header(survey_id)
+        tmp_dir = tempfile.mkdtemp(prefix="thematic-shards-")
+        try:
+            shard_paths = split_csv(csv_filename, tmp_dir, shard_rows, has_header=has_header)
+            log.info("Translating {} in {} shards of up to {} rows".format(csv_filename, len(shard_paths), shard_rows))
+            chains = [
+                Chain(i, [Step("run_translations", survey_id=survey_id, csv_filename=path, columns=columns, job_options=job_options)], survey_id=survey_id)
+                for i, path in enumerate(shard_paths)
+            ]
+            results = PipelineExecutor(self, max_workers=max_workers, max_jobs=max_jobs, retries=retries).run(chains)
+            failed = [key for key in sorted(results) if results[key]["error"]]
+            if failed:
+                raise Exception("run_sharded_translations: {} of {} shards failed ({})".format(len(failed), len(chains), results[failed[0]]["error"]))
+            job_ids = [results[i]["job_id"] for i in range(len(chains))]
+
+            output_paths = [os.path.join(tmp_dir, "translated_{:05d}.csv".format(i)) for i in range(len(job_ids))]
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for ok in executor.map(lambda args: self.retrieve_csv(args[0], path=args[1]), zip(job_ids, output_paths)):
+                    if not ok:
+                        raise Exception("run_sharded_translations: Failed to retrieve a translated shard")
+            join_csv(output_paths, output_path, has_header=has_header)
+            return job_ids
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def configure_concepts(self, concepts_filename, previous_job_id, data_filename=None, themes_filename=None, job_options={}, skip_if_unchanged=False):
+        if skip_if_unchanged and self._unchanged(
+            "configure_concepts", previous_job_id, [("concepts", concepts_filename, self.retrieve_concepts, False)], data_filename, themes_filename, job_options
+        ):
+            return previous_job_id
         files = {"concepts_file": open(concepts_filename, "rb")}
         if data_filename:
             files["csv_file"] = open(data_filename, "rb")
@@ -252,9 +743,20 @@ class Thematic(object):
 
         if "jobid" not in response["data"]:
             raise Exception("configure_concepts: Bad Response")
+        if not data_filename:
+            self._inherit_duplicates(response["data"]["jobid"], previous_job_id, False)
         return response["data"]["jobid"]
 
-    def configure_word_frequencies(self, nouns_filename, verbs_filename, adjectives_filename, previous_job_id, data_filename=None, themes_filename=None, job_options={}):
+    def configure_word_frequencies(
+        self, nouns_filename, verbs_filename, adjectives_filename, previous_job_id, data_filename=None, themes_filename=None, job_options={}, skip_if_unchanged=False
+    ):
+        outputs = [
+            ("nouns", nouns_filename, self.retrieve_nouns, False),
+            ("verbs", verbs_filename, self.retrieve_verbs, False),
+            ("adjectives", adjectives_filename, self.retrieve_adjectives, False),
+        ]
+        if skip_if_unchanged and self._unchanged("configure_word_frequencies", previous_job_id, outputs, data_filename, themes_filename, job_options):
+            return previous_job_id
         files = {"nouns_file": open(nouns_filename, "rb"), "verbs_file": open(verbs_filename, "rb"), "adjectives_file": open(adjectives_filename, "rb")}
         if data_filename:
             files["csv_file"] = open(data_filename, "rb")
@@ -273,9 +775,16 @@ class Thematic(object):
 
         if "jobid" not in response["data"]:
             raise Exception("configure_word_frequencies: Bad Response")
+        if not data_filename:
+            self._inherit_duplicates(response["data"]["jobid"], previous_job_id, False)
         return response["data"]["jobid"]
 
-    def configure_themes(self, themes_filename, previous_job_id, data_filename=None, job_options={}):
+    def configure_themes(self, themes_filename, previous_job_id, data_filename=None, job_options={}, skip_if_unchanged=False):
+        # themes are compared as json, as the server may lay them out differently
+        if skip_if_unchanged and self._unchanged(
+            "configure_themes", previous_job_id, [("themes", themes_filename, self.retrieve_themes, True)], data_filename, None, job_options
+        ):
+            return previous_job_id
         files = {"themes_file": open(themes_filename, "rb")}
         if data_filename:
             files["csv_file"] = open(data_filename, "rb")
@@ -288,6 +797,8 @@ class Thematic(object):
 
         if "jobid" not in response["data"]:
             raise Exception("configure_themes: Bad Response")
+        if not data_filename:
+            self._inherit_duplicates(response["data"]["jobid"], previous_job_id, False)
         return response["data"]["jobid"]
 
     def configure_language_model(self, language_model_filename, previous_job_id, data_filename=None, themes_filename=None, job_options={}):
@@ -307,9 +818,15 @@ class Thematic(object):
 
         if "jobid" not in response["data"]:
             raise Exception("configure_language_model: Bad Response")
+        if not data_filename:
+            self._inherit_duplicates(response["data"]["jobid"], previous_job_id, False)
         return response["data"]["jobid"]
 
-    def configure_stopwords(self, stopwords_filename, previous_job_id, data_filename=None, themes_filename=None, job_options={}):
+    def configure_stopwords(self, stopwords_filename, previous_job_id, data_filename=None, themes_filename=None, job_options={}, skip_if_unchanged=False):
+        if skip_if_unchanged and self._unchanged(
+            "configure_stopwords", previous_job_id, [("stopwords", stopwords_filename, self.retrieve_stopwords, False)], data_filename, themes_filename, job_options
+        ):
+            return previous_job_id
         files = {"stopwords_file": open(stopwords_filename, "rb")}
         if data_filename:
             files["csv_file"] = open(data_filename, "rb")
@@ -326,9 +843,17 @@ class Thematic(object):
 
         if "jobid" not in response["data"]:
             raise Exception("configure_stopwords: Bad Response")
+        if not data_filename:
+            self._inherit_duplicates(response["data"]["jobid"], previous_job_id, False)
         return response["data"]["jobid"]
 
-    def configure_parameters(self, parameters, previous_job_id, data_filename=None, themes_filename=None):
+    def configure_parameters(self, parameters, previous_job_id, data_filename=None, themes_filename=None, skip_if_unchanged=False):
+        def same():
+            current = self.retrieve_parameters(previous_job_id) or {}
+            return all(key in current and same_parameter(current[key], value) for key, value in parameters.items())
+
+        if skip_if_unchanged and self._unchanged("configure_parameters", previous_job_id, [], data_filename, themes_filename, same=same):
+            return previous_job_id
         files = {}
         if data_filename:
             files["csv_file"] = open(data_filename, "rb")
@@ -344,13 +869,15 @@ class Thematic(object):
 
         if "jobid" not in response["data"]:
             raise Exception("configure_parameters: Bad Response")
+        if not data_filename:
+            self._inherit_duplicates(response["data"]["jobid"], previous_job_id, False)
         return response["data"]["jobid"]
 
     def get_job_details(self, job_id):
         url = self.base_url + "/job/" + job_id + "/info"
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
-        r = requests.get(url, headers={"X-API-Authentication": self.api_key})
+        r = self._request("GET", url, headers={"X-API-Authentication": self.api_key})
         if r.status_code != 200:
             raise Exception("get_job_status: Bad Response: {} {}".format(r.status_code, r.text))
 
@@ -370,61 +897,186 @@ class Thematic(object):
         url = self.base_url + "/job/" + job_id + "/log"
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
-        r = requests.get(url, headers={"X-API-Authentication": self.api_key})
+        r = self._request("GET", url, headers={"X-API-Authentication": self.api_key})
         response = r.text
         return response
 
-    def wait_for_job_completion(self, job_id, check_continue=None):
-        ready = False
+    def tail_job_logs(self, job_id, tail):
+        # the lines added to a job's log since tail was last given to this method
+        url = self.base_url + "/job/" + job_id + "/log"
+        if LOG_REQUESTS:
+            log.info("Calling URL: {}".format(url))
+        headers = {"X-API-Authentication": self.api_key}
+        if tail.offset:
+            # offsets are into the unencoded log
+            headers["Range"] = "bytes={}-".format(tail.offset)
+            headers["Accept-Encoding"] = "identity"
+        r = self._request("GET", url, headers=headers)
+        if r.status_code == 416:
+            # nothing new yet
+            return []
+        if r.status_code == 206:
+            return tail.feed(r.content, content_range(r)[0])
+        if r.status_code != 200:
+            raise Exception("tail_job_logs: Bad Response: {} {}".format(r.status_code, r.text))
+        return tail.feed(r.content)
+
+    def follow_job_logs(self, job_id, check_continue=None, polling=None):
+        # yields the lines of a job's log as they are written, until the job ends
+        polling = polling or self.polling
+        watch = JobWatch(job_id, polling)
+        tail = LogTail()
+        num_exceptions = 0
+        while True:
+            try:
+                status = self.get_job_details(job_id)["state"]
+                lines = self.tail_job_logs(job_id, tail)
+                num_exceptions = 0
+            except Exception as e:
+                num_exceptions += 1
+                if num_exceptions > self.num_retries:
+                    raise Exception("follow_job_logs: Failed after {} tries: {}".format(num_exceptions, e))
+                log.warning("\tFailed to get job log, retrying ({})".format(e))
+                time.sleep(polling.error_interval(num_exceptions))
+                continue
+            for line in lines:
+                yield line
+            if watch.update(status) and status in TERMINAL_STATES:
+                self._job_done(watch)
+            if status in TERMINAL_STATES:
+                for line in tail.flush():
+                    yield line
+                return
+            if check_continue and not check_continue():
+                raise Exception("follow_job_logs: Interrupted")
+            time.sleep(watch.next_interval())
+
+    def _follow_log(self, job_id, tail, on_log, ended):
+        # passes new log lines to on_log while waiting, without letting a failed fetch stop the wait
+        try:
+            lines = self.tail_job_logs(job_id, tail)
+        except Exception as e:
+            log.warning("\tFailed to get job log ({})".format(e))
+            lines = []
+        if ended:
+            lines += tail.flush()
+        for line in lines:
+            on_log(job_id, line)
+
+    def wait_for_job_completion(self, job_id, check_continue=None, polling=None, on_poll=None, on_log=None):
+        # on_log(job_id, line) is called with each new line of the job's log, fetched along with its state
+        polling = polling or self.polling
+        watch = JobWatch(job_id, polling)
+        tail = LogTail() if on_log else None
         log.info("Waiting for results of job " + job_id + " ...")
-        current_status = "unknown"
         num_exceptions = 0
-        start_time = time.time()
-        process_start_time = 0
-        end_time = 0
         log.info("\tStarted at {}".format(datetime.datetime.now()))
-        while not ready:
+        while True:
             # protect the endpoint to get job details against transmission errors (because we call it so much)
             try:
                 job_details = self.get_job_details(job_id)
                 num_exceptions = 0
             except Exception as e:
-                if num_exceptions >= self.num_retries:
-                    num_exceptions += 1
-                else:
+                num_exceptions += 1
+                if num_exceptions > self.num_retries:
                     raise Exception("Failure waiting for job completion after {} tries: {}".format(num_exceptions, e))
+                log.warning("\tFailed to get job status, retrying ({})".format(e))
+                time.sleep(polling.error_interval(num_exceptions))
+                continue
 
             status = job_details["state"]
+            if watch.update(status):
+                log.info("\tStatus is " + status)
+                if status in TERMINAL_STATES:
+                    self._job_done(watch)
+            if on_log:
+                self._follow_log(job_id, tail, on_log, status in TERMINAL_STATES)
             if status == "finished":
-                ready = True
                 log.info("\tFinished at {}".format(datetime.datetime.now()))
-                end_time = time.time()
                 break
-            elif status == "in_progress":
-                process_start_time = time.time()
             elif status == "errored":
                 log.error("\tErrored at {}".format(datetime.datetime.now()))
                 raise Exception("wait_for_job_completion: Job errored and did not complete")
             elif status == "canceled":
                 log.info("\tCancelled at {}".format(datetime.datetime.now()))
                 raise Exception("wait_for_job_completion: Job was canceled")
-            if status != current_status:
-                current_status = status
-                log.info("\tStatus is " + current_status)
+
+            if on_poll:
+                on_poll(job_id, job_details, watch.eta())
 
             # check if we should still be waiting for this job
             if check_continue and not check_continue():
                 raise Exception("wait_for_job_completion: Interrupted")
 
-            time.sleep(2)
-        log.info("\tStatus is finished")
-        if process_start_time:
+            time.sleep(watch.next_interval())
+        if watch.process_start_time:
             # only prints if we spent time processing
             log.info(
                 "\tWaited {}s in queue and spent {}s processing".format(
-                    datetime.timedelta(seconds=(process_start_time - start_time)), datetime.timedelta(seconds=(end_time - process_start_time))
+                    datetime.timedelta(seconds=watch.queue_seconds), datetime.timedelta(seconds=watch.processing_seconds)
                 )
             )
+        return job_details
+
+    def _poll_job_states(self, pending, job_surveys):
+        states = {}
+        by_survey, singles = group_jobs_for_polling(pending, job_surveys)
+        for survey_id, job_ids in by_survey.items():
+            jobs = self.list_jobs(survey_id=survey_id)
+            listed = {job_id_of(job): job for job in jobs}
+            for job_id in job_ids:
+                if listed.get(job_id, {}).get("state"):
+                    states[job_id] = listed[job_id]
+                else:
+                    singles.append(job_id)
+        for job_id in singles:
+            job_details = self.get_job_details(job_id)
+            states[job_id] = job_details
+            if job_details.get("survey_id"):
+                job_surveys[job_id] = job_details["survey_id"]
+        return states
+
+    def as_completed(self, job_ids, survey_id=None, check_continue=None, polling=None, on_poll=None):
+        polling = polling or self.polling
+        watches = {job_id: JobWatch(job_id, polling) for job_id in job_ids}
+        pending = list(watches)
+        job_surveys = initial_job_surveys(pending, survey_id)
+        num_exceptions = 0
+        log.info("Waiting for results of {} jobs ...".format(len(pending)))
+        while pending:
+            try:
+                states = self._poll_job_states(pending, job_surveys)
+                num_exceptions = 0
+            except Exception as e:
+                num_exceptions += 1
+                if num_exceptions > self.num_retries:
+                    raise Exception("Failure waiting for job completion after {} tries: {}".format(num_exceptions, e))
+                log.warning("\tFailed to get job states, retrying ({})".format(e))
+                time.sleep(polling.error_interval(num_exceptions))
+                continue
+
+            for job_id in list(pending):
+                job_details = states[job_id]
+                watches[job_id].update(job_details["state"])
+                if job_details["state"] in TERMINAL_STATES:
+                    self._job_done(watches[job_id])
+                    pending.remove(job_id)
+                    log.info("\tJob {} is {}".format(job_id, job_details["state"]))
+                    yield job_id, job_details
+                elif on_poll:
+                    on_poll(job_id, job_details, watches[job_id].eta())
+            if not pending:
+                break
+
+            # check if we should still be waiting for these jobs
+            if check_continue and not check_continue():
+                raise Exception("as_completed: Interrupted")
+
+            # a single poll serves every job, so wait for whichever job is expected to change first
+            time.sleep(min(watches[job_id].next_interval() for job_id in pending))
+
+    def wait_for_jobs(self, job_ids, survey_id=None, check_continue=None, polling=None, on_poll=None):
+        return dict(self.as_completed(job_ids, survey_id=survey_id, check_continue=check_continue, polling=polling, on_poll=on_poll))
 
     def list_jobs(self, survey_id=None, job_type=None):
         payload = {}
@@ -436,9 +1088,9 @@ class Thematic(object):
         url = self.base_url + "/jobs/"
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
-        r = requests.get(url, headers={"X-API-Authentication": self.api_key}, params=payload)
+        r = self._request("GET", url, headers={"X-API-Authentication": self.api_key}, params=payload)
         if r.status_code != 200:
-            return None
+            raise Exception("list_jobs: Bad Response: {} {}".format(r.status_code, r.text))
 
         try:
             response = json.loads(r.text)
@@ -448,80 +1100,183 @@ class Thematic(object):
 
         return response["data"]["jobs"]
 
-    def _internal_request_to_text_or_file(self, url, file_obj):
+    def _downloader(self):
+        return Downloader(
+            self._request, chunk_size=self.download_chunk_size, segments=self.download_segments, min_segment_size=self.download_segment_size
+        )
+
+    def _internal_request_to_text_or_file(self, url, file_obj, path=None):
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
+        headers = {"X-API-Authentication": self.api_key}
+        if path:
+            return self._downloader().to_path(url, headers, path)
         if file_obj:
-            r = requests.get(url, headers={"X-API-Authentication": self.api_key}, stream=True)
-            if r.status_code != 200:
-                log.error("Failed to retrieve. Code {} message {}".format(r.status_code, r.text))
-                return None
-            for chunk in r.iter_content(chunk_size=512):
-                if chunk:  # filter out keep-alive new chunks
-                    file_obj.write(chunk)
-            return True
+            return self._downloader().to_file(url, headers, file_obj)
+        return self._downloader().to_bytes(url, headers)
 
-        else:
-            r = requests.get(url, headers={"X-API-Authentication": self.api_key})
-            if r.status_code != 200:
-                log.error("Failed to retrieve. Code {} message {}".format(r.status_code, r.text))
+    def _is_cacheable(self, job_id):
+        # outputs can only be cached once the job can no longer change
+        if job_id in self._terminal_jobs:
+            return True
+        if self.cache.get(job_id, "state") is None:
+            if self.get_job_details(job_id)["state"] not in TERMINAL_STATES:
+                return False
+            self.cache.put(job_id, "state", b"terminal")
+        self._terminal_jobs.add(job_id)
+        return True
+
+    def _retrieve_output(self, job_id, artifact, url, file_obj, path=None):
+        if self.cache is None or not self._is_cacheable(job_id):
+            return self._internal_request_to_text_or_file(url, file_obj, path=path)
+        cached = self.cache.open(job_id, artifact)
+        if cached is None:
+            cached = self.cache.store(job_id, artifact, lambda f: self._internal_request_to_text_or_file(url, f))
+            if cached is None:
                 return None
-            return r.text.encode("utf-8")
-
-    def retrieve_csv(self, job_id, file_obj=None):
+        with cached:
+            if path:
+                tmp_path = path + ".part"
+                with open(tmp_path, "wb") as f:
+                    shutil.copyfileobj(cached, f, self.download_chunk_size)
+                os.replace(tmp_path, path)
+                return True
+            if file_obj:
+                shutil.copyfileobj(cached, file_obj, self.download_chunk_size)
+                return True
+            return cached.read()
+
+    def _retrieve_coded_output(self, job_id, artifact, url, file_obj, path=None):
+        # outputs of jobs run with collapse_duplicates are re-expanded to the rows of the original file
+        duplicates_path = self._duplicate_map_path(job_id, artifact)
+        if not os.path.exists(duplicates_path):
+            record = self._duplicates_record(job_id, artifact)
+            if record is None:
+                return self._retrieve_output(job_id, artifact, url, file_obj, path=path)
+            if record["builds_on"]:
+                raise Exception(
+                    "retrieve_{}: Job {} adds or deletes rows of job {}, which was run with collapse_duplicates, so its results can't be re-expanded".format(
+                        artifact, job_id, record["builds_on"]
+                    )
+                )
+            raise Exception("retrieve_{}: The duplicate map of job {} is missing from {}, so its results can't be re-expanded".format(artifact, job_id, self.duplicate_map_dir))
+        duplicates = DuplicateMap.load(duplicates_path)
+        with tempfile.TemporaryFile() as coded:
+            if not self._retrieve_output(job_id, artifact, url, coded):
+                return None
+            coded.seek(0)
+            coded_text = io.TextIOWrapper(coded, encoding="utf-8", newline="")
+            if path:
+                with io.open(path + ".part", "w", encoding="utf-8", newline="") as f:
+                    expand_results(coded_text, duplicates, f)
+                os.replace(path + ".part", path)
+                return True
+            out = file_obj if file_obj else io.BytesIO()
+            out_text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+            expand_results(coded_text, duplicates, out_text)
+            out_text.flush()
+            out_text.detach()
+            return True if file_obj else out.getvalue()
+
+    def retrieve_csv(self, job_id, file_obj=None, path=None):
         url = self.base_url + "/job/" + job_id + "/csv/"
+        return self._retrieve_coded_output(job_id, "csv", url, file_obj, path=path)
+
+    @contextlib.contextmanager
+    def _coded_reader(self, job_id, incremental, num_input_columns, has_header, separator):
+        # a CodedReader over the job's coded csv as it downloads
+        artifact = "incremental_csv" if incremental else "csv"
+        url = self.base_url + "/job/" + job_id + "/" + artifact + "/"
+        if num_input_columns is None or has_header is None:
+            survey = self.get_survey_details(self.get_job_details(job_id)["survey_id"])
+            if num_input_columns is None:
+                num_input_columns = int(survey["total_columns"])
+            if has_header is None:
+                has_header = str(survey.get("has_header")).lower() in ("true", "1")
+
+        if self.cache is not None or self._duplicates_record(job_id, artifact) is not None:
+            # cached and collapsed outputs are put together on disk first
+            with tempfile.TemporaryFile() as f:
+                if not self._retrieve_coded_output(job_id, artifact, url, f):
+                    raise Exception("iter_coded_rows: Failed to retrieve results")
+                f.seek(0)
+                yield CodedReader(io.TextIOWrapper(f, encoding="utf-8", newline=""), num_input_columns, has_header, separator)
+            return
+
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
-        return self._internal_request_to_text_or_file(url, file_obj)
-
-    def retrieve_incremental_csv(self, job_id, file_obj=None):
+        r = self._downloader().open(url, {"X-API-Authentication": self.api_key})
+        if r is None:
+            raise Exception("iter_coded_rows: Failed to retrieve results")
+        with r:
+            yield CodedReader(text_stream(r.iter_content(chunk_size=self.download_chunk_size)), num_input_columns, has_header, separator)
+
+    def iter_coded_rows(self, job_id, incremental=False, num_input_columns=None, has_header=None, separator=None):
+        # Yields the rows of the job's coded csv as CodedRow(index, values, codes) while it downloads,
+        # where codes holds ThemeCodes(base_themes, sub_themes, sentiment) for each column group.
+        # The number of columns and whether there is a header come from the survey unless given.
+        with self._coded_reader(job_id, incremental, num_input_columns, has_header, separator) as reader:
+            for row in reader:
+                yield row
+
+    def export_coded_results(self, job_id, path, format="parquet", incremental=False, num_input_columns=None, has_header=None, separator=None, batch_size=50000):
+        # writes the coded csv to a Parquet or Arrow IPC file as it downloads, returning the number of rows
+        with self._coded_reader(job_id, incremental, num_input_columns, has_header, separator) as reader:
+            return write_columnar(reader, path, format=format, batch_size=batch_size)
+
+    def retrieve_incremental_csv(self, job_id, file_obj=None, path=None):
         url = self.base_url + "/job/" + job_id + "/incremental_csv/"
-        return self._internal_request_to_text_or_file(url, file_obj)
+        return self._retrieve_coded_output(job_id, "incremental_csv", url, file_obj, path=path)
 
     def retrieve_themes(self, job_id, file_obj=None):
         url = self.base_url + "/job/" + job_id + "/themes/"
-        return self._internal_request_to_text_or_file(url, file_obj)
+        return self._retrieve_output(job_id, "themes", url, file_obj)
 
     def retrieve_stopwords(self, job_id, file_obj=None):
         url = self.base_url + "/job/" + job_id + "/stopwords/"
-        return self._internal_request_to_text_or_file(url, file_obj)
+        return self._retrieve_output(job_id, "stopwords", url, file_obj)
 
     def retrieve_concepts(self, job_id, file_obj=None):
         url = self.base_url + "/job/" + job_id + "/concepts/"
-        return self._internal_request_to_text_or_file(url, file_obj)
+        return self._retrieve_output(job_id, "concepts", url, file_obj)
 
     def retrieve_nouns(self, job_id, file_obj=None):
         url = self.base_url + "/job/" + job_id + "/nouns/"
-        return self._internal_request_to_text_or_file(url, file_obj)
+        return self._retrieve_output(job_id, "nouns", url, file_obj)
 
     def retrieve_verbs(self, job_id, file_obj=None):
         url = self.base_url + "/job/" + job_id + "/verbs/"
-        return self._internal_request_to_text_or_file(url, file_obj)
+        return self._retrieve_output(job_id, "verbs", url, file_obj)
 
     def retrieve_adjectives(self, job_id, file_obj=None):
         url = self.base_url + "/job/" + job_id + "/adjectives/"
-        return self._internal_request_to_text_or_file(url, file_obj)
+        return self._retrieve_output(job_id, "adjectives", url, file_obj)
 
-    def retrieve_artifacts(self, job_id, file_obj=None):
-        if file_obj is None:
-            raise Exception("Artifacts must be retrieved into a file object")
+    def retrieve_artifacts(self, job_id, file_obj=None, path=None):
+        if file_obj is None and path is None:
+            raise Exception("Artifacts must be retrieved into a file object or path")
         url = self.base_url + "/job/" + job_id + "/artifacts/"
-        return self._internal_request_to_text_or_file(url, file_obj)
+        return self._internal_request_to_text_or_file(url, file_obj, path=path)
 
-    def retrieve_language_model(self, job_id):
+    def retrieve_language_model(self, job_id, path=None):
         url = self.base_url + "/job/" + job_id + "/language_model/"
-        if LOG_REQUESTS:
-            log.info("Calling URL: {}".format(url))
-        r = requests.get(url, headers={"X-API-Authentication": self.api_key})
-        if r.status_code != 200:
-            return None
-        return r.content
+        return self._internal_request_to_text_or_file(url, None, path=path)
 
     def retrieve_parameters(self, job_id):
+        if self.cache is not None and self._is_cacheable(job_id):
+            cached = self.cache.get(job_id, "parameters")
+            if cached is not None:
+                return json.loads(cached.decode("utf-8"))
+            parameters = self._fetch_parameters(job_id)
+            self.cache.put(job_id, "parameters", json.dumps(parameters).encode("utf-8"))
+            return parameters
+        return self._fetch_parameters(job_id)
+
+    def _fetch_parameters(self, job_id):
         url = self.base_url + "/job/" + job_id + "/params"
         if LOG_REQUESTS:
             log.info("Calling URL: {}".format(url))
-        r = requests.get(url, headers={"X-API-Authentication": self.api_key})
+        r = self._request("GET", url, headers={"X-API-Authentication": self.api_key})
 
         try:
             response = json.loads(r.text)
@@ -533,11 +1288,110 @@ class Thematic(object):
             raise Exception("retrieve_parameters: Failed to get job parameters (" + response["error"]["message"] + ")")
         return response["data"]
 
-    def discover_new_themes(self, job_id, csv_filename, themes_filename=None):
+    def _retrieve_bundle_output(self, job_id, output, path):
+        # True if the output was saved to path. An output that fails is left out rather than
+        # failing the whole bundle, whether its retrieve method returned nothing or raised.
+        try:
+            if output in ("csv", "incremental_csv", "artifacts", "language_model"):
+                ok = getattr(self, "retrieve_" + output)(job_id, path=path)
+            elif output == "parameters":
+                parameters = self.retrieve_parameters(job_id)
+                ok = parameters is not None
+                if ok:
+                    with open(path, "w") as f:
+                        json.dump(parameters, f, indent=2, sort_keys=True)
+            else:
+                with open(path, "wb") as f:
+                    ok = getattr(self, "retrieve_" + output)(job_id, file_obj=f)
+        except Exception as e:
+            log.error("Failed to retrieve the {} output of job {}: {}".format(output, job_id, e))
+            ok = False
+        if not ok and os.path.exists(path):
+            os.remove(path)
+        return bool(ok)
+
+    def retrieve_bundle(self, job_ids, dest, outputs=None, max_workers=8):
+        # Fetches the outputs of one or more jobs concurrently, at most max_workers requests at a
+        # time across all jobs, into a directory or, if dest ends in .zip, a zip archive. With a
+        # list of jobs each gets a sub directory named after its id. Nothing is written to dest
+        # until every output has been fetched. Outputs a job doesn't have, or that fail to download,
+        # are left out.
+        # Returns {job id: {output: file name within the job's bundle}}.
+        single = isinstance(job_ids, str)
+        if single:
+            job_ids = [job_ids]
+        outputs = outputs or [name for name, filename in BUNDLE_FILES]
+        filenames = {output: bundle_filename(output) for output in outputs}
+        parent = os.path.dirname(os.path.abspath(dest))
+        if not os.path.isdir(parent):
+            os.makedirs(parent, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".bundle-")
+        try:
+            tasks = []
+            for job_id in job_ids:
+                job_dir = tmp_dir if single else os.path.join(tmp_dir, job_id)
+                if not os.path.isdir(job_dir):
+                    os.makedirs(job_dir)
+                for output in outputs:
+                    tasks.append((job_id, output, os.path.join(job_dir, filenames[output])))
+            manifest = {job_id: {} for job_id in job_ids}
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [(task, executor.submit(self._retrieve_bundle_output, *task)) for task in tasks]
+                for (job_id, output, path), future in futures:
+                    if future.result():
+                        manifest[job_id][output] = filenames[output]
+                    else:
+                        log.warning("Job {} has no {} output, or it failed to download, leaving it out of the bundle".format(job_id, output))
+            if dest.lower().endswith(".zip"):
+                publish_zip(tmp_dir, dest)
+            else:
+                publish_directory(tmp_dir, dest)
+            log.info("Saved {} outputs of {} jobs to {}".format(sum(len(files) for files in manifest.values()), len(job_ids), dest))
+            return manifest
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _sample(self, csv_filename, sample_size, has_header, seed, stratify_column, collapse_duplicates):
+        # samples are kept in sample_dir by the content of the file and the settings, so sampling
+        # the same file again is free
+        path = sample_path(
+            self.sample_dir, self._file_digest(csv_filename), sample_size, has_header, seed, stratify_column, collapse_duplicates
+        )
+        if os.path.exists(path):
+            return path
+        if not os.path.isdir(self.sample_dir):
+            os.makedirs(self.sample_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.sample_dir, prefix=".tmp-", suffix=".csv")
+        try:
+            with io.open(fd, "w", encoding="utf-8", newline="") as f:
+                num_rows, num_sampled = sample_csv(
+                    csv_filename, f, sample_size, has_header=has_header, seed=seed, stratify_column=stratify_column, collapse_duplicates=collapse_duplicates
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        log.info("Sampled {} rows out of {}".format(num_sampled, num_rows))
+        return path
+
+    def discover_new_themes(
+        self, job_id, csv_filename, themes_filename=None, sample_size=None, seed=0, stratify_column=None, collapse_duplicates=False, has_header=None
+    ):
+        # With sample_size, only a random sample of that many rows is uploaded, stratified by the
+        # values of stratify_column if given and drawn from distinct rows with collapse_duplicates
+        # (see sampling.sample_csv). has_header is looked up from the job's survey if not given.
+        if sample_size:
+            if has_header is None:
+                survey_id = self.get_job_details(job_id).get("survey_id")
+                has_header = self._survey_has_header(survey_id) if survey_id else False
+            csv_filename = self._sample(csv_filename, sample_size, has_header, seed, stratify_column, collapse_duplicates)
         payload = {"job_id": job_id}
-        files = {"csv_file": open(csv_filename, "rb")}
-        if themes_filename:
-            files["themes_file"] = open(themes_filename, "rb")
-
-        response = self._run_post_request_with_json_response(self.base_url + "/helpers/discoverThemes", files, payload)
+        with open(csv_filename, "rb") as csv_file_obj:
+            files = {"csv_file": csv_file_obj}
+            if themes_filename:
+                with open(themes_filename, "rb") as themes_file_obj:
+                    files["themes_file"] = themes_file_obj
+                    response = self._run_post_request_with_json_response(self.base_url + "/helpers/discoverThemes", files, payload)
+            else:
+                response = self._run_post_request_with_json_response(self.base_url + "/helpers/discoverThemes", files, payload)
         return response["data"]
@@ -0,0 +1,285 @@
+import io
+import os
+import sys
+import json
+import mmap
+import array
+import struct
+import threading
+
+_MAGIC = b"THEMEIDX1\n"
+_NAN = float("nan")
+
+# the positions of the set bits of every byte value, for turning bitmaps back into row numbers
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def _popcount(value):
+    try:
+        return value.bit_count()
+    except AttributeError:  # pragma: no cover - python < 3.10
+        return bin(value).count("1")
+
+
+def _bitmap(rows, num_rows):
+    bits = bytearray((num_rows + 7) // 8)
+    for row in rows:
+        bits[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(bytes(bits), "little")
+
+
+def _bitmap_rows(bitmap, num_rows):
+    rows = array.array("I")
+    data = bitmap.to_bytes((num_rows + 7) // 8, "little")
+    for offset, value in enumerate(data):
+        if value:
+            base = offset << 3
+            rows.extend(base + bit for bit in _BYTE_BITS[value])
+    return rows
+
+
+def parse_themes(themes):
+    # the titles of all themes and the base theme of each sub theme, from a job's themes json
+    if isinstance(themes, (bytes, str)):
+        themes = json.loads(themes)
+    titles = dict(themes.get("titles") or {})
+    parents = {}
+    for key, group in themes.items():
+        if not key.startswith("themes") or not isinstance(group, dict):
+            continue
+        for theme_id, info in group.items():
+            if isinstance(info, dict) and info.get("sub_themes") is not None:
+                for sub_theme_id in info["sub_themes"]:
+                    parents[sub_theme_id] = theme_id
+    return titles, parents
+
+
+class ThemeIndex(object):
+    # Which rows of a job's coded csv have each theme and sub theme, for answering counts,
+    # co-occurrence and row lookups without going back to the csv.
+    #
+    # Each theme keeps a sorted array of the rows that have it (in any column group). Queries that
+    # combine themes turn those into bitmaps held as Python ints, so that intersections and counts
+    # are single big-integer operations; bitmaps are made on first use and kept. The index can be
+    # saved to a single file and loaded back with the row arrays memory mapped, so loading is
+    # instant whatever the size of the survey.
+    def __init__(self, num_rows, postings, titles=None, parents=None, sentiment=None, job_id=None):
+        self.num_rows = num_rows
+        self.job_id = job_id
+        self.titles = titles or {}
+        self.parents = parents or {}
+        # theme id -> sorted row numbers, as an array or a memoryview of a mapped file
+        self._postings = postings
+        # per row sentiment (the mean over column groups), NaN where there is none
+        self._sentiment = sentiment
+        self._bitmaps = {}
+        self._lock = threading.Lock()
+        self._mmap = None
+
+    @classmethod
+    def build(cls, themes, rows, job_id=None):
+        # themes is the themes json (parsed or not), rows an iterable of CodedRow, e.g. from iter_coded_rows
+        titles, parents = parse_themes(themes)
+        postings = {}
+        sentiment = array.array("f")
+        num_rows = 0
+        for row in rows:
+            seen = set()
+            scores = []
+            for codes in row.codes:
+                seen.update(codes.base_themes)
+                seen.update(codes.sub_themes)
+                if codes.sentiment is not None:
+                    scores.append(codes.sentiment)
+            for theme_id in seen:
+                rows_with_theme = postings.get(theme_id)
+                if rows_with_theme is None:
+                    rows_with_theme = postings[theme_id] = array.array("I")
+                rows_with_theme.append(row.index)
+            # rows can come with gaps in their numbering, which are left without themes or sentiment
+            while len(sentiment) < row.index:
+                sentiment.append(_NAN)
+            sentiment.append(sum(scores) / len(scores) if scores else _NAN)
+            num_rows = max(num_rows, row.index + 1)
+        return cls(num_rows, postings, titles=titles, parents=parents, sentiment=sentiment, job_id=job_id)
+
+    @classmethod
+    def from_job(cls, client, job_id, incremental=False, **kwargs):
+        # kwargs are passed on to iter_coded_rows
+        themes = client.retrieve_themes(job_id)
+        if not themes:
+            raise Exception("ThemeIndex: Failed to retrieve themes for job {}".format(job_id))
+        return cls.build(themes, client.iter_coded_rows(job_id, incremental=incremental, **kwargs), job_id=job_id)
+
+    def __getstate__(self):
+        # mapped files can't be pickled, the arrays are copied instead
+        state = self.__dict__.copy()
+        state["_postings"] = {theme_id: array.array("I", rows) for theme_id, rows in self._postings.items()}
+        state["_sentiment"] = array.array("f", self._sentiment) if self._sentiment is not None else None
+        state["_bitmaps"] = {}
+        state["_mmap"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def theme_ids(self):
+        return sorted(self._postings)
+
+    def title(self, theme_id):
+        return self.titles.get(theme_id, theme_id)
+
+    def base_theme(self, theme_id):
+        return self.parents.get(theme_id)
+
+    def sub_themes(self, theme_id):
+        return sorted(sub_theme_id for sub_theme_id, parent in self.parents.items() if parent == theme_id)
+
+    def rows(self, theme_id):
+        # the sorted row numbers with the theme
+        return self._postings.get(theme_id, array.array("I"))
+
+    def bitmap(self, theme_id):
+        bitmap = self._bitmaps.get(theme_id)
+        if bitmap is None:
+            bitmap = _bitmap(self.rows(theme_id), self.num_rows)
+            with self._lock:
+                self._bitmaps[theme_id] = bitmap
+        return bitmap
+
+    def _match(self, all_of=(), any_of=(), none_of=()):
+        if isinstance(all_of, str):
+            all_of = [all_of]
+        if isinstance(any_of, str):
+            any_of = [any_of]
+        if isinstance(none_of, str):
+            none_of = [none_of]
+        bitmap = (1 << self.num_rows) - 1
+        for theme_id in all_of:
+            bitmap &= self.bitmap(theme_id)
+        if any_of:
+            union = 0
+            for theme_id in any_of:
+                union |= self.bitmap(theme_id)
+            bitmap &= union
+        for theme_id in none_of:
+            bitmap &= ~self.bitmap(theme_id)
+        return bitmap
+
+    def count(self, all_of=(), any_of=(), none_of=()):
+        # the number of rows with all of all_of, at least one of any_of and none of none_of
+        if isinstance(all_of, str) and not any_of and not none_of:
+            return len(self.rows(all_of))
+        return _popcount(self._match(all_of, any_of, none_of))
+
+    def find(self, all_of=(), any_of=(), none_of=()):
+        # the row numbers matching the same filters as count
+        if isinstance(all_of, str) and not any_of and not none_of:
+            return self.rows(all_of)
+        return _bitmap_rows(self._match(all_of, any_of, none_of), self.num_rows)
+
+    def counts(self):
+        return {theme_id: len(rows) for theme_id, rows in self._postings.items()}
+
+    def cooccurrence(self, theme_ids=None):
+        # (theme_ids, matrix) where matrix[i][j] is the number of rows with both theme i and theme j
+        theme_ids = list(theme_ids) if theme_ids is not None else self.theme_ids
+        bitmaps = [self.bitmap(theme_id) for theme_id in theme_ids]
+        matrix = [[0] * len(theme_ids) for _ in theme_ids]
+        for i, a in enumerate(bitmaps):
+            matrix[i][i] = len(self.rows(theme_ids[i]))
+            for j in range(i + 1, len(bitmaps)):
+                matrix[i][j] = matrix[j][i] = _popcount(a & bitmaps[j])
+        return theme_ids, matrix
+
+    def sentiment(self, row):
+        if self._sentiment is None or row >= len(self._sentiment):
+            return None
+        value = self._sentiment[row]
+        return None if value != value else value
+
+    def mean_sentiment(self, all_of=(), any_of=(), none_of=()):
+        if self._sentiment is None:
+            return None
+        total = 0.0
+        num_scores = 0
+        for row in self.find(all_of, any_of, none_of):
+            value = self._sentiment[row] if row < len(self._sentiment) else _NAN
+            if value == value:
+                total += value
+                num_scores += 1
+        return total / num_scores if num_scores else None
+
+    def save(self, path):
+        # one file: a json header followed by the row arrays and the sentiment array, little endian
+        theme_ids = self.theme_ids
+        offsets = []
+        position = 0
+        for theme_id in theme_ids:
+            offsets.append([position, len(self._postings[theme_id])])
+            position += len(self._postings[theme_id])
+        header = {
+            "num_rows": self.num_rows,
+            "job_id": self.job_id,
+            "titles": self.titles,
+            "parents": self.parents,
+            "themes": theme_ids,
+            "offsets": offsets,
+            "num_postings": position,
+            "num_sentiment": len(self._sentiment) if self._sentiment is not None else None,
+        }
+        header_bytes = json.dumps(header).encode("utf-8")
+        # pad so the arrays start 8-byte aligned
+        header_bytes += b" " * (-(len(_MAGIC) + 8 + len(header_bytes)) % 8)
+        with io.open(path + ".tmp", "wb") as f:
+            f.write(_MAGIC)
+            f.write(struct.pack("<Q", len(header_bytes)))
+            f.write(header_bytes)
+            for theme_id in theme_ids:
+                rows = array.array("I", self._postings[theme_id])
+                if sys.byteorder != "little":
+                    rows.byteswap()
+                f.write(rows.tobytes())
+            if self._sentiment is not None:
+                sentiment = array.array("f", self._sentiment)
+                if sys.byteorder != "little":
+                    sentiment.byteswap()
+                f.write(sentiment.tobytes())
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path, use_mmap=True):
+        with io.open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise Exception("ThemeIndex: {} is not a theme index".format(path))
+            header_size = struct.unpack("<Q", f.read(8))[0]
+            header = json.loads(f.read(header_size).decode("utf-8"))
+            start = len(_MAGIC) + 8 + header_size
+            if use_mmap and sys.byteorder == "little":
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(data)
+                postings_view = view[start : start + 4 * header["num_postings"]].cast("I")
+                sentiment_start = start + 4 * header["num_postings"]
+                sentiment = None
+                if header["num_sentiment"] is not None:
+                    sentiment = view[sentiment_start : sentiment_start + 4 * header["num_sentiment"]].cast("f")
+            else:
+                data = None
+                f.seek(start)
+                postings_view = array.array("I")
+                postings_view.fromfile(f, header["num_postings"])
+                sentiment = None
+                if header["num_sentiment"] is not None:
+                    sentiment = array.array("f")
+                    sentiment.fromfile(f, header["num_sentiment"])
+                if sys.byteorder != "little":
+                    postings_view.byteswap()
+                    if sentiment is not None:
+                        sentiment.byteswap()
+        postings = {theme_id: postings_view[offset : offset + length] for theme_id, (offset, length) in zip(header["themes"], header["offsets"])}
+        index = cls(header["num_rows"], postings, titles=header["titles"], parents=header["parents"], sentiment=sentiment, job_id=header["job_id"])
+        index._mmap = data
+        return index
@@ -0,0 +1,150 @@
+import io
+import os
+import time
+import uuid
+import zlib
+
+
+def _quote(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _file_name(key, file_obj):
+    # same rule as requests: use the file's base name if it has a real one, otherwise the field name
+    name = getattr(file_obj, "name", None)
+    if isinstance(name, str) and name and name[0] != "<" and name[-1] != ">":
+        return os.path.basename(name)
+    return key
+
+
+def _remaining_size(file_obj):
+    try:
+        return os.fstat(file_obj.fileno()).st_size - file_obj.tell()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        pass
+    try:
+        position = file_obj.tell()
+        end = file_obj.seek(0, os.SEEK_END)
+        file_obj.seek(position)
+        return end - position
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+class MultipartStream(object):
+    # A multipart/form-data body that is produced while it is being sent, so uploads use a constant
+    # amount of memory whatever the size of the files. Optionally gzips the whole body on the fly
+    # (sent with Content-Encoding: gzip), and reports progress as the files are read.
+    def __init__(self, fields, files, chunk_size=1024 * 1024, compress=False, progress=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary=" + self.boundary
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.progress = progress
+        self._parts = []
+        for key, values in (fields or {}).items():
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            for value in values:
+                if value is None:
+                    continue
+                if not isinstance(value, bytes):
+                    value = str(value).encode("utf-8")
+                header = self._part_header('form-data; name="{}"'.format(_quote(key)))
+                self._parts.append((header, value))
+        for key, file_obj in (files or {}).items():
+            header = self._part_header('form-data; name="{}"; filename="{}"'.format(_quote(key), _quote(_file_name(key, file_obj))))
+            self._parts.append((header, file_obj))
+        self._footer = "--{}--\r\n".format(self.boundary).encode("ascii")
+        self._start_positions = {}
+        for header, value in self._parts:
+            if not isinstance(value, bytes):
+                try:
+                    self._start_positions[id(value)] = value.tell()
+                except (AttributeError, OSError, io.UnsupportedOperation):
+                    pass
+        self.total_bytes = self._raw_length()
+        self.reset()
+
+    def _part_header(self, disposition):
+        return "--{}\r\nContent-Disposition: {}\r\n\r\n".format(self.boundary, disposition).encode("utf-8")
+
+    def _raw_length(self):
+        total = len(self._footer)
+        for header, value in self._parts:
+            size = len(value) if isinstance(value, bytes) else _remaining_size(value)
+            if size is None:
+                return None
+            total += len(header) + size + 2
+        return total
+
+    @property
+    def len(self):
+        # requests sends Content-Length when this is known, and chunked encoding otherwise
+        if self.compress:
+            return None
+        return self.total_bytes
+
+    def reset(self):
+        # rewinds the body so that the same upload can be sent again, e.g. when a request is retried
+        for header, value in self._parts:
+            if id(value) in self._start_positions:
+                value.seek(self._start_positions[id(value)])
+        # bytes_read counts the files and fields read so far, bytes_sent the (possibly compressed) body handed out
+        self.bytes_read = 0
+        self.bytes_sent = 0
+        self._start_time = None
+        self._buffer = bytearray()
+        self._chunks = self._generate()
+
+    def _raw_chunks(self):
+        for header, value in self._parts:
+            yield header
+            if isinstance(value, bytes):
+                yield value
+            else:
+                while True:
+                    chunk = value.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    if not isinstance(chunk, bytes):
+                        chunk = chunk.encode("utf-8")
+                    yield chunk
+            yield b"\r\n"
+        yield self._footer
+
+    def _generate(self):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if self.compress else None
+        for chunk in self._raw_chunks():
+            if self._start_time is None:
+                self._start_time = time.time()
+            self.bytes_read += len(chunk)
+            if self.progress:
+                self.progress(self.bytes_read, self.total_bytes, time.time() - self._start_time)
+            if compressor:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+        if compressor:
+            yield compressor.flush()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.bytes_sent += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk